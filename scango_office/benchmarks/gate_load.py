@@ -0,0 +1,331 @@
+# Load test: many gates scanning at the same time against a running site
+#
+# สร้างข้อมูลจำลอง (Building / Building Gate / Machine Gate / Visitor Register ที่ขึ้นต้นด้วย BENCH)
+# แล้วให้แต่ละ thread ทำหน้าที่เป็นประตูหนึ่งบาน ยิง HTTP ไปยัง
+#   process_gate_scan  - เครื่อง In / Out
+#   check_qr_status    - เครื่อง CheckStatus
+#   /qr_scanner        - หน้า QR Scanner (GET)
+# แล้วรายงาน throughput และ latency p50 / p95 / p99 ต่อ endpoint
+#
+#   bench --site <site> execute scango_office.benchmarks.gate_load.run \
+#       --kwargs "{'gates': 20, 'scans_per_gate': 500, 'visitors': 20000}"
+#
+# ใช้ output / baseline เพื่อเก็บผลเป็น JSON และเทียบกับรอบก่อนหน้า (เช่นก่อนขึ้น production)
+#
+#   ... run --kwargs "{'output': '/tmp/gate_load.json'}"
+#   ... run --kwargs "{'baseline': '/tmp/gate_load.json', 'tolerance': 0.2}"
+#
+# ลบข้อมูลจำลองทั้งหมดด้วย
+#   bench --site <site> execute scango_office.benchmarks.gate_load.cleanup
+
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import frappe
+from frappe.utils import add_days, cint, flt, get_url, now_datetime, today
+
+from scango_office.scango.qr_payload import is_signed_qr_enabled, make_qr_payload
+
+BENCH_PREFIX = "BENCH"
+BENCH_USER = "scango-bench@example.com"
+SEED_CHUNK_SIZE = 1000
+REQUEST_TIMEOUT = 30
+
+VISITOR_REGISTER_API = "/api/method/scango_office.scango.doctype.visitor_register.visitor_register"
+SCENARIOS = {
+    "process_gate_scan": ("POST", f"{VISITOR_REGISTER_API}.process_gate_scan"),
+    "check_qr_status": ("POST", f"{VISITOR_REGISTER_API}.check_qr_status"),
+    "qr_scanner": ("GET", "/qr_scanner"),
+}
+
+# บทบาทของเครื่องจำลอง วนตามลำดับนี้ (ไม่มี Checkout เพราะจะทำให้ QR ของ visitor ใช้ไม่ได้)
+MACHINE_ROLES = ["In", "Out", "CheckStatus"]
+
+
+def run(gates=10, scans_per_gate=200, visitors=5000, buildings=2, site_url=None,
+        scenarios=None, output=None, baseline=None, tolerance=0.2, reseed=False):
+    """Seed synthetic data (if needed) and drive the gate endpoints from N concurrent gates"""
+    gates, scans_per_gate, visitors = cint(gates), cint(scans_per_gate), cint(visitors)
+    scenarios = [s.strip() for s in (scenarios or ",".join(SCENARIOS)).split(",") if s.strip()]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            frappe.throw(f"Unknown scenario: {scenario}")
+
+    if cint(reseed):
+        cleanup()
+    machines = seed(gates=gates, visitors=visitors, buildings=cint(buildings))
+    qr_contents = get_bench_qr_contents()
+    authorization = get_bench_authorization()
+    site_url = (site_url or get_url()).rstrip("/")
+
+    # คืน connection ของ process นี้ก่อนเริ่ม thread (แต่ละ request ใช้ worker ของ site เอง)
+    frappe.db.commit()
+
+    print(f"== {len(machines)} gates x {scans_per_gate} scans, {len(qr_contents):,} visitors -> {site_url}")
+    started = threading.Barrier(len(machines))
+    with ThreadPoolExecutor(max_workers=len(machines)) as pool:
+        futures = [
+            pool.submit(drive_gate, site_url, authorization, machine, qr_contents, scenarios, scans_per_gate, started)
+            for machine in machines
+        ]
+        results = [future.result() for future in futures]
+
+    report = summarize(results)
+    print_report(report)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=1)
+    if baseline:
+        compare(report, baseline, flt(tolerance))
+
+    return report
+
+
+def seed(gates, visitors, buildings=2):
+    """Create the BENCH topology and visitors, return the bench Machine Gate names"""
+    buildings = max(buildings, 1)
+    building_names = []
+    for i in range(buildings):
+        code = f"{BENCH_PREFIX}-B{i:02d}"
+        name = frappe.db.get_value("Building", {"building_code": code})
+        if not name:
+            name = frappe.get_doc({
+                "doctype": "Building",
+                "building_code": code,
+                "building_name": f"Bench Building {i}",
+            }).insert(ignore_permissions=True).name
+        building_names.append(name)
+
+    machines = []
+    for i in range(gates):
+        gate_code = f"{BENCH_PREFIX}-G{i:03d}"
+        if not frappe.db.exists("Building Gate", gate_code):
+            frappe.get_doc({
+                "doctype": "Building Gate",
+                "gate_code": gate_code,
+                "gate_name": f"Bench Gate {i}",
+                "building": building_names[i % buildings],
+            }).insert(ignore_permissions=True)
+
+        machine_id = f"{BENCH_PREFIX}-M{i:03d}"
+        if not frappe.db.exists("Machine Gate", machine_id):
+            frappe.get_doc({
+                "doctype": "Machine Gate",
+                "machine_id": machine_id,
+                "building_gate": gate_code,
+                "use_for": MACHINE_ROLES[i % len(MACHINE_ROLES)],
+            }).insert(ignore_permissions=True)
+        machines.append(frappe._dict(name=machine_id, use_for=MACHINE_ROLES[i % len(MACHINE_ROLES)]))
+
+    seed_visitors(visitors)
+    frappe.db.commit()
+    return machines
+
+
+def seed_visitors(count):
+    existing = frappe.db.count("Visitor Register", {"name": ("like", f"{BENCH_PREFIX}-REG-%")})
+    if existing >= count:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    visit_date = add_days(today(), -1)
+    visit_end_date = add_days(today(), 30)
+    fields = ["name", "owner", "modified_by", "creation", "modified", "docstatus",
+              "title", "first_name", "last_name", "gender", "nationality", "id_type", "passport_number",
+              "birth_date", "age", "visit_date", "visit_end_date", "total_days", "purpose",
+              "person_to_meet", "visitor_photo", "terms_accepted", "security_guard"]
+
+    # Visitor Register ไม่ได้ถูกบันทึกผ่าน ORM จึงไม่มีการสร้างรูป QR (ไม่จำเป็นสำหรับการยิงโหลด)
+    for start in range(existing, count, SEED_CHUNK_SIZE):
+        values = []
+        for i in range(start, min(start + SEED_CHUNK_SIZE, count)):
+            values.append([
+                f"{BENCH_PREFIX}-REG-{i:07d}", user, user, now, now, 0,
+                "Mr.", "Bench", f"Visitor {i}", "อื่นๆ", "จีน", "เลขหนังสือเดินทาง", f"BENCH{i:07d}",
+                "1990-01-01", 36, visit_date, visit_end_date, 32, "อื่นๆ",
+                "Bench", "/files/bench-visitor.png", 1, user,
+            ])
+        frappe.db.bulk_insert("Visitor Register", fields, values)
+        frappe.db.commit()
+
+
+def get_bench_qr_contents():
+    """The content each bench visitor's QR would carry (signed payload when enabled)"""
+    visitors = frappe.get_all("Visitor Register",
+        filters={"name": ("like", f"{BENCH_PREFIX}-REG-%")},
+        fields=["name", "visit_date", "visit_end_date"],
+        order_by="name asc"
+    )
+    if not is_signed_qr_enabled():
+        return [v.name for v in visitors]
+    return [make_qr_payload(v.name, v.visit_date, v.visit_end_date) for v in visitors]
+
+
+def get_bench_authorization():
+    """Token header of a dedicated System Manager user (keeps Administrator's keys untouched)"""
+    if not frappe.db.exists("User", BENCH_USER):
+        frappe.get_doc({
+            "doctype": "User",
+            "email": BENCH_USER,
+            "first_name": "ScanGo Bench",
+            "send_welcome_email": 0,
+            "roles": [{"role": "System Manager"}],
+        }).insert(ignore_permissions=True)
+
+    user = frappe.get_doc("User", BENCH_USER)
+    if not user.api_key:
+        user.api_key = frappe.generate_hash(length=15)
+    api_secret = frappe.generate_hash(length=15)
+    user.api_secret = api_secret
+    user.save(ignore_permissions=True)
+    frappe.db.commit()
+    return f"token {user.api_key}:{api_secret}"
+
+
+def drive_gate(site_url, authorization, machine, qr_contents, scenarios, scans, started):
+    """One simulated gate: scan random visitors back to back, return latencies per scenario"""
+    import requests
+
+    # เครื่อง CheckStatus เรียก check_qr_status แทน process_gate_scan
+    gate_scenarios = [
+        s for s in scenarios
+        if not (s == "process_gate_scan" and machine.use_for == "CheckStatus")
+        and not (s == "check_qr_status" and machine.use_for != "CheckStatus")
+    ] or scenarios
+
+    session = requests.Session()
+    session.headers.update({"Authorization": authorization, "Accept": "application/json"})
+    rng = random.Random(machine.name)
+    result = {"latencies": {}, "errors": {}, "started": None, "finished": None}
+
+    started.wait()
+    result["started"] = time.perf_counter()
+    for i in range(scans):
+        scenario = gate_scenarios[i % len(gate_scenarios)]
+        method, path = SCENARIOS[scenario]
+        qr_content = rng.choice(qr_contents)
+
+        if scenario == "process_gate_scan":
+            kwargs = {"data": {"visitor_id": qr_content, "gate_machine": machine.name}}
+        elif scenario == "check_qr_status":
+            kwargs = {"data": {"visitor_id": qr_content}}
+        else:
+            kwargs = {"params": {"id": qr_content, "machine": machine.name}}
+
+        request_started = time.perf_counter()
+        try:
+            response = session.request(method, site_url + path, timeout=REQUEST_TIMEOUT, **kwargs)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - request_started) * 1000
+
+        result["latencies"].setdefault(scenario, []).append(elapsed)
+        if not ok:
+            result["errors"][scenario] = result["errors"].get(scenario, 0) + 1
+    result["finished"] = time.perf_counter()
+
+    return result
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(results):
+    wall = max(r["finished"] for r in results) - min(r["started"] for r in results)
+
+    latencies = {}
+    errors = {}
+    for r in results:
+        for scenario, values in r["latencies"].items():
+            latencies.setdefault(scenario, []).extend(values)
+        for scenario, count in r["errors"].items():
+            errors[scenario] = errors.get(scenario, 0) + count
+    latencies["total"] = [value for values in latencies.values() for value in values]
+    errors["total"] = sum(errors.values())
+
+    report = {"gates": len(results), "seconds": round(wall, 3), "scenarios": {}}
+    for scenario, values in latencies.items():
+        values.sort()
+        report["scenarios"][scenario] = {
+            "requests": len(values),
+            "errors": errors.get(scenario, 0),
+            "throughput": round(len(values) / wall, 2) if wall else 0,
+            "p50": round(percentile(values, 50), 2),
+            "p95": round(percentile(values, 95), 2),
+            "p99": round(percentile(values, 99), 2),
+            "max": round(values[-1], 2) if values else 0,
+        }
+    return report
+
+
+def print_report(report):
+    print(f"== {report['gates']} gates, {report['seconds']} s")
+    print(f"{'scenario':<20} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for scenario, row in report["scenarios"].items():
+        print(f"{scenario:<20} {row['requests']:>9} {row['errors']:>7} {row['throughput']:>9.2f} "
+              f"{row['p50']:>9.2f} {row['p95']:>9.2f} {row['p99']:>9.2f} {row['max']:>9.2f}")
+
+
+def compare(report, baseline, tolerance=0.2):
+    """Print scenarios whose p95 / p99 got worse than the baseline run by more than tolerance"""
+    with open(baseline) as f:
+        previous = json.load(f)
+
+    regressions = []
+    for scenario, row in report["scenarios"].items():
+        before = previous.get("scenarios", {}).get(scenario)
+        if not before:
+            continue
+        for metric in ("p95", "p99"):
+            if before[metric] and row[metric] > before[metric] * (1 + tolerance):
+                regressions.append(f"{scenario} {metric}: {before[metric]:.2f} -> {row[metric]:.2f} ms")
+        if before["throughput"] and row["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(f"{scenario} throughput: {before['throughput']:.2f} -> {row['throughput']:.2f} req/s")
+
+    if regressions:
+        print("== REGRESSION")
+        for line in regressions:
+            print(f"   {line}")
+    else:
+        print(f"== no regression against {baseline} (tolerance {tolerance:.0%})")
+    return regressions
+
+
+def cleanup():
+    """Delete all BENCH data created by this benchmark"""
+    machines = frappe.get_all("Machine Gate", filters={"name": ("like", f"{BENCH_PREFIX}-M%")}, pluck="name")
+    visitor_filter = {"visitor_register": ("like", f"{BENCH_PREFIX}-REG-%")}
+
+    frappe.db.delete("Visitor Gate Pass", visitor_filter)
+    frappe.db.delete("Visitor Presence", visitor_filter)
+    if machines:
+        frappe.db.delete("Gate Traffic Rollup", {"gate_machine": ("in", machines)})
+    frappe.db.delete("Visitor Register", {"name": ("like", f"{BENCH_PREFIX}-REG-%")})
+
+    for name in machines:
+        frappe.delete_doc("Machine Gate", name, ignore_permissions=True, force=True)
+    for name in frappe.get_all("Building Gate", filters={"name": ("like", f"{BENCH_PREFIX}-G%")}, pluck="name"):
+        frappe.delete_doc("Building Gate", name, ignore_permissions=True, force=True)
+    for name in frappe.get_all("Building", filters={"building_code": ("like", f"{BENCH_PREFIX}-B%")}, pluck="name"):
+        frappe.delete_doc("Building", name, ignore_permissions=True, force=True)
+
+    frappe.db.commit()
+
+    # ตัวนับและ cache ที่อาจมีข้อมูล BENCH ค้างอยู่
+    from scango_office.scango.occupancy import reconcile_occupancy
+    from scango_office.scango.revoked_qr import rebuild_revoked_qr_cache
+
+    reconcile_occupancy()
+    rebuild_revoked_qr_cache()
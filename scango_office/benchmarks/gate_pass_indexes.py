@@ -0,0 +1,119 @@
+# Benchmark: query plans of the Visitor Gate Pass hot queries before / after composite indexes
+#
+# ใช้ตารางสำเนา (CREATE TABLE ... LIKE) จึงไม่แตะข้อมูลจริงของ site
+#
+#   bench --site <site> execute scango_office.benchmarks.gate_pass_indexes.run --kwargs "{'rows': 2000000}"
+
+import random
+import time
+from datetime import datetime, timedelta
+
+import frappe
+
+from scango_office.scango.doctype.visitor_gate_pass.visitor_gate_pass import GATE_PASS_INDEXES
+
+BENCH_TABLE = "tabVisitor Gate Pass Index Bench"
+SEED_CHUNK_SIZE = 10000
+ACTIONS = ["In", "Out", "In", "Out", "CheckStatus", "Checkout"]
+
+HOT_QUERIES = {
+    "checkout_lookup": (
+        "select name, scan_datetime from `{table}` "
+        "where visitor_register = %(visitor)s and action_type = 'Checkout' "
+        "order by scan_datetime asc limit 1"
+    ),
+    "history_page": (
+        "select name, action_type, scan_datetime from `{table}` "
+        "where visitor_register = %(visitor)s "
+        "order by scan_datetime desc, name desc limit 50"
+    ),
+    "revoked_rebuild": (
+        "select distinct visitor_register from `{table}` where action_type = 'Checkout'"
+    ),
+}
+
+
+def run(rows=2000000, visitors=50000, repeat=20):
+    """Seed a scratch copy of Visitor Gate Pass and print EXPLAIN + timings without / with indexes"""
+    rows, visitors, repeat = int(rows), int(visitors), int(repeat)
+
+    create_bench_table()
+    try:
+        seed(rows, visitors)
+        frappe.db.sql(f"analyze table `{BENCH_TABLE}`")
+
+        print(f"== {rows:,} rows, {visitors:,} visitors: without composite indexes")
+        before = report(visitors, repeat)
+
+        for index_name, fields in GATE_PASS_INDEXES.items():
+            columns = ", ".join(f"`{field}`" for field in fields)
+            frappe.db.sql_ddl(f"alter table `{BENCH_TABLE}` add index `{index_name}` ({columns})")
+        frappe.db.sql(f"analyze table `{BENCH_TABLE}`")
+
+        print(f"== {rows:,} rows, {visitors:,} visitors: with composite indexes")
+        after = report(visitors, repeat)
+
+        print("== summary (avg ms)")
+        for name in HOT_QUERIES:
+            print(f"{name:<20} {before[name]:>10.2f} -> {after[name]:>10.2f}")
+    finally:
+        frappe.db.sql_ddl(f"drop table if exists `{BENCH_TABLE}`")
+
+
+def create_bench_table():
+    frappe.db.sql_ddl(f"drop table if exists `{BENCH_TABLE}`")
+    frappe.db.sql_ddl(f"create table `{BENCH_TABLE}` like `tabVisitor Gate Pass`")
+
+    # เริ่มจากสภาพเดิม: มีเฉพาะ search_index แบบคอลัมน์เดียว
+    existing = {row.Key_name for row in frappe.db.sql(f"show index from `{BENCH_TABLE}`", as_dict=True)}
+    for index_name in GATE_PASS_INDEXES:
+        if index_name in existing:
+            frappe.db.sql_ddl(f"alter table `{BENCH_TABLE}` drop index `{index_name}`")
+
+
+def seed(rows, visitors):
+    start = datetime.now() - timedelta(days=365)
+    now = datetime.now()
+    fields = ["name", "creation", "modified", "owner", "modified_by", "docstatus", "visitor_register",
+              "visitor_name", "visitor_last_name", "gate_machine", "building_gate", "building_name",
+              "action_type", "scan_datetime"]
+    columns = ", ".join(f"`{field}`" for field in fields)
+    placeholders = ", ".join(["%s"] * len(fields))
+
+    for offset in range(0, rows, SEED_CHUNK_SIZE):
+        values = []
+        for i in range(offset, min(offset + SEED_CHUNK_SIZE, rows)):
+            scan_datetime = start + timedelta(seconds=random.randint(0, 365 * 86400))
+            values.append((
+                f"BENCH-{i:09d}", now, now, "Administrator", "Administrator", 0,
+                f"BENCH-REG-{random.randrange(visitors):07d}", "Bench", "Visitor",
+                f"M{random.randrange(40):02d}", f"G{random.randrange(20):02d}", f"B{random.randrange(5)}",
+                random.choice(ACTIONS), scan_datetime,
+            ))
+
+        flat = [value for row in values for value in row]
+        row_sql = ", ".join([f"({placeholders})"] * len(values))
+        frappe.db.sql(f"insert into `{BENCH_TABLE}` ({columns}) values {row_sql}", flat)
+        frappe.db.commit()
+
+
+def report(visitors, repeat):
+    timings = {}
+    for name, query in HOT_QUERIES.items():
+        sql = query.format(table=BENCH_TABLE)
+        params = {"visitor": f"BENCH-REG-{random.randrange(visitors):07d}"}
+
+        print(f"-- {name}")
+        for row in frappe.db.sql(f"explain {sql}", params, as_dict=True):
+            print("   type={type} key={key} rows={rows} extra={Extra}".format(**row))
+
+        elapsed = 0.0
+        for _ in range(repeat):
+            params["visitor"] = f"BENCH-REG-{random.randrange(visitors):07d}"
+            started = time.perf_counter()
+            frappe.db.sql(sql, params)
+            elapsed += time.perf_counter() - started
+        timings[name] = elapsed / repeat * 1000
+        print(f"   avg {timings[name]:.2f} ms over {repeat} runs")
+
+    return timings
@@ -87,6 +87,14 @@ add_to_apps_screen = [
 # before_install = "scango_office.install.before_install"
 # after_install = "scango_office.install.after_install"
 
+# Migration
+# ------------
+
+after_migrate = [
+	"scango_office.scango.revoked_qr.rebuild_revoked_qr_cache",
+	"scango_office.scango.occupancy.reconcile_occupancy",
+]
+
 # Uninstallation
 # ------------
 
@@ -142,6 +150,24 @@ add_to_apps_screen = [
 # Scheduled Tasks
 # ---------------
 
+scheduler_events = {
+	"daily_long": [
+		"scango_office.scango.doctype.gate_traffic_rollup.gate_traffic_rollup.rebuild_traffic_rollup",
+		"scango_office.scango.gate_pass_archive.archive_gate_passes",
+	],
+	"cron": {
+		"*/5 * * * *": [
+			"scango_office.scango.occupancy.reconcile_and_publish_occupancy",
+		],
+		"5 0 * * *": [
+			"scango_office.scango.visit_expiry.expire_overdue_visits",
+		],
+		"20 0 * * *": [
+			"scango_office.scango.gate_snapshot.build_gate_snapshot",
+		],
+	},
+}
+
 # scheduler_events = {
 # 	"all": [
 # 		"scango_office.tasks.all"
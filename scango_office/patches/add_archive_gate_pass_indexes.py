@@ -0,0 +1,7 @@
+from scango_office.scango.gate_pass_archive import get_archive_tables, sync_archive_indexes
+
+
+def execute():
+    """Add the Visitor Gate Pass indexes to archive tables created before them"""
+    for table in get_archive_tables():
+        sync_archive_indexes(table)
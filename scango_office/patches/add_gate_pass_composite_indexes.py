@@ -0,0 +1,6 @@
+from scango_office.scango.doctype.visitor_gate_pass.visitor_gate_pass import on_doctype_update
+
+
+def execute():
+    """Add composite indexes for the Visitor Gate Pass hot queries on existing sites"""
+    on_doctype_update()
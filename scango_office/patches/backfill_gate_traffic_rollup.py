@@ -0,0 +1,24 @@
+import frappe
+from frappe.utils import add_days, add_months, get_first_day, getdate, today
+
+from scango_office.scango.doctype.gate_traffic_rollup.gate_traffic_rollup import rebuild_traffic_rollup
+from scango_office.scango.gate_pass_archive import get_gate_pass_tables
+
+
+def execute():
+    """Build Gate Traffic Rollup rows for the existing gate pass history, one month at a time"""
+    first_dates = []
+    for table in get_gate_pass_tables():
+        first = frappe.db.sql(f"select min(scan_datetime) from `{table}`")[0][0]
+        if first:
+            first_dates.append(getdate(first))
+
+    if not first_dates:
+        return
+
+    month_start = get_first_day(min(first_dates))
+    end = getdate(today())
+    while month_start <= end:
+        month_end = min(add_days(add_months(month_start, 1), -1), end)
+        rebuild_traffic_rollup(month_start, month_end)
+        month_start = add_months(month_start, 1)
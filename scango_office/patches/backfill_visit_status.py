@@ -0,0 +1,20 @@
+import frappe
+
+from scango_office.scango.gate_pass_archive import get_gate_pass_tables
+from scango_office.scango.visit_expiry import ACTIVE, CHECKED_OUT, expire_overdue_visits
+
+
+def execute():
+    """Set Visitor Register.visit_status for existing registrations"""
+    frappe.db.sql("update `tabVisitor Register` set visit_status = %s", (ACTIVE,))
+
+    for table in get_gate_pass_tables():
+        frappe.db.sql(f"""
+            update `tabVisitor Register` vr
+            join (select distinct visitor_register from `{table}` where action_type = 'Checkout') gp
+                on gp.visitor_register = vr.name
+            set vr.visit_status = %s
+        """, (CHECKED_OUT,))
+
+    # ผู้เยี่ยมชมที่เลยวันแล้วแต่ยังไม่ Checkout - ปรับเป็น Expired พร้อมบันทึกรายการ Expired
+    expire_overdue_visits()
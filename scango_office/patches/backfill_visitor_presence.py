@@ -0,0 +1,58 @@
+import frappe
+
+from scango_office.scango.doctype.visitor_presence.visitor_presence import PRESENCE_ACTIONS
+
+CHUNK_SIZE = 1000
+
+
+def execute():
+    """Build one Visitor Presence row per visitor from the existing gate pass history"""
+    after = ""
+
+    # ไล่ทีละชุดของผู้เยี่ยมชม (keyset ตาม visitor_register) อ่านเฉพาะการแสกนล่าสุดของแต่ละคน
+    # ด้วย visitor_action_scan_index แทนการอ่านประวัติทั้งตาราง
+    while True:
+        rows = frappe.db.sql("""
+            select gp.name, gp.visitor_register, gp.visitor_name, gp.visitor_last_name, gp.gate_machine,
+                gp.building_gate, gp.building_name, gp.action_type, gp.scan_datetime
+            from `tabVisitor Gate Pass` gp
+            join (
+                select visitor_register, max(scan_datetime) as scan_datetime
+                from `tabVisitor Gate Pass`
+                where action_type in %(actions)s and visitor_register > %(after)s
+                group by visitor_register
+                order by visitor_register
+                limit %(limit)s
+            ) latest on latest.visitor_register = gp.visitor_register and latest.scan_datetime = gp.scan_datetime
+            where gp.action_type in %(actions)s
+            order by gp.visitor_register, gp.name
+        """, {"actions": PRESENCE_ACTIONS, "after": after, "limit": CHUNK_SIZE}, as_dict=True)
+        if not rows:
+            break
+
+        # หลายแถวเวลาเดียวกัน - ใช้แถวสุดท้ายตาม name เหมือนลำดับ scan_datetime, name
+        latest = {row.visitor_register: row for row in rows}
+        existing = set(frappe.get_all("Visitor Presence",
+            filters={"name": ["in", list(latest)]},
+            pluck="name"
+        ))
+
+        for visitor_id, row in latest.items():
+            if visitor_id in existing:
+                continue
+
+            frappe.get_doc({
+                "doctype": "Visitor Presence",
+                "visitor_register": visitor_id,
+                "visitor_name": row.visitor_name,
+                "visitor_last_name": row.visitor_last_name,
+                "in_building": 1 if row.action_type == "In" else 0,
+                "last_action": row.action_type,
+                "last_gate_machine": row.gate_machine,
+                "last_building_gate": row.building_gate,
+                "last_building_name": row.building_name,
+                "last_scan_datetime": row.scan_datetime,
+                "last_gate_pass": row.name,
+            }).insert(ignore_permissions=True)
+
+        after = rows[-1].visitor_register
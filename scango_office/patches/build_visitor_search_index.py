@@ -0,0 +1,5 @@
+from scango_office.scango.visitor_search import rebuild_search_index
+
+
+def execute():
+    rebuild_search_index()
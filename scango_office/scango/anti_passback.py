@@ -0,0 +1,269 @@
+# Anti-passback
+#
+# สถานะล่าสุดของผู้เยี่ยมชมในแต่ละอาคาร (โซน) เก็บเป็น Redis hash หนึ่ง key ต่อคน
+#   scango:passback:<visitor>  {<building>: "In|<timestamp>" / "Out|<timestamp>", "_loaded": 1}
+#
+# กฎตั้งได้ที่ Building และ Building Gate (ค่าของประตูใช้ก่อน) และถูกโหลดมากับ gate topology
+#   anti_passback      - ห้ามเข้าซ้ำโดยยังไม่ได้ออก และห้ามออกโดยไม่ได้เข้า
+#   reentry_cooldown   - เวลาขั้นต่ำหลังออกก่อนจะเข้าได้อีก
+#   parent_building    - โซนซ้อนกัน: ต้องอยู่ในอาคารหลักก่อนจึงเข้าอาคารย่อยได้
+#
+# process_gate_scan ตรวจและจองสถานะใหม่ด้วย Lua script ครั้งเดียว (atomic) จึงถูกต้องแม้สแกนพร้อมกันหลายประตู
+# ถ้าบันทึก gate pass ไม่สำเร็จจะคืนสถานะเดิม ส่วนการสแกนจากทางอื่น (sync offline, บันทึกเอง) ถูกนำมาปรับ
+# สถานะหลัง commit โดยไม่ทับสถานะที่ใหม่กว่า
+#
+# ไม่มีการอ่านประวัติบน hot path - ประวัติ (รวมตาราง archive) ถูกอ่านเฉพาะตอนที่ยังไม่มี state ของผู้เยี่ยมชมใน Redis
+
+import math
+
+import frappe
+from frappe.utils import get_datetime, now_datetime
+
+from scango_office.scango.cache_errors import log_cache_error
+from scango_office.scango.gate_pass_archive import get_gate_pass_tables
+from scango_office.scango.gate_topology import get_all_gate_topology, get_gate_topology
+
+PASSBACK_PREFIX = "scango:passback"
+LOADED_FIELD = "_loaded"
+PASSBACK_ACTIONS = ("In", "Out")
+
+# state ที่ไม่ถูกใช้นานกว่านี้จะหายไป และถูกสร้างใหม่จากประวัติเมื่อสแกนครั้งถัดไป
+STATE_TTL = 7 * 24 * 60 * 60
+HISTORY_LIMIT = 500
+
+# KEYS[1] state hash
+# ARGV: building, action, timestamp, strict (0/1), cooldown seconds, parent building, ttl
+CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {'miss', '', '0'}
+end
+
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+local state, at = nil, 0
+if current then
+    local sep = string.find(current, '|', 1, true)
+    state = string.sub(current, 1, sep - 1)
+    at = tonumber(string.sub(current, sep + 1))
+end
+local now = tonumber(ARGV[3])
+
+if ARGV[2] == 'In' then
+    if ARGV[4] == '1' and state == 'In' then
+        return {'already_in', current, '0'}
+    end
+    local cooldown = tonumber(ARGV[5])
+    if state == 'Out' and cooldown > 0 and now - at < cooldown then
+        return {'cooldown', current, tostring(cooldown - (now - at))}
+    end
+    if ARGV[6] ~= '' then
+        local parent = redis.call('HGET', KEYS[1], ARGV[6])
+        if not parent or string.sub(parent, 1, 3) ~= 'In|' then
+            return {'not_in_parent', current or '', '0'}
+        end
+    end
+elseif ARGV[4] == '1' and state ~= 'In' then
+    return {'not_in', current or '', '0'}
+end
+
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. '|' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+return {'ok', current or '', '0'}
+"""
+
+# KEYS[1] state hash
+# ARGV: building, claimed value, previous value ('' = none)
+RESTORE_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    if ARGV[3] == '' then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+    else
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[3])
+    end
+end
+return 1
+"""
+
+# KEYS[1] state hash
+# ARGV: building, action, timestamp, ttl, nested buildings...
+RECORD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+
+local ts = tonumber(ARGV[3])
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current or tonumber(string.sub(current, string.find(current, '|', 1, true) + 1)) < ts then
+    redis.call('HSET', KEYS[1], ARGV[1], ARGV[2] .. '|' .. ARGV[3])
+end
+
+-- ออกจากอาคารหลัก = ออกจากทุกโซนที่อยู่ภายใน
+if ARGV[2] == 'Out' then
+    for i = 5, #ARGV do
+        local child = redis.call('HGET', KEYS[1], ARGV[i])
+        if child and string.sub(child, 1, 3) == 'In|' and tonumber(string.sub(child, 4)) < ts then
+            redis.call('HSET', KEYS[1], ARGV[i], 'Out|' .. ARGV[3])
+        end
+    end
+end
+
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+VIOLATION_MESSAGES = {
+    "already_in": "ยังไม่ได้สแกนออกจากอาคาร ไม่สามารถสแกนเข้าซ้ำได้",
+    "not_in": "ยังไม่ได้สแกนเข้าอาคาร ไม่สามารถสแกนออกได้",
+    "not_in_parent": "ต้องสแกนเข้าอาคารหลักก่อน จึงจะเข้าพื้นที่นี้ได้",
+}
+
+
+def _state_key(visitor_id):
+    return frappe.cache.make_key(f"{PASSBACK_PREFIX}:{visitor_id}")
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _timestamp(value):
+    return f"{get_datetime(value).timestamp():.3f}"
+
+
+def has_passback_rules(machine):
+    return bool(machine and machine.building and (machine.anti_passback or machine.reentry_cooldown
+                                                   or machine.parent_building))
+
+
+def claim_passback(visitor_id, gate_machine, action_type):
+    """
+    Check the anti-passback rules of the machine and reserve the new state atomically
+    คืนค่า (claim, None) ถ้าผ่าน (claim ใช้คืนสถานะเดิมเมื่อบันทึกไม่สำเร็จ) หรือ (None, ผลแบบ check_qr_status) ถ้าผิดกฎ
+    """
+    machine = get_gate_topology(gate_machine)
+    if action_type not in PASSBACK_ACTIONS or not has_passback_rules(machine):
+        return None, None
+
+    key = _state_key(visitor_id)
+    value = f"{action_type}|{_timestamp(now_datetime())}"
+    try:
+        script = frappe.cache.register_script(CLAIM_SCRIPT)
+        for _ in range(2):
+            code, previous, remaining = (_decode(v) for v in script(keys=[key], args=[
+                machine.building, action_type, value.split("|")[1], int(machine.anti_passback),
+                machine.reentry_cooldown or 0, machine.parent_building or "", STATE_TTL
+            ]))
+            if code != "miss":
+                break
+            load_passback_state(visitor_id)
+        else:
+            # โหลด state ไม่ได้ - ไม่บล็อกการสแกน
+            return None, None
+    except Exception as e:
+        # Redis ใช้งานไม่ได้ - ไม่บล็อกการสแกน (ประตูยังใช้งานได้โดยไม่มี anti-passback)
+        log_cache_error("Anti-passback Error", e)
+        return None, None
+
+    if code == "ok":
+        return (key, machine.building, value, previous), None
+
+    if code == "cooldown":
+        message = f"ยังไม่ถึงเวลาที่สแกนเข้าซ้ำได้ กรุณารออีก {math.ceil(float(remaining) / 60)} นาที"
+    else:
+        message = VIOLATION_MESSAGES.get(code, "ไม่สามารถผ่านประตูนี้ได้")
+    return None, {
+        "valid": False,
+        "message": message,
+        "status": f"passback_{code}",
+        "action_type": action_type
+    }
+
+
+def release_passback(claim):
+    """Put back the state a claim replaced when its gate pass was not recorded"""
+    key, building, value, previous = claim
+    try:
+        frappe.cache.register_script(RESTORE_SCRIPT)(keys=[key], args=[building, value, previous])
+    except Exception as e:
+        log_cache_error("Anti-passback Error", e)
+
+
+def load_passback_state(visitor_id):
+    """Rebuild a visitor's state from recent gate passes (only when it is not cached)"""
+    topology = get_all_gate_topology().values()
+    gate_buildings = {m.building_gate: m.building for m in topology if m.building_gate}
+    child_buildings = {m.building: m.child_buildings for m in topology if m.building}
+
+    # รวมตาราง archive - การสแกนเข้าครั้งล่าสุดอาจถูกย้ายออกจากตารางหลักแล้ว
+    # ไล่จากตารางใหม่ไปเก่า และหยุดเมื่อครบ HISTORY_LIMIT หรือพบ Checkout (ประวัติก่อนหน้านั้นไม่มีผล)
+    rows = []
+    for table in get_gate_pass_tables():
+        table_rows = frappe.db.sql(f"""
+            select building_gate, action_type, scan_datetime from `{table}`
+            where visitor_register = %s and action_type in ('In', 'Out', 'Checkout')
+            order by scan_datetime desc
+            limit %s
+        """, (visitor_id, HISTORY_LIMIT - len(rows)), as_dict=True)
+        rows += table_rows
+        if len(rows) >= HISTORY_LIMIT or any(row.action_type == "Checkout" for row in table_rows):
+            break
+
+    state = {}
+    for row in reversed(rows):
+        if row.action_type == "Checkout":
+            state.clear()
+            continue
+        building = gate_buildings.get(row.building_gate)
+        if not building:
+            continue
+        value = f"{row.action_type}|{_timestamp(row.scan_datetime)}"
+        state[building] = value
+        if row.action_type == "Out":
+            for child in child_buildings.get(building, ()):
+                if state.get(child, "").startswith("In|"):
+                    state[child] = value
+
+    # HSETNX ไม่ทับสถานะที่ประตูอื่นเพิ่งบันทึกระหว่างที่อ่านประวัติ
+    key = _state_key(visitor_id)
+    pipe = frappe.cache.pipeline()
+    for field, value in {**state, LOADED_FIELD: 1}.items():
+        pipe.hsetnx(key, field, value)
+    pipe.expire(key, STATE_TTL)
+    pipe.execute()
+
+
+def record_passback(gate_passes):
+    """Apply committed gate passes to the cached state (sync offline / manual entries / after_insert)"""
+    gate_passes = [gp for gp in gate_passes if gp.action_type in (*PASSBACK_ACTIONS, "Checkout")]
+    if not gate_passes:
+        return
+
+    def _record():
+        topology = get_all_gate_topology().values()
+        gate_buildings = {m.building_gate: m for m in topology if m.building_gate}
+        try:
+            script = frappe.cache.register_script(RECORD_SCRIPT)
+            pipe = frappe.cache.pipeline()
+            for gp in sorted(gate_passes, key=lambda gp: get_datetime(gp.scan_datetime)):
+                key = _state_key(gp.visitor_register)
+                machine = gate_buildings.get(gp.building_gate)
+                if gp.action_type == "Checkout":
+                    pipe.delete(key)
+                elif machine and machine.building:
+                    script(keys=[key], args=[machine.building, gp.action_type, _timestamp(gp.scan_datetime),
+                                             STATE_TTL, *machine.child_buildings], client=pipe)
+            pipe.execute()
+        except Exception as e:
+            log_cache_error("Anti-passback Error", e)
+            clear_passback_state({gp.visitor_register for gp in gate_passes})
+
+    frappe.db.after_commit.add(_record)
+
+
+def clear_passback_state(visitor_ids):
+    """Drop cached states so they are rebuilt from the gate passes on the next scan"""
+    if not visitor_ids:
+        return
+    try:
+        frappe.cache.delete(*[_state_key(visitor_id) for visitor_id in visitor_ids])
+    except Exception as e:
+        log_cache_error("Anti-passback Error", e)
@@ -0,0 +1,25 @@
+# Cache error logging
+#
+# เมื่อ Redis ใช้งานไม่ได้ ทุกการสแกนจะเจอ error เดียวกัน ถ้าบันทึก Error Log ทุกครั้งตาราง Error Log
+# จะโตเร็วและทำให้ฐานข้อมูลช้าลงในช่วงที่ระบบกำลังมีปัญหาอยู่แล้ว จึงบันทึกไม่เกินครั้งละ LOG_INTERVAL
+# วินาทีต่อหัวข้อต่อ process (นับใน memory เพราะ Redis อาจใช้งานไม่ได้)
+
+import time
+
+import frappe
+
+LOG_INTERVAL = 60
+
+# {(site, title): เวลาที่บันทึกล่าสุด}
+_last_logged = {}
+
+
+def log_cache_error(title, error):
+    """frappe.log_error at most once per LOG_INTERVAL seconds for each title"""
+    key = (frappe.local.site, title)
+    now = time.monotonic()
+    last = _last_logged.get(key)
+    if last is not None and now - last < LOG_INTERVAL:
+        return
+    _last_logged[key] = now
+    frappe.log_error(f"{title}: {str(error)}")
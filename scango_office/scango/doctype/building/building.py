@@ -1,9 +1,30 @@
 # Copyright (c) 2025, kunpriya-natpaphat and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from scango_office.scango.gate_topology import clear_gate_topology_cache
+
 
 class Building(Document):
-	pass
+	def validate(self):
+		self.validate_parent_building()
+
+	def validate_parent_building(self):
+		"""Zones may nest but not loop back on themselves"""
+		parent, seen = self.parent_building, {self.name}
+		while parent:
+			if parent in seen:
+				frappe.throw("อาคารที่อยู่ภายในซ้อนกันเป็นวงไม่ได้")
+			seen.add(parent)
+			parent = frappe.db.get_value("Building", parent, "parent_building")
+
+	def on_update(self):
+		clear_gate_topology_cache()
+
+	def after_rename(self, old, new, merge=False):
+		clear_gate_topology_cache()
+
+	def on_trash(self):
+		clear_gate_topology_cache()
@@ -4,6 +4,15 @@
 # import frappe
 from frappe.model.document import Document
 
+from scango_office.scango.gate_topology import clear_gate_topology_cache
+
 
 class BuildingGate(Document):
-	pass
+	def on_update(self):
+		clear_gate_topology_cache()
+
+	def after_rename(self, old, new, merge=False):
+		clear_gate_topology_cache()
+
+	def on_trash(self):
+		clear_gate_topology_cache()
@@ -0,0 +1,8 @@
+// Copyright (c) 2026, kunpriya-natpaphat and contributors
+// For license information, please see license.txt
+
+// frappe.ui.form.on("Gate Traffic Rollup", {
+// 	refresh(frm) {
+
+// 	},
+// });
@@ -0,0 +1,130 @@
+# Copyright (c) 2026, kunpriya-natpaphat and contributors
+# For license information, please see license.txt
+
+import hashlib
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_days, get_datetime, getdate, now_datetime, today
+
+from scango_office.scango.gate_pass_archive import get_gate_pass_tables
+from scango_office.scango.visit_expiry import EXPIRED
+
+ROLLUP_KEY_FIELDS = ["scan_date", "scan_hour", "building_name", "building_gate", "gate_machine", "action_type"]
+REPORT_GROUP_FIELDS = ROLLUP_KEY_FIELDS
+
+# รายการที่ระบบสร้างเอง (ไม่ใช่การสแกนจริง) ไม่ถูกนับ ทั้งตอนเพิ่มทีละรายการและตอน rebuild
+EXCLUDED_ACTIONS = (EXPIRED,)
+
+
+class GateTrafficRollup(Document):
+	pass
+
+
+def get_rollup_name(key):
+	return hashlib.md5("|".join(str(value or "") for value in key).encode()).hexdigest()
+
+
+def get_rollup_key(gate_pass):
+	scan_datetime = get_datetime(gate_pass.scan_datetime)
+	return (
+		scan_datetime.date(),
+		scan_datetime.hour,
+		gate_pass.building_name or "",
+		gate_pass.building_gate or "",
+		gate_pass.gate_machine or "",
+		gate_pass.action_type or "",
+	)
+
+
+def add_to_traffic_rollup(gate_passes):
+	"""Increment the rollup rows for the given gate passes (same transaction as the insert)"""
+	counts = {}
+	for gate_pass in gate_passes:
+		if not gate_pass.scan_datetime or gate_pass.action_type in EXCLUDED_ACTIONS:
+			continue
+		key = get_rollup_key(gate_pass)
+		counts[key] = counts.get(key, 0) + 1
+
+	upsert_rollup_counts(counts)
+
+
+def upsert_rollup_counts(counts, replace=False):
+	if not counts:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	for key, count in counts.items():
+		values.extend([get_rollup_name(key), now, now, user, user, 0, *key, count])
+
+	row_sql = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"] * len(counts))
+	update = "values(scan_count)" if replace else "scan_count + values(scan_count)"
+	frappe.db.sql(
+		f"""
+		insert into `tabGate Traffic Rollup`
+			(name, creation, modified, owner, modified_by, docstatus,
+			scan_date, scan_hour, building_name, building_gate, gate_machine, action_type, scan_count)
+		values {row_sql}
+		on duplicate key update scan_count = {update}, modified = values(modified)
+		""",
+		values,
+	)
+
+
+def rebuild_traffic_rollup(from_date=None, to_date=None):
+	"""Recompute rollup rows for a date range from the raw gate passes (defaults to yesterday)"""
+	from_date = getdate(from_date or add_days(today(), -1))
+	to_date = getdate(to_date or from_date)
+
+	counts = {}
+	for table in get_gate_pass_tables():
+		for row in frappe.db.sql(
+			f"""
+			select date(scan_datetime) as scan_date, hour(scan_datetime) as scan_hour,
+				ifnull(building_name, '') as building_name, ifnull(building_gate, '') as building_gate,
+				ifnull(gate_machine, '') as gate_machine, ifnull(action_type, '') as action_type,
+				count(*) as scan_count
+			from `{table}`
+			where scan_datetime >= %s and scan_datetime < %s
+				and ifnull(action_type, '') not in %s
+			group by 1, 2, 3, 4, 5, 6
+			""",
+			(from_date, add_days(to_date, 1), EXCLUDED_ACTIONS),
+			as_dict=True,
+		):
+			key = tuple(row[field] for field in ROLLUP_KEY_FIELDS)
+			counts[key] = counts.get(key, 0) + row.scan_count
+
+	frappe.db.delete("Gate Traffic Rollup", {"scan_date": ["between", [from_date, to_date]]})
+	upsert_rollup_counts(counts, replace=True)
+	frappe.db.commit()
+
+
+@frappe.whitelist()
+def get_traffic_report(from_date, to_date, group_by="scan_date", building_name=None, action_type=None):
+	"""
+	Scan counts from the rollup table
+	group_by: ฟิลด์เดียวหรือ JSON list ของ scan_date, scan_hour, building_name, building_gate, gate_machine, action_type
+	"""
+	frappe.has_permission("Gate Traffic Rollup", "read", throw=True)
+
+	group_fields = frappe.parse_json(group_by) if group_by.startswith("[") else [group_by]
+	group_fields = [field for field in group_fields if field in REPORT_GROUP_FIELDS] or ["scan_date"]
+
+	filters = {"scan_date": ["between", [getdate(from_date), getdate(to_date)]]}
+	if building_name:
+		filters["building_name"] = building_name
+	if action_type:
+		filters["action_type"] = action_type
+
+	rows = frappe.get_all(
+		"Gate Traffic Rollup",
+		filters=filters,
+		fields=[*group_fields, "sum(scan_count) as scans"],
+		group_by=", ".join(group_fields),
+		order_by=", ".join(group_fields),
+	)
+
+	return {"success": True, "rows": rows, "total": sum(row.scans for row in rows)}
@@ -1,8 +1,19 @@
 import frappe
 from frappe.model.document import Document
 
+from scango_office.scango.gate_topology import clear_gate_topology_cache
+
 class MachineGate(Document):
     
+    def on_update(self):
+        clear_gate_topology_cache()
+    
+    def after_rename(self, old, new, merge=False):
+        clear_gate_topology_cache()
+    
+    def on_trash(self):
+        clear_gate_topology_cache()
+    
     @frappe.whitelist()
     def processCheckIn(self, qr_content, machine_name):
         # Logic สำหรับ Check In
@@ -1,9 +1,47 @@
 # Copyright (c) 2025, kunpriya-natpaphat and contributors
 # For license information, please see license.txt
 
-# import frappe
+import frappe
 from frappe.model.document import Document
 
+from scango_office.scango.anti_passback import clear_passback_state, record_passback
+from scango_office.scango.doctype.gate_traffic_rollup.gate_traffic_rollup import add_to_traffic_rollup
+from scango_office.scango.doctype.visitor_presence.visitor_presence import update_visitor_presence
+from scango_office.scango.revoked_qr import add_revoked_qr, invalidate_revoked_qr_cache
+from scango_office.scango.visit_expiry import mark_checked_out, refresh_visit_status
+
 
 class VisitorGatePass(Document):
-	pass
+	def after_insert(self):
+		update_visitor_presence(self)
+		add_to_traffic_rollup([self])
+		record_passback([self])
+
+		if self.action_type == "Checkout":
+			mark_checked_out([self.visitor_register])
+			add_revoked_qr(self.visitor_register)
+
+	def on_trash(self):
+		if self.action_type == "Checkout":
+			invalidate_revoked_qr_cache()
+
+	def after_delete(self):
+		if self.action_type in ("Checkout", "Expired"):
+			refresh_visit_status(self.visitor_register)
+		if self.action_type in ("In", "Out", "Checkout"):
+			clear_passback_state([self.visitor_register])
+
+
+# ดัชนีสำหรับ query ที่ใช้บ่อย (ตรวจ Checkout ของผู้เยี่ยมชม และประวัติเรียงตามเวลาแสกน)
+# scan_name_index ใช้กับการไล่ตามเวลาโดยไม่กรองผู้เยี่ยมชม (archive, rebuild rollup, keyset ทั้งตาราง)
+GATE_PASS_INDEXES = {
+	"visitor_action_scan_index": ["visitor_register", "action_type", "scan_datetime"],
+	"visitor_scan_index": ["visitor_register", "scan_datetime"],
+	"action_scan_index": ["action_type", "scan_datetime"],
+	"scan_name_index": ["scan_datetime", "name"],
+}
+
+
+def on_doctype_update():
+	for index_name, fields in GATE_PASS_INDEXES.items():
+		frappe.db.add_index("Visitor Gate Pass", fields, index_name=index_name)
@@ -0,0 +1,123 @@
+# Copyright (c) 2026, kunpriya-natpaphat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import get_datetime
+
+from scango_office.scango.occupancy import apply_presence_change
+
+# การแสกนที่เปลี่ยนสถานะการอยู่ในอาคาร (CheckStatus ไม่เปลี่ยนสถานะ)
+PRESENCE_ACTIONS = ("In", "Out", "Checkout")
+
+
+class VisitorPresence(Document):
+	pass
+
+
+def update_visitor_presence(gate_pass):
+	"""Apply a Visitor Gate Pass to the visitor's presence row (same transaction as the insert)"""
+	if gate_pass.action_type not in PRESENCE_ACTIONS:
+		return
+
+	values = {
+		"visitor_name": gate_pass.visitor_name,
+		"visitor_last_name": gate_pass.visitor_last_name,
+		"in_building": 1 if gate_pass.action_type == "In" else 0,
+		"last_action": gate_pass.action_type,
+		"last_gate_machine": gate_pass.gate_machine,
+		"last_building_gate": gate_pass.building_gate,
+		"last_building_name": gate_pass.building_name,
+		"last_scan_datetime": gate_pass.scan_datetime,
+		"last_gate_pass": gate_pass.name,
+	}
+
+	current = frappe.db.get_value(
+		"Visitor Presence",
+		gate_pass.visitor_register,
+		["name", "last_scan_datetime", "in_building", "last_building_name", "last_building_gate"],
+		as_dict=True,
+		for_update=True,
+	)
+
+	if not current:
+		try:
+			frappe.get_doc({"doctype": "Visitor Presence", "visitor_register": gate_pass.visitor_register, **values}).insert(
+				ignore_permissions=True
+			)
+			apply_presence_change(None, _occupancy_state(values))
+			return
+		except frappe.DuplicateEntryError:
+			# gate อื่นสร้างแถวนี้ไปพร้อมกัน - อัปเดตแทน
+			current = frappe.db.get_value(
+				"Visitor Presence",
+				gate_pass.visitor_register,
+				["name", "last_scan_datetime", "in_building", "last_building_name", "last_building_gate"],
+				as_dict=True,
+				for_update=True,
+			)
+
+	# ไม่ให้การแสกนที่เก่ากว่า (เช่น sync ย้อนหลัง) ทับสถานะล่าสุด
+	if (
+		current.last_scan_datetime
+		and gate_pass.scan_datetime
+		and get_datetime(gate_pass.scan_datetime) < get_datetime(current.last_scan_datetime)
+	):
+		return
+
+	frappe.db.set_value("Visitor Presence", current.name, values)
+	apply_presence_change(_occupancy_state(current), _occupancy_state(values))
+
+
+def _occupancy_state(row):
+	return {
+		"in_building": row.get("in_building"),
+		"building_name": row.get("last_building_name"),
+		"building_gate": row.get("last_building_gate"),
+	}
+
+
+@frappe.whitelist()
+def get_visitor_presence(visitor_id):
+	"""Current presence of a visitor without scanning the gate pass history"""
+	frappe.has_permission("Visitor Presence", "read", throw=True)
+
+	presence = frappe.db.get_value(
+		"Visitor Presence",
+		visitor_id,
+		[
+			"visitor_register",
+			"in_building",
+			"last_action",
+			"last_gate_machine",
+			"last_building_gate",
+			"last_building_name",
+			"last_scan_datetime",
+		],
+		as_dict=True,
+	)
+
+	if not presence:
+		return {"success": True, "in_building": 0, "last_action": None}
+
+	return {"success": True, **presence}
+
+
+@frappe.whitelist()
+def get_building_occupancy(building_name=None):
+	"""Number of visitors currently inside, per building"""
+	frappe.has_permission("Visitor Presence", "read", throw=True)
+
+	filters = {"in_building": 1}
+	if building_name:
+		filters["last_building_name"] = building_name
+
+	rows = frappe.get_all(
+		"Visitor Presence",
+		filters=filters,
+		fields=["last_building_name as building_name", "count(name) as visitors"],
+		group_by="last_building_name",
+		order_by=None,
+	)
+
+	return {"success": True, "occupancy": rows, "total": sum(row.visitors for row in rows)}
@@ -0,0 +1,311 @@
+# bulk_import.py - นำเข้าผู้เยี่ยมชมจำนวนมากจากไฟล์ CSV / XLSX
+#
+# ตรวจสอบข้อมูลทีละคอลัมน์ด้วยกฎเดียวกับฟอร์ม Visitor Register แล้วบันทึกแถวที่ถูกต้อง
+# ด้วย bulk insert เป็นชุด ๆ แทนการ save เอกสารทีละคน
+
+import frappe
+from frappe.model.naming import make_autoname
+from frappe.utils import cint, date_diff, getdate, now_datetime, today
+
+from scango_office.scango.doctype.visitor_register.visitor_register import (
+    NAME_FIELDS,
+    NAME_PATTERN,
+    enqueue_visitor_qr_code,
+    is_valid_thai_id,
+)
+from scango_office.scango.visitor_images import enqueue_image_processing
+from scango_office.scango.visitor_search import index_visitors
+from scango_office.scango.watchlist import DENY as WATCHLIST_DENY
+from scango_office.scango.watchlist import get_watchlist_message, match_watchlist
+
+INSERT_CHUNK_SIZE = 500
+
+ID_TYPE_NATIONAL_ID = "เลขบัตรประชาชน"
+
+IMPORT_COLUMNS = [
+    "title", "first_name", "last_name", "gender", "id_type", "birth_date", "visit_end_date",
+    "purpose", "person_to_meet", "nationality", "visitor_photo",
+    "middle_name", "thai_national_id", "passport_number", "phone_number",
+    "visit_date", "other_purpose_details", "items_to_bring", "terms_accepted"
+]
+
+# ฟิลด์บังคับที่การนำเข้ากรอกให้เอง (ไม่ต้องมีในไฟล์)
+IMPORT_FILLED_FIELDS = ("security_guard", "visit_date")
+
+PURPOSE_OTHER = "อื่นๆ"
+
+DATE_COLUMNS = ["birth_date", "visit_date", "visit_end_date"]
+
+# ค่าในคอลัมน์ Check ที่ถือว่าเลือก
+CHECK_TRUE_VALUES = ("1", "yes", "y", "true", "ใช่")
+
+
+@frappe.whitelist()
+def import_visitors(file_url, validate_only=0):
+    """
+    Import Visitor Register rows from an uploaded CSV/XLSX file
+    หัวตารางใช้ได้ทั้ง fieldname หรือ label ของฟิลด์
+    """
+    frappe.has_permission("Visitor Register", "create", throw=True)
+
+    rows = read_import_file(file_url)
+    if len(rows) < 2:
+        return {
+            "success": False,
+            "message": "ไม่พบข้อมูลในไฟล์"
+        }
+
+    columns = get_columns(rows[0], rows[1:])
+    missing = [fieldname for fieldname in get_required_columns() if fieldname not in columns]
+    if missing:
+        return {
+            "success": False,
+            "message": f"ไม่พบคอลัมน์: {', '.join(missing)}"
+        }
+
+    row_count = len(rows) - 1
+    errors = validate_columns(columns, row_count)
+    valid_rows = [idx for idx in range(row_count) if idx not in errors]
+
+    inserted = []
+    if valid_rows and not cint(validate_only):
+        inserted = insert_visitors(columns, valid_rows)
+
+    return {
+        "success": not errors,
+        "total_rows": row_count,
+        "valid_rows": len(valid_rows),
+        "inserted": inserted,
+        # แถวที่ 1 คือหัวตาราง
+        "errors": [{"row": idx + 2, "messages": messages} for idx, messages in sorted(errors.items())]
+    }
+
+
+def read_import_file(file_url):
+    file_doc = frappe.get_doc("File", {"file_url": file_url})
+    file_doc.check_permission("read")
+    extension = (file_doc.file_name or file_url).rsplit(".", 1)[-1].lower()
+    content = file_doc.get_content()
+
+    if extension == "csv":
+        from frappe.utils.csvutils import read_csv_content
+        return read_csv_content(content)
+
+    if extension == "xlsx":
+        from frappe.utils.xlsxutils import read_xlsx_file_from_attached_file
+        return read_xlsx_file_from_attached_file(fcontent=content)
+
+    frappe.throw("รองรับเฉพาะไฟล์ CSV หรือ XLSX เท่านั้น", title="ไฟล์ไม่ถูกต้อง")
+
+
+def get_required_columns():
+    """Every mandatory Visitor Register field (bulk insert skips the document's own mandatory check)"""
+    meta = frappe.get_meta("Visitor Register")
+    return [df.fieldname for df in meta.fields if df.reqd and df.fieldname not in IMPORT_FILLED_FIELDS]
+
+
+def get_columns(header, data):
+    """Turn row-oriented file data into {fieldname: [value per row]}"""
+    meta = frappe.get_meta("Visitor Register")
+    label_map = {df.label.strip(): df.fieldname for df in meta.fields if df.label}
+
+    columns = {}
+    for col_idx, heading in enumerate(header):
+        heading = str(heading or "").strip()
+        fieldname = heading if heading in IMPORT_COLUMNS else label_map.get(heading)
+        if fieldname not in IMPORT_COLUMNS or fieldname in columns:
+            continue
+
+        columns[fieldname] = [
+            clean_cell(row[col_idx] if col_idx < len(row) else None) for row in data
+        ]
+
+    return columns
+
+
+def clean_cell(value):
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, int):
+        value = str(value)
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def validate_columns(columns, row_count):
+    """Apply the Visitor Register rules column by column, return {row index: [messages]}"""
+    errors = {}
+
+    def add_error(idx, message):
+        errors.setdefault(idx, []).append(message)
+
+    meta = frappe.get_meta("Visitor Register")
+    today_date = getdate(today())
+    id_types = columns["id_type"]
+
+    # ช่องที่ต้องกรอก (ทุกฟิลด์ที่ reqd ใน doctype)
+    for fieldname in get_required_columns():
+        label = meta.get_label(fieldname)
+        for idx, value in enumerate(columns[fieldname]):
+            if value is None:
+                add_error(idx, f"กรุณากรอก {label}")
+
+    other_details = columns.get("other_purpose_details") or [None] * row_count
+    for idx, (purpose, value) in enumerate(zip(columns["purpose"], other_details, strict=True)):
+        if purpose == PURPOSE_OTHER and value is None:
+            add_error(idx, f"กรุณากรอก {meta.get_label('other_purpose_details')}")
+
+    # validate_terms_acceptance: มีรูปต้องยอมรับเงื่อนไข (ไม่มีคอลัมน์ = ไม่ยอมรับ)
+    columns["terms_accepted"] = [
+        1 if str(value or "").lower() in CHECK_TRUE_VALUES else 0
+        for value in columns.get("terms_accepted") or [None] * row_count
+    ]
+    for idx, (photo, accepted) in enumerate(zip(columns.get("visitor_photo") or [None] * row_count,
+                                               columns["terms_accepted"], strict=True)):
+        if photo is not None and not accepted:
+            add_error(idx, "กรุณายอมรับเงื่อนไขการเข้า-ออกสถานที่")
+
+    # รูปผู้เยี่ยมชมต้องเป็นไฟล์ที่อัปโหลดไว้แล้วในระบบ
+    photo_urls = {value for value in columns.get("visitor_photo") or [] if value is not None}
+    existing_urls = set(frappe.get_all("File",
+        filters={"file_url": ["in", list(photo_urls)]},
+        pluck="file_url"
+    )) if photo_urls else set()
+    for idx, value in enumerate(columns.get("visitor_photo") or []):
+        if value is not None and value not in existing_urls:
+            add_error(idx, f"ไม่พบไฟล์ {meta.get_label('visitor_photo')}: {value}")
+
+    # ตัวเลือกของฟิลด์ Select
+    for fieldname, values in columns.items():
+        df = meta.get_field(fieldname)
+        if not df or df.fieldtype != "Select" or not df.options:
+            continue
+        options = set(df.options.split("\n"))
+        for idx, value in enumerate(values):
+            if value is not None and value not in options:
+                add_error(idx, f"ช่อง {df.label} ไม่มีตัวเลือก {value}")
+
+    # validate_name_fields
+    for fieldname, label in NAME_FIELDS.items():
+        for idx, value in enumerate(columns.get(fieldname) or []):
+            if value is None:
+                continue
+            if not NAME_PATTERN.match(value):
+                add_error(idx, f"ช่อง {label} สามารถกรอกได้เฉพาะตัวอักษรไทย-อังกฤษเท่านั้น")
+            elif "  " in value:
+                add_error(idx, f"ช่อง {label} ไม่ควรมีช่องว่างซ้ำกันหรือเว้นวรรคหน้า-หลัง")
+
+    # validate_national_id / is_valid_thai_id
+    for idx, (id_type, value) in enumerate(zip(id_types, columns.get("thai_national_id") or [None] * row_count, strict=True)):
+        if id_type != ID_TYPE_NATIONAL_ID or value is None:
+            continue
+        national_id = value.replace("-", "").replace(" ", "")
+        if len(national_id) < 10:
+            continue
+        if not national_id.isdigit() or len(national_id) != 13:
+            add_error(idx, "เลขบัตรประชาชนต้องเป็นตัวเลข 13 หลักเท่านั้น")
+        elif not is_valid_thai_id(national_id):
+            add_error(idx, "เลขบัตรประชาชนไม่ถูกต้องตามหลักการคำนวณ")
+
+    # แปลงวันที่ทั้งคอลัมน์ก่อนตรวจสอบ
+    if "visit_date" not in columns:
+        columns["visit_date"] = [None] * row_count
+    columns["visit_date"] = [value or today_date for value in columns["visit_date"]]
+
+    for fieldname in DATE_COLUMNS:
+        parsed = []
+        for idx, value in enumerate(columns[fieldname]):
+            try:
+                parsed.append(getdate(value) if value is not None else None)
+            except Exception:
+                add_error(idx, f"ช่อง {meta.get_label(fieldname)} รูปแบบวันที่ไม่ถูกต้อง")
+                parsed.append(None)
+        columns[fieldname] = parsed
+
+    # validate_birth_date
+    for idx, birth_date in enumerate(columns["birth_date"]):
+        if birth_date and birth_date > today_date:
+            add_error(idx, "วันเกิดไม่สามารถเป็นวันที่ในอนาคตได้")
+
+    # validate_visit_dates
+    for idx, (start_date, end_date) in enumerate(zip(columns["visit_date"], columns["visit_end_date"], strict=True)):
+        if start_date and start_date != today_date:
+            add_error(idx, "วันที่เข้าต้องเป็นวันนี้เท่านั้น")
+        if start_date and end_date and end_date < start_date:
+            add_error(idx, "วันที่ออกต้องไม่เป็นวันก่อนวันที่เข้า")
+
+    # รายชื่อเฝ้าระวัง: แถวที่ตรงกับรายชื่อห้ามเข้าไม่ถูกนำเข้า
+    for idx in range(row_count):
+        entry = match_watchlist(get_row(columns, idx))
+        if entry and entry.action == WATCHLIST_DENY:
+            add_error(idx, get_watchlist_message(entry))
+
+    return errors
+
+
+def get_row(columns, idx):
+    return {fieldname: values[idx] for fieldname, values in columns.items()}
+
+
+def get_age(birth_date, today_date):
+    age = today_date.year - birth_date.year
+    if (today_date.month, today_date.day) < (birth_date.month, birth_date.day):
+        age -= 1
+    return age
+
+
+def insert_visitors(columns, row_indexes):
+    """Bulk insert validated rows in chunks, return the new Visitor Register names"""
+    today_date = getdate(today())
+    now = now_datetime()
+    user = frappe.session.user
+    autoname = frappe.get_meta("Visitor Register").autoname
+
+    fieldnames = [fieldname for fieldname in IMPORT_COLUMNS if fieldname in columns]
+    fields = ["name", "owner", "modified_by", "creation", "modified", "docstatus",
+              "security_guard", "age", "total_days", "watchlist_entry", *fieldnames]
+
+    inserted = []
+    for start in range(0, len(row_indexes), INSERT_CHUNK_SIZE):
+        values = []
+        visitors = []
+        for idx in row_indexes[start:start + INSERT_CHUNK_SIZE]:
+            row = {fieldname: columns[fieldname][idx] for fieldname in fieldnames}
+
+            # ทำความสะอาดข้อมูลแบบเดียวกับ before_save
+            for fieldname in NAME_FIELDS:
+                if row.get(fieldname):
+                    row[fieldname] = " ".join(row[fieldname].split())
+            if row.get("thai_national_id"):
+                row["thai_national_id"] = row["thai_national_id"].replace("-", "").replace(" ", "")
+            if row.get("passport_number"):
+                row["passport_number"] = row["passport_number"].upper().replace(" ", "")
+
+            name = make_autoname(autoname, "Visitor Register")
+            age = get_age(row["birth_date"], today_date)
+            total_days = date_diff(row["visit_end_date"], row["visit_date"]) + 1
+
+            watchlist = match_watchlist(row)
+
+            values.append([name, user, user, now, now, 0, user, age, total_days,
+                           watchlist.name if watchlist else None,
+                           *(row[fieldname] for fieldname in fieldnames)])
+            visitors.append({"name": name, **row})
+            inserted.append(name)
+
+        frappe.db.bulk_insert("Visitor Register", fields, values)
+        index_visitors(visitors)
+
+        # bulk insert ไม่เรียก on_update - ส่งงานสร้าง QR / thumbnail เอง (เข้าคิวหลัง commit ของชุดนี้)
+        for visitor in visitors:
+            if visitor.get("visitor_photo"):
+                enqueue_image_processing(visitor["name"])
+                if visitor["terms_accepted"]:
+                    enqueue_visitor_qr_code(visitor["name"])
+        frappe.db.commit()
+
+    return inserted
@@ -1,8 +1,14 @@
 # Copyright (c) 2025, kunpriya-natpaphat and Contributors
 # See license.txt
 
-# import frappe
+import frappe
 from frappe.tests import IntegrationTestCase
+from frappe.utils import get_datetime
+
+from scango_office.scango.doctype.visitor_register.visitor_register import (
+	decode_history_cursor,
+	encode_history_cursor,
+)
 
 
 # On IntegrationTestCase, the doctype test records and all
@@ -19,4 +25,6 @@ class IntegrationTestVisitorRegister(IntegrationTestCase):
 	Use this class for testing interactions between multiple components.
 	"""
 
-	pass
+	def test_history_cursor_round_trip(self):
+		row = frappe._dict(scan_datetime=get_datetime("2026-10-18 08:30:15.123456"), name="GP-2026-00001|x")
+		self.assertEqual(decode_history_cursor(encode_history_cursor(row)), (row.scan_datetime, row.name))
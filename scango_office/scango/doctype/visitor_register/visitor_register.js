@@ -16,6 +16,14 @@ frappe.ui.form.on("Visitor Register", {
         if (frm.is_new()) {
             frm.set_value('visit_date', frappe.datetime.get_today());
         }
+
+        // QR Code ถูกสร้างใน background job - โหลดฟอร์มใหม่เมื่อสร้างเสร็จ
+        frappe.realtime.off('visitor_qr_code_ready');
+        frappe.realtime.on('visitor_qr_code_ready', (data) => {
+            if (data && data.name === frm.doc.name && !frm.is_dirty()) {
+                frm.reload_doc();
+            }
+        });
     },
     
     birth_date: function(frm) {
@@ -4,31 +4,70 @@ import frappe
 from frappe.model.document import Document
 import re
 
+from scango_office.scango.anti_passback import claim_passback, record_passback, release_passback
+from scango_office.scango.gate_pass_archive import ARCHIVE_TABLE_PREFIX, get_gate_pass_tables
+from scango_office.scango.gate_topology import get_gate_topology
+from scango_office.scango.qr_payload import decode_qr_content, is_signed_qr_enabled, make_qr_payload
+from scango_office.scango.revoked_qr import is_qr_revoked, get_checkout_time
+from scango_office.scango.scan_debounce import (
+    claim_scan,
+    get_debounce_seconds,
+    get_idempotent_result,
+    release_scan,
+    remember_scan_result,
+)
+from scango_office.scango.scan_metrics import ScanTimer
+from scango_office.scango.visitor_images import enqueue_visitor_images, keep_image_variants
+from scango_office.scango.visitor_search import remove_from_search_index, update_search_index
+from scango_office.scango.watchlist import DENY as WATCHLIST_DENY
+from scango_office.scango.watchlist import get_watchlist_message, match_watchlist, publish_watchlist_alert
+from scango_office.scango.visit_expiry import CHECKED_OUT, EXPIRED, get_visit_status, mark_checked_out
+
+NAME_FIELDS = {
+    'first_name': 'ชื่อ',
+    'middle_name': 'ชื่อกลาง', 
+    'last_name': 'นามสกุล'
+}
+
+NAME_PATTERN = re.compile(r'^[a-zA-Zก-๙\s]+$')
+
+
+def is_valid_thai_id(national_id):
+    """Validate Thai National ID using checksum algorithm"""
+    if len(national_id) != 13:
+        return False
+    
+    sum_value = 0
+    for i in range(12):
+        sum_value += int(national_id[i]) * (13 - i)
+    
+    remainder = sum_value % 11
+    check_digit = (11 - remainder) % 10
+    
+    return int(national_id[12]) == check_digit
+
+
 class VisitorRegister(Document):
     def validate(self):
         """Validate visitor register fields"""
-        self.validate_name_fields()
-        self.validate_id_fields()
-        self.validate_birth_date()
-        self.calculate_age()
-        self.validate_visit_dates()
-        self.calculate_visit_duration()
-        self.validate_terms_acceptance()
+        self.flags.registration_timer = ScanTimer("registration")
+        with self.flags.registration_timer.stage("validate"):
+            self.validate_name_fields()
+            self.validate_id_fields()
+            self.validate_birth_date()
+            self.calculate_age()
+            self.validate_visit_dates()
+            self.calculate_visit_duration()
+            self.validate_terms_acceptance()
+            self.set_visit_status()
+            self.check_watchlist()
     
     def validate_name_fields(self):
         """Validate name fields to allow only Thai and English characters"""
-        name_fields = {
-            'first_name': 'ชื่อ',
-            'middle_name': 'ชื่อกลาง', 
-            'last_name': 'นามสกุล'
-        }
-        
-        pattern = r'^[a-zA-Zก-๙\s]+$'
-        
-        for field_name, label in name_fields.items():
+        for field_name, label in NAME_FIELDS.items():
             if self.get(field_name):
                 value = self.get(field_name).strip()
-                if not re.match(pattern, value):
+                if not NAME_PATTERN.match(value):
                     frappe.throw(
                         f"ช่อง {label} สามารถกรอกได้เฉพาะตัวอักษรไทย-อังกฤษเท่านั้น",
                         title="ข้อมูลไม่ถูกต้อง"
@@ -77,17 +116,7 @@ class VisitorRegister(Document):
     
     def is_valid_thai_id(self, national_id):
         """Validate Thai National ID using checksum algorithm"""
-        if len(national_id) != 13:
-            return False
-        
-        sum_value = 0
-        for i in range(12):
-            sum_value += int(national_id[i]) * (13 - i)
-        
-        remainder = sum_value % 11
-        check_digit = (11 - remainder) % 10
-        
-        return int(national_id[12]) == check_digit
+        return is_valid_thai_id(national_id)
     
     def validate_passport_number(self):
         """No validation required for passport number"""
@@ -182,8 +211,26 @@ class VisitorRegister(Document):
                     title="จำเป็นต้องยอมรับเงื่อนไข"
                 )
 
+    def set_visit_status(self):
+        """Pre-compute the status gates read (Checkout keeps it Checked Out)"""
+        # อ่านจากฐานข้อมูล ไม่ใช่จากฟอร์ม - mark_checked_out ไม่เปลี่ยน modified ฟอร์มที่เปิดค้างไว้จึงยังเป็น Active
+        checked_out = not self.is_new() and frappe.db.get_value(
+            "Visitor Register", self.name, "visit_status", for_update=True) == CHECKED_OUT
+        self.visit_status = get_visit_status(self.visit_end_date, checked_out=checked_out)
+
+    def check_watchlist(self):
+        """Refuse visitors on the Deny watchlist, link the entry for flagged ones"""
+        entry = match_watchlist(self)
+        self.watchlist_entry = entry.name if entry else None
+        if not entry:
+            return
+        
+        if entry.action == WATCHLIST_DENY:
+            frappe.throw(get_watchlist_message(entry), title="ไม่อนุญาตให้ลงทะเบียน")
+        frappe.msgprint(get_watchlist_message(entry), title="รายชื่อเฝ้าระวัง", indicator="orange")
+
     def before_save(self):
-        """Clean up data and generate QR code before saving"""
+        """Clean up data before saving"""
         name_fields = ['first_name', 'middle_name', 'last_name']
         for field in name_fields:
             if self.get(field):
@@ -196,170 +243,430 @@ class VisitorRegister(Document):
         if self.passport_number:
             self.passport_number = self.passport_number.upper().replace(' ', '')
         
-        if self.visitor_photo and self.terms_accepted:
-            self.generate_qr_code()
+        keep_image_variants(self)
+        self.keep_qr_code()
+        
+    def keep_qr_code(self):
+        """Keep the QR code written by generate_visitor_qr_code from the database"""
+        # job บันทึกด้วย update_modified=False ฟอร์มที่เปิดไว้ก่อน job เสร็จจึงยังมีค่าว่าง (หรือ QR ไฟล์เดิมที่ถูกลบแล้ว)
+        if self.is_new():
+            return
+        values = frappe.db.get_value("Visitor Register", self.name, ["qr_code", "qr_content_hash"], as_dict=True)
+        if values:
+            self.update(values)
+    
+    def on_update(self):
+        """Queue QR code rendering / image processing and refresh the search index when their inputs have changed"""
+        timer = self.flags.registration_timer or ScanTimer("registration")
+        with timer.stage("enqueue_qr"):
+            if self.visitor_photo and self.terms_accepted and self.qr_code_needs_update():
+                enqueue_visitor_qr_code(self.name)
+        with timer.stage("enqueue_images"):
+            enqueue_visitor_images(self)
+        with timer.stage("search_index"):
+            update_search_index(self)
+        timer.finish(visitor=self.name)
+
+    def on_trash(self):
+        remove_from_search_index(self.name)
+
+    def get_qr_content(self):
+        """Content encoded in the visitor's QR code (signed payload when enabled)"""
+        if is_signed_qr_enabled() and self.visit_date and self.visit_end_date:
+            return make_qr_payload(self.name, self.visit_date, self.visit_end_date)
+        return self.name
+
+    def get_qr_content_hash(self):
+        import hashlib
+        return hashlib.sha256(self.get_qr_content().encode()).hexdigest()
+
+    def qr_code_needs_update(self):
+        return not self.qr_code or self.qr_content_hash != self.get_qr_content_hash()
 
     def generate_qr_code(self):
-        """Generate QR code with visitor ID only"""
-        import qrcode
+        """Render the QR code PNG and attach it (runs in a background job)"""
         import io
-        import base64
         
         if not self.name:
             return
         
+        timer = ScanTimer("qr_code")
         try:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(self.name)
-            qr.make(fit=True)
-            
-            qr_img = qr.make_image(fill_color="black", back_color="white")
+            import qrcode
             
-            img_buffer = io.BytesIO()
-            qr_img.save(img_buffer, format='PNG')
-            img_str = base64.b64encode(img_buffer.getvalue()).decode()
+            with timer.stage("render"):
+                qr_content = self.get_qr_content()
+                qr = qrcode.QRCode(
+                    version=1,
+                    error_correction=qrcode.constants.ERROR_CORRECT_L,
+                    box_size=10,
+                    border=4,
+                )
+                qr.add_data(qr_content)
+                qr.make(fit=True)
+                
+                qr_img = qr.make_image(fill_color="black", back_color="white")
+                
+                img_buffer = io.BytesIO()
+                qr_img.save(img_buffer, format='PNG')
             
             from frappe.utils.file_manager import save_file
-            file_doc = save_file(
-                fname=f"qr_code_{self.name}.png",
-                content=base64.b64decode(img_str),
-                dt=self.doctype,
-                dn=self.name,
-                is_private=1
-            )
+            with timer.stage("save_file"):
+                file_doc = save_file(
+                    fname=f"qr_code_{self.name}.png",
+                    content=img_buffer.getvalue(),
+                    dt=self.doctype,
+                    dn=self.name,
+                    df="qr_code",
+                    is_private=1
+                )
+            
+            old_qr_code = self.qr_code
+            with timer.stage("db_set"):
+                self.db_set({
+                    "qr_code": file_doc.file_url,
+                    "qr_content_hash": self.get_qr_content_hash()
+                }, update_modified=False)
             
-            self.qr_code = file_doc.file_url
+            # ลบไฟล์ QR เดิมที่ไม่ได้ใช้แล้ว
+            with timer.stage("cleanup"):
+                if old_qr_code and old_qr_code != file_doc.file_url:
+                    for old_file in frappe.get_all("File", filters={
+                        "attached_to_doctype": self.doctype,
+                        "attached_to_name": self.name,
+                        "file_url": old_qr_code
+                    }, pluck="name"):
+                        frappe.delete_doc("File", old_file, ignore_permissions=True)
             
-            frappe.msgprint(
-                f"QR Code สร้างเรียบร้อย (ID: {self.name})",
-                title="QR Code พร้อมใช้งาน",
-                indicator="green"
+            frappe.publish_realtime(
+                "visitor_qr_code_ready",
+                {"name": self.name, "qr_code": file_doc.file_url},
+                doctype=self.doctype,
+                docname=self.name
             )
             
         except ImportError:
-            frappe.msgprint(
-                "กรุณาติดตั้ง: pip install qrcode[pil] เพื่อสร้าง QR Code",
-                title="ต้องติดตั้ง Library",
-                indicator="orange"
-            )
+            frappe.log_error("กรุณาติดตั้ง: pip install qrcode[pil] เพื่อสร้าง QR Code")
         except Exception as e:
             frappe.log_error(f"Error generating QR Code: {str(e)}")
-            frappe.msgprint(
-                "เกิดข้อผิดพลาดในการสร้าง QR Code",
-                title="ข้อผิดพลาด",
-                indicator="red"
-            )
+        finally:
+            timer.finish(visitor=self.name)
+
+
+def enqueue_visitor_qr_code(visitor_id):
+    """Queue generate_visitor_qr_code after commit (one job per visitor)"""
+    frappe.enqueue(
+        "scango_office.scango.doctype.visitor_register.visitor_register.generate_visitor_qr_code",
+        queue="short",
+        job_id=f"visitor_qr_code::{visitor_id}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        visitor_id=visitor_id
+    )
+
+
+def generate_visitor_qr_code(visitor_id):
+    """Background job: render the QR code of a Visitor Register if its content changed"""
+    visitor = frappe.get_doc("Visitor Register", visitor_id)
+    
+    if not (visitor.visitor_photo and visitor.terms_accepted):
+        return
+    
+    if not visitor.qr_code_needs_update():
+        return
+    
+    visitor.generate_qr_code()
+
+
+def on_doctype_update():
+    # สำหรับ job expire_overdue_visits (visit_status = Active and visit_end_date < วันนี้)
+    frappe.db.add_index("Visitor Register", ["visit_status", "visit_end_date"], index_name="visit_status_end_date_index")
+
+
+# ==================== Scan Response ====================
+
+# ฟิลด์ของผู้เยี่ยมชมที่ส่งกลับในผลการสแกน แยกตามประเภทเครื่อง (ไม่ส่งเลขบัตร / เลขหนังสือเดินทาง)
+# ปรับได้ใน site_config: "scango_scan_response_fields": {"In": ["name", "first_name", ...], ...}
+SCAN_RESPONSE_FIELDS = {
+    "In": ["name", "title", "first_name", "last_name"],
+    "Out": ["name", "title", "first_name", "last_name"],
+    "Checkout": ["name", "title", "first_name", "last_name"],
+    "CheckStatus": ["name", "title", "first_name", "last_name", "visit_date", "visit_end_date",
+                    "visit_status", "purpose", "person_to_meet", "visitor_photo_medium"],
+}
+
+# ฟิลด์ที่ขอเพิ่มได้ผ่าน extra_fields
+SCAN_EXTRA_FIELDS = ("middle_name", "gender", "nationality", "phone_number", "visit_date", "visit_end_date",
+    "total_days", "visit_status", "purpose", "other_purpose_details", "person_to_meet", "items_to_bring",
+    "visitor_photo", "visitor_photo_thumbnail", "visitor_photo_medium", "qr_code")
+
+# ฟิลด์ที่ต้องใช้ตรวจสถานะ QR รายชื่อเฝ้าระวัง และบันทึก gate pass (ไม่ส่งกลับถ้าไม่อยู่ใน response fields)
+VISITOR_STATUS_FIELDS = ["name", "first_name", "last_name", "visit_date", "visit_end_date", "visit_status",
+    "thai_national_id", "passport_number"]
+
+
+def get_scan_response_fields(action_type, extra_fields=None):
+    """Visitor fields returned for a machine type, plus allowed extras (list, JSON list or comma separated)"""
+    configured = frappe.conf.get("scango_scan_response_fields") or {}
+    fields = list(configured.get(action_type) or SCAN_RESPONSE_FIELDS.get(action_type)
+                  or SCAN_RESPONSE_FIELDS["CheckStatus"])
+    
+    if extra_fields:
+        if isinstance(extra_fields, str):
+            extra_fields = (frappe.parse_json(extra_fields) if extra_fields.startswith("[")
+                            else extra_fields.split(","))
+        for field in extra_fields:
+            field = field.strip()
+            if field in SCAN_EXTRA_FIELDS and field not in fields:
+                fields.append(field)
+    
+    meta = frappe.get_meta("Visitor Register")
+    return [field for field in fields if field == "name" or meta.has_field(field)]
+
+
+def load_scan_visitor(visitor_id, response_fields):
+    """Read only the columns needed for the status check and the response (None if not found)"""
+    fields = list(dict.fromkeys([*VISITOR_STATUS_FIELDS, *response_fields]))
+    return frappe.db.get_value("Visitor Register", visitor_id, fields, as_dict=True)
+
+
+def project_visitor(visitor, fields):
+    return {field: visitor.get(field) for field in fields}
+
+
+def apply_watchlist(status, visitor, gate_machine=None):
+    """Add the watchlist match to a scan status, turn a valid status into a denial for Deny entries"""
+    entry = match_watchlist(visitor)
+    if not entry:
+        return status
+    
+    publish_watchlist_alert(visitor.get("name"), entry, gate_machine)
+    watchlist = {"action": entry.action, "message": get_watchlist_message(entry)}
+    # ไม่ปิดทางออก - รายชื่อห้ามเข้าจะถูกปฏิเสธเฉพาะตอนเข้า / ตรวจสถานะ
+    if entry.action == WATCHLIST_DENY and status.get("valid") and status.get("action_type") not in ("Out", "Checkout"):
+        return {
+            "valid": False,
+            "message": watchlist["message"],
+            "status": "watchlist_denied",
+            "action_type": status.get("action_type"),
+            "watchlist": watchlist
+        }
+    return {**status, "watchlist": watchlist}
 
 
 # ==================== Gate Pass Functions ====================
 
 @frappe.whitelist()
-def check_qr_status(visitor_id):
+def check_qr_status(visitor_id, extra_fields=None):
     """Check if visitor can check in (not checked out yet)"""
+    timer = ScanTimer("check_status")
     try:
-        visitor = frappe.get_doc("Visitor Register", visitor_id)
-        
-        # ตรวจสอบว่ามี Checkout record หรือยัง (ตรวจสอบเข้มงวด)
-        checkout_records = frappe.get_all("Visitor Gate Pass", 
-            filters={
-                "visitor_register": visitor_id,
-                "action_type": "Checkout"
-            },
-            limit=1
-        )
+        with timer.stage("decode"):
+            decoded = decode_qr_content(visitor_id)
+        if decoded.get("error"):
+            return decoded["error"]
         
-        if checkout_records:
+        response_fields = get_scan_response_fields("CheckStatus", extra_fields)
+        with timer.stage("visitor"):
+            visitor = load_scan_visitor(decoded["visitor_id"], response_fields)
+        if not visitor:
             return {
                 "valid": False,
-                "message": "QR Code นี้ถูกใช้ Checkout ไปแล้ว ไม่สามารถใช้งานอีกได้",
-                "status": "checked_out",
-                "checkout_time": checkout_records[0].get("scan_datetime")
+                "message": "ไม่พบข้อมูลผู้เยี่ยมชม",
+                "status": "not_found"
             }
         
-        # ตรวจสอบวันหมดอายุ
-        from frappe.utils import getdate, today
-        today_date = getdate(today())
-        
-        if visitor.visit_date:
-            start_date = getdate(visitor.visit_date)
-            if today_date < start_date:
-                return {
-                    "valid": False,
-                    "message": "QR Code ยังไม่ถึงวันที่ใช้งาน",
-                    "status": "not_started"
-                }
-        
-        if visitor.visit_end_date:
-            end_date = getdate(visitor.visit_end_date)
-            if today_date > end_date:
-                return {
-                    "valid": False,
-                    "message": "QR Code หมดอายุแล้ว",
-                    "status": "expired"
-                }
+        with timer.stage("status"):
+            status = get_visitor_status(visitor, fields=response_fields)
+        with timer.stage("watchlist"):
+            return apply_watchlist(status, visitor)
         
+    except Exception as e:
+        frappe.log_error(f"Check QR Status Error: {str(e)}")
         return {
-            "valid": True,
-            "message": "QR Code ใช้งานได้",
-            "status": "active",
-            "visitor": visitor.as_dict()
+            "valid": False,
+            "message": f"เกิดข้อผิดพลาด: {str(e)}",
+            "status": "error"
         }
-        
-    except frappe.DoesNotExistError:
+    finally:
+        timer.finish(visitor=visitor_id)
+
+
+def get_visitor_status(visitor, fields=None):
+    """
+    Work out the QR status of an already loaded Visitor Register
+    วันที่ใช้งานถูกตรวจจากฐานข้อมูลเสมอ แม้ QR แบบ signed จะผ่านการตรวจวันที่ในลายเซ็นแล้ว
+    fields: ฟิลด์ของผู้เยี่ยมชมที่ส่งกลับเมื่อใช้งานได้ (ค่าเริ่มต้นตามเครื่อง CheckStatus)
+    """
+    fields = fields or SCAN_RESPONSE_FIELDS["CheckStatus"]
+    # ตรวจสอบว่ามี Checkout record หรือยัง (ตรวจสอบเข้มงวด)
+    # ใช้ visit_status ที่คำนวณไว้แล้ว และใช้ revoked QR cache เฉพาะแถวที่ยังไม่มีสถานะ
+    visit_status = visitor.get("visit_status")
+    if visit_status == CHECKED_OUT or (not visit_status and is_qr_revoked(visitor.name)):
         return {
             "valid": False,
-            "message": "ไม่พบข้อมูลผู้เยี่ยมชม",
-            "status": "not_found"
+            "message": "QR Code นี้ถูกใช้ Checkout ไปแล้ว ไม่สามารถใช้งานอีกได้",
+            "status": "checked_out",
+            "checkout_time": get_checkout_time(visitor.name)
         }
-    except Exception as e:
-        frappe.log_error(f"Check QR Status Error: {str(e)}")
+    
+    if visit_status == EXPIRED:
         return {
             "valid": False,
-            "message": f"เกิดข้อผิดพลาด: {str(e)}",
-            "status": "error"
+            "message": "QR Code หมดอายุแล้ว",
+            "status": "expired"
         }
+    
+    # ตรวจสอบวันหมดอายุ (ช่วงก่อน job expire_overdue_visits จะปรับสถานะ หรือวันที่ถูกแก้หลังพิมพ์ QR)
+    from frappe.utils import getdate, today
+    today_date = getdate(today())
+    
+    if visitor.visit_date:
+        start_date = getdate(visitor.visit_date)
+        if today_date < start_date:
+            return {
+                "valid": False,
+                "message": "QR Code ยังไม่ถึงวันที่ใช้งาน",
+                "status": "not_started"
+            }
+    
+    if visitor.visit_end_date:
+        end_date = getdate(visitor.visit_end_date)
+        if today_date > end_date:
+            return {
+                "valid": False,
+                "message": "QR Code หมดอายุแล้ว",
+                "status": "expired"
+            }
+    
+    return {
+        "valid": True,
+        "message": "QR Code ใช้งานได้",
+        "status": "active",
+        "visitor": project_visitor(visitor, fields)
+    }
+
+
+def get_machine_gate_info(gate_machine):
+    """Resolve a Machine Gate to its building gate, building name and action"""
+    return get_gate_topology(gate_machine)
 
 
 @frappe.whitelist()
-def process_gate_scan(visitor_id, gate_machine, building_gate, building_name, action_type):
+def process_gate_scan(visitor_id, gate_machine, building_gate=None, building_name=None, action_type=None,
+                      idempotency_key=None, extra_fields=None):
     """
     Process QR scan at gate
     action_type: 'In', 'Out', 'CheckStatus', หรือ 'Checkout'
+    
+    ถ้าไม่ส่ง building_gate / building_name / action_type มา จะอ่านจาก Machine Gate
+    ให้เอง เพื่อให้หน้า gate เรียกครั้งเดียวจบ (ตรวจสอบ + บันทึก + ตอบผล)
+    
+    idempotency_key: request เดิมที่ส่งซ้ำจะได้ผลเดิมโดยไม่บันทึกใหม่
+    การสแกน (visitor, เครื่อง, action) เดียวกันซ้ำภายในช่วง debounce ก็ได้ผลเดิมเช่นกัน
+    
+    ข้อมูลผู้เยี่ยมชมในผลลัพธ์มีเฉพาะฟิลด์ตามประเภทเครื่อง (SCAN_RESPONSE_FIELDS) + extra_fields
+    
+    กฎ anti-passback ของอาคาร / ประตู ตรวจกับสถานะล่าสุดใน Redis (ไม่อ่านประวัติการสแกน)
     """
+    timer = ScanTimer("scan", gate_machine)
+    claimed = recorded = False
+    passback_claim = None
     try:
-        # ตรวจสอบสถานะ QR ก่อนเสมอ (ยกเว้น CheckStatus)
-        status = check_qr_status(visitor_id)
+        if idempotency_key:
+            previous = get_idempotent_result(idempotency_key)
+            if previous:
+                return previous
+        
+        if not (building_gate and building_name and action_type):
+            with timer.stage("topology"):
+                machine = get_machine_gate_info(gate_machine)
+            if not machine:
+                return {
+                    "valid": False,
+                    "message": f"ไม่พบ Machine Gate: {gate_machine}",
+                    "status": "machine_not_found"
+                }
+            building_gate = building_gate or machine.building_gate
+            building_name = building_name or machine.building_name
+            action_type = action_type or machine.use_for
+        
+        # QR แบบ signed ถูกปฏิเสธได้ทันทีถ้าปลอมหรือหมดอายุ โดยไม่ต้องอ่านฐานข้อมูล
+        with timer.stage("decode"):
+            decoded = decode_qr_content(visitor_id)
+        if decoded.get("error"):
+            return {**decoded["error"], "action_type": action_type}
+        visitor_id = decoded["visitor_id"]
+        
+        # QR ที่ค้างหน้ากล้อง: คืนผลของการสแกนครั้งแรกแทนการบันทึกซ้ำ
+        if action_type != "CheckStatus":
+            with timer.stage("debounce"):
+                claimed, previous = claim_scan(visitor_id, gate_machine, action_type)
+            if previous:
+                return previous
+        
+        # อ่านเฉพาะฟิลด์ที่ต้องใช้ตรวจสถานะ บันทึก และส่งกลับ (ไม่โหลดทั้งเอกสาร)
+        response_fields = get_scan_response_fields(action_type, extra_fields)
+        with timer.stage("visitor"):
+            visitor = load_scan_visitor(visitor_id, response_fields)
+        
+        if not visitor:
+            return {
+                "valid": False,
+                "message": "ไม่พบข้อมูลผู้เยี่ยมชม",
+                "status": "not_found",
+                "action_type": action_type
+            }
+        
+        # ตรวจสอบสถานะ QR ก่อนเสมอ (รวมการตรวจ Checkout / revoked QR)
+        with timer.stage("status"):
+            status = get_visitor_status(visitor, fields=response_fields)
+        status["action_type"] = action_type
+        
+        # รายชื่อเฝ้าระวัง (index ใน memory) - Deny ห้ามผ่าน, Flag ผ่านได้แต่แจ้งเตือน
+        with timer.stage("watchlist"):
+            status = apply_watchlist(status, visitor, gate_machine)
         
         # ถ้าเป็น CheckStatus ให้ดูสถานะอย่างเดียว ไม่บันทึก
         if action_type == "CheckStatus":
             return status
         
         # สำหรับ In, Out, Checkout - ต้อง valid เท่านั้น
+        # ห้ามบันทึก gate pass ถ้า QR ไม่ valid
         if not status["valid"]:
-            # ห้ามบันทึก gate pass ถ้า QR ไม่ valid
-            frappe.throw(status["message"], title="QR Code ไม่สามารถใช้งานได้")
+            return status
         
-        visitor = frappe.get_doc("Visitor Register", visitor_id)
+        # anti-passback: ตรวจและจองสถานะใหม่ของผู้เยี่ยมชมแบบ atomic (ประตูอื่นที่สแกนพร้อมกันจะเห็นสถานะนี้)
+        with timer.stage("passback"):
+            passback_claim, violation = claim_passback(visitor_id, gate_machine, action_type)
+        if violation:
+            return {**violation, "visitor": status["visitor"]}
         
         # บันทึกการแสกนใน Visitor Gate Pass
-        gate_pass = frappe.get_doc({
-            "doctype": "Visitor Gate Pass",
-            "visitor_register": visitor_id,
-            "visitor_name": visitor.first_name or "",
-            "visitor_last_name": visitor.last_name or "",
-            "gate_machine": gate_machine,
-            "building_gate": building_gate,
-            "building_name": building_name,
-            "action_type": action_type,
-            "scan_datetime": frappe.utils.now_datetime()
-        })
-        gate_pass.insert(ignore_permissions=True)
-        frappe.db.commit()
+        with timer.stage("insert"):
+            gate_pass = frappe.get_doc({
+                "doctype": "Visitor Gate Pass",
+                "visitor_register": visitor_id,
+                "visitor_name": visitor.first_name or "",
+                "visitor_last_name": visitor.last_name or "",
+                "gate_machine": gate_machine,
+                "building_gate": building_gate,
+                "building_name": building_name,
+                "action_type": action_type,
+                "scan_datetime": frappe.utils.now_datetime(),
+                "idempotency_key": idempotency_key
+            })
+            try:
+                gate_pass.insert(ignore_permissions=True)
+                gate_pass_name = gate_pass.name
+            except frappe.UniqueValidationError:
+                # บันทึกด้วย idempotency key นี้ไปแล้ว (เช่นจาก sync_offline_scans)
+                frappe.db.rollback()
+                gate_pass_name = frappe.db.get_value("Visitor Gate Pass", {"idempotency_key": idempotency_key})
+                if not gate_pass_name:
+                    raise
+        with timer.stage("commit"):
+            frappe.db.commit()
         
         messages = {
             "In": "เข้าสถานที่สำเร็จ",
@@ -367,42 +674,366 @@ def process_gate_scan(visitor_id, gate_machine, building_gate, building_name, ac
             "Checkout": "Checkout สำเร็จ - QR Code ถูกปิดการใช้งานถาวร"
         }
         
-        return {
+        result = {
             "valid": True,
             "message": messages.get(action_type, "บันทึกสำเร็จ"),
             "status": "success",
             "action_type": action_type,
-            "visitor": visitor.as_dict(),
-            "gate_pass": gate_pass.name
+            "visitor": status["visitor"],
+            "gate_pass": gate_pass_name
         }
+        if status.get("watchlist"):
+            result["watchlist"] = status["watchlist"]
+        recorded = True
+        remember_scan_result(visitor_id, gate_machine, action_type, idempotency_key, result)
+        return result
         
     except Exception as e:
+        # ไม่เก็บ gate pass / ผลข้างเคียงที่บันทึกไปครึ่งทาง (request จะ commit ตามปกติหลังคืนค่า)
+        frappe.db.rollback()
         frappe.log_error(f"Gate Scan Error: {str(e)}")
         return {
             "valid": False,
             "message": f"เกิดข้อผิดพลาด: {str(e)}",
             "status": "error"
         }
+    finally:
+        if claimed and not recorded:
+            release_scan(visitor_id, gate_machine, action_type)
+        if passback_claim and not recorded:
+            release_passback(passback_claim)
+        timer.finish(visitor=visitor_id, action_type=action_type)
+
+
+def get_offline_scan_error(visitor, action_type, scan_datetime):
+    """
+    Apply the process_gate_scan rules to a scan made offline, at the time it was scanned
+    คืนข้อความที่ปฏิเสธ หรือ None ถ้าผ่าน (การตรวจ Checkout ทำแยกใน sync_offline_scans)
+    """
+    from frappe.utils import getdate
+    
+    scan_date = getdate(scan_datetime)
+    if visitor.visit_date and scan_date < getdate(visitor.visit_date):
+        return "QR Code ยังไม่ถึงวันที่ใช้งาน"
+    if visitor.visit_end_date and scan_date > getdate(visitor.visit_end_date):
+        return "QR Code หมดอายุแล้ว"
+    
+    # รายชื่อห้ามเข้า - ไม่ปิดทางออกเหมือน apply_watchlist
+    entry = match_watchlist(visitor)
+    if entry and entry.action == WATCHLIST_DENY and action_type not in ("Out", "Checkout"):
+        return get_watchlist_message(entry)
+    return None
 
 
 @frappe.whitelist()
-def get_gate_pass_history(visitor_id):
-    """Get all gate pass history for a visitor"""
-    try:
-        history = frappe.get_all("Visitor Gate Pass",
-            filters={"visitor_register": visitor_id},
-            fields=["name", "visitor_name", "visitor_last_name", "gate_machine", 
-                    "building_gate", "building_name", "action_type", "scan_datetime"],
-            order_by="scan_datetime desc"
+def sync_offline_scans(gate_machine, scans):
+    """
+    Ingest scans a gate machine buffered while it was offline
+    scans: [{"idempotency_key", "visitor_id", "scan_datetime", "action_type"}, ...]
+    บันทึกทั้งชุดด้วย bulk insert และอัปเดต Visitor Presence ใน transaction เดียว
+    """
+    from datetime import timedelta
+
+    from frappe.model.naming import make_autoname
+    from frappe.utils import get_datetime, now_datetime
+    from scango_office.scango.doctype.gate_traffic_rollup.gate_traffic_rollup import add_to_traffic_rollup
+    from scango_office.scango.doctype.visitor_presence.visitor_presence import update_visitor_presence
+    from scango_office.scango.qr_payload import get_qr_visitor_id
+    from scango_office.scango.revoked_qr import add_revoked_qr, get_checkout_times
+
+    frappe.has_permission("Visitor Gate Pass", "create", throw=True)
+
+    scans = frappe.parse_json(scans) or []
+    # เรียงตามเวลาสแกน เพื่อให้ Checkout และการรวมสแกนซ้ำ (debounce) เป็นไปตามลำดับจริง
+    scans.sort(key=lambda scan: str(scan.get("scan_datetime") or ""))
+    machine = get_machine_gate_info(gate_machine)
+    if not machine:
+        return {
+            "success": False,
+            "message": f"ไม่พบ Machine Gate: {gate_machine}"
+        }
+
+    # QR แบบ signed: ใช้ visitor ID ในลายเซ็น ส่วน QR ที่ลายเซ็นไม่ถูกต้อง (หรือไม่มีลายเซ็นขณะบังคับใช้) จะถูกปฏิเสธ
+    for scan in scans:
+        scan["visitor_id"] = get_qr_visitor_id(scan.get("visitor_id"))
+
+    keys = [scan.get("idempotency_key") for scan in scans if scan.get("idempotency_key")]
+    existing_keys = set(frappe.get_all("Visitor Gate Pass",
+        filters={"idempotency_key": ["in", keys]},
+        pluck="idempotency_key"
+    )) if keys else set()
+
+    visitor_ids = list({scan.get("visitor_id") for scan in scans if scan.get("visitor_id")})
+    visitors = {v.name: v for v in frappe.get_all("Visitor Register",
+        filters={"name": ["in", visitor_ids]},
+        fields=VISITOR_STATUS_FIELDS
+    )} if visitor_ids else {}
+
+    # รวม Checkout ที่ถูกย้ายไปตาราง archive แล้วด้วย
+    checkout_times = {visitor_id: get_datetime(scan_datetime)
+                      for visitor_id, scan_datetime in get_checkout_times(visitor_ids).items()}
+
+    now = now_datetime()
+    user = frappe.session.user
+    autoname = frappe.get_meta("Visitor Gate Pass").autoname
+    results = []
+    gate_passes = []
+    # การสแกนที่รับไว้ล่าสุดของ (visitor, action) - QR ที่ค้างหน้ากล้องตอน offline ถูกรวมเป็นครั้งเดียว
+    debounce = timedelta(seconds=get_debounce_seconds())
+    last_accepted = {}
+
+    for scan in scans:
+        key = scan.get("idempotency_key")
+        visitor_id = scan.get("visitor_id")
+        action_type = scan.get("action_type") or machine.use_for
+
+        if not key:
+            results.append({"idempotency_key": key, "status": "rejected", "message": "ไม่มี idempotency key"})
+            continue
+        if key in existing_keys:
+            results.append({"idempotency_key": key, "status": "duplicate"})
+            continue
+        if visitor_id not in visitors:
+            results.append({"idempotency_key": key, "status": "rejected", "message": "ไม่พบข้อมูลผู้เยี่ยมชม"})
+            continue
+        if action_type == "CheckStatus":
+            results.append({"idempotency_key": key, "status": "ignored"})
+            existing_keys.add(key)
+            continue
+
+        scan_datetime = min(get_datetime(scan.get("scan_datetime")) if scan.get("scan_datetime") else now, now)
+        checkout_time = checkout_times.get(visitor_id)
+        if checkout_time and scan_datetime > checkout_time:
+            results.append({"idempotency_key": key, "status": "rejected", "message": "QR Code นี้ถูกใช้ Checkout ไปแล้ว"})
+            continue
+
+        last_scan = last_accepted.get((visitor_id, action_type))
+        if debounce and last_scan and scan_datetime - last_scan < debounce:
+            results.append({"idempotency_key": key, "status": "duplicate"})
+            existing_keys.add(key)
+            continue
+
+        visitor = visitors[visitor_id]
+        error = get_offline_scan_error(visitor, action_type, scan_datetime)
+        if error:
+            results.append({"idempotency_key": key, "status": "rejected", "message": error})
+            continue
+        last_accepted[(visitor_id, action_type)] = scan_datetime
+        if action_type == "Checkout":
+            checkout_times[visitor_id] = scan_datetime
+
+        gate_passes.append(frappe._dict({
+            "name": make_autoname(autoname, "Visitor Gate Pass"),
+            "visitor_register": visitor_id,
+            "visitor_name": visitor.first_name or "",
+            "visitor_last_name": visitor.last_name or "",
+            "gate_machine": gate_machine,
+            "building_gate": machine.building_gate,
+            "building_name": machine.building_name,
+            "action_type": action_type,
+            "scan_datetime": scan_datetime,
+            "idempotency_key": key
+        }))
+        existing_keys.add(key)
+        results.append({"idempotency_key": key, "status": "accepted"})
+
+    if gate_passes:
+        fields = list(gate_passes[0].keys())
+        frappe.db.bulk_insert("Visitor Gate Pass",
+            ["owner", "modified_by", "creation", "modified", "docstatus", *fields],
+            [[user, user, now, now, 0, *(gp[f] for f in fields)] for gp in gate_passes],
+            ignore_duplicates=True
+        )
+
+        # ignore_duplicates ข้ามแถวที่ชนกับ idempotency key ที่เพิ่งถูกบันทึกจากทางอื่น - นับเฉพาะแถวที่บันทึกจริง
+        inserted = {(row.name, row.idempotency_key) for row in frappe.get_all("Visitor Gate Pass",
+            filters={"name": ["in", [gp.name for gp in gate_passes]]},
+            fields=["name", "idempotency_key"]
+        )}
+        skipped = {gp.idempotency_key for gp in gate_passes if (gp.name, gp.idempotency_key) not in inserted}
+        gate_passes = [gp for gp in gate_passes if gp.idempotency_key not in skipped]
+        for result in results:
+            if result["idempotency_key"] in skipped:
+                result["status"] = "duplicate"
+
+    if gate_passes:
+        # อัปเดตสถานะด้วยการแสกนล่าสุดของแต่ละคน (update_visitor_presence ข้ามการแสกนที่เก่ากว่า)
+        latest = {}
+        for gp in sorted(gate_passes, key=lambda gp: gp.scan_datetime):
+            latest[gp.visitor_register] = gp
+            if gp.action_type == "Checkout":
+                add_revoked_qr(gp.visitor_register)
+        for gp in latest.values():
+            update_visitor_presence(gp)
+        mark_checked_out({gp.visitor_register for gp in gate_passes if gp.action_type == "Checkout"})
+        add_to_traffic_rollup(gate_passes)
+        record_passback(gate_passes)
+
+    frappe.db.commit()
+
+    return {
+        "success": True,
+        "accepted": len(gate_passes),
+        "results": results
+    }
+
+
+GATE_PASS_HISTORY_FIELDS = ["name", "visitor_name", "visitor_last_name", "gate_machine", 
+    "building_gate", "building_name", "action_type", "scan_datetime"]
+
+MAX_HISTORY_PAGE_LENGTH = 500
+
+
+def encode_history_cursor(row):
+    import base64
+    raw = f"{row.scan_datetime.isoformat()}|{row.name}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_history_cursor(cursor):
+    import base64
+    from frappe.utils import get_datetime
+    scan_datetime, name = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    return get_datetime(scan_datetime), name
+
+
+def build_gate_pass_history_query(visitor_id=None, from_date=None, to_date=None, action_type=None, fields=None, table=None,
+                                  building_name=None, building_gate=None):
+    """Query on Visitor Gate Pass (or one of its archive tables) with the history filters applied"""
+    from frappe.utils import add_days, getdate
+    
+    GatePass = frappe.qb.Table(table) if table else frappe.qb.DocType("Visitor Gate Pass")
+    if fields is None:
+        fields = GATE_PASS_HISTORY_FIELDS
+    query = frappe.qb.from_(GatePass).select(*[GatePass[f] for f in fields])
+    
+    if visitor_id:
+        query = query.where(GatePass.visitor_register == visitor_id)
+    if building_name:
+        query = query.where(GatePass.building_name == building_name)
+    if building_gate:
+        query = query.where(GatePass.building_gate == building_gate)
+    if action_type:
+        action_types = frappe.parse_json(action_type) if action_type.startswith("[") else [action_type]
+        query = query.where(GatePass.action_type.isin(action_types))
+    if from_date:
+        query = query.where(GatePass.scan_datetime >= getdate(from_date))
+    if to_date:
+        query = query.where(GatePass.scan_datetime < add_days(getdate(to_date), 1))
+    
+    return GatePass, query
+
+
+def get_history_tables(from_date=None, to_date=None, before=None):
+    """Live + archive tables that can hold rows in the requested range (newest first)"""
+    from frappe.utils import getdate, get_first_day, get_last_day
+    
+    tables = []
+    for table in get_gate_pass_tables():
+        month = table[len(ARCHIVE_TABLE_PREFIX):] if table.startswith(ARCHIVE_TABLE_PREFIX) else None
+        if month:
+            month_start = getdate(f"{month[:4]}-{month[4:]}-01")
+            if to_date and month_start > getdate(to_date):
+                continue
+            if before and month_start > getdate(before):
+                continue
+            if from_date and get_last_day(month_start) < getdate(from_date):
+                continue
+        tables.append(table)
+    return tables
+
+
+def get_gate_pass_page(cursor=None, page_length=50, **filters):
+    """
+    One keyset page ordered by (scan_datetime desc, name desc), across live and archived gate passes
+    คืนค่า (rows, next_cursor) โดย next_cursor เป็น None เมื่อถึงหน้าสุดท้าย
+    """
+    from frappe.query_builder import Order
+    
+    cursor_datetime = cursor_name = None
+    if cursor:
+        cursor_datetime, cursor_name = decode_history_cursor(cursor)
+    
+    rows = []
+    for table in get_history_tables(filters.get("from_date"), filters.get("to_date"), cursor_datetime):
+        GatePass, query = build_gate_pass_history_query(table=table, **filters)
+        if cursor:
+            query = query.where(
+                (GatePass.scan_datetime < cursor_datetime)
+                | ((GatePass.scan_datetime == cursor_datetime) & (GatePass.name < cursor_name))
+            )
+        
+        rows += (
+            query.where(GatePass.scan_datetime.isnotnull())
+            .orderby(GatePass.scan_datetime, order=Order.desc)
+            .orderby(GatePass.name, order=Order.desc)
+            .limit(page_length + 1 - len(rows))
+            .run(as_dict=True)
         )
+        if len(rows) > page_length:
+            break
+    
+    if len(rows) > page_length:
+        rows = rows[:page_length]
+        return rows, encode_history_cursor(rows[-1])
+    return rows, None
+
+
+def iter_gate_pass_pages(page_length=1000, **filters):
+    """Yield keyset pages of gate passes so callers can walk large histories in constant memory"""
+    cursor = None
+    while True:
+        rows, cursor = get_gate_pass_page(cursor, page_length, **filters)
+        if rows:
+            yield rows
+        if not cursor:
+            break
+
+
+@frappe.whitelist()
+def get_gate_pass_history(visitor_id, cursor=None, page_length=50, from_date=None, to_date=None, action_type=None):
+    """
+    Get gate pass history for a visitor, one page at a time (newest first)
+    ส่ง next_cursor ที่ได้กลับมาเป็น cursor เพื่อขอหน้าถัดไป
+    """
+    from frappe.utils import cint
+    
+    try:
+        page_length = min(max(cint(page_length), 1), MAX_HISTORY_PAGE_LENGTH)
+        history, next_cursor = get_gate_pass_page(cursor, page_length,
+            visitor_id=visitor_id, from_date=from_date, to_date=to_date, action_type=action_type)
         
         return {
             "success": True,
             "history": history,
-            "total_scans": len(history)
+            "next_cursor": next_cursor,
+            "has_more": bool(next_cursor)
         }
     except Exception as e:
         return {
             "success": False,
             "message": str(e)
-        }
\ No newline at end of file
+        }
+
+
+@frappe.whitelist()
+def get_gate_pass_history_count(visitor_id, from_date=None, to_date=None, action_type=None):
+    """Number of gate passes matching the history filters (COUNT only, no rows)"""
+    from frappe.query_builder.functions import Count
+    
+    try:
+        total = 0
+        for table in get_history_tables(from_date, to_date):
+            GatePass, query = build_gate_pass_history_query(visitor_id, from_date, to_date, action_type,
+                fields=[], table=table)
+            total += query.select(Count(GatePass.name)).run()[0][0]
+        
+        return {
+            "success": True,
+            "total_scans": total
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": str(e)
+        }
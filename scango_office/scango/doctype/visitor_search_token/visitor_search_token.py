@@ -0,0 +1,14 @@
+# Copyright (c) 2026, kunpriya-natpaphat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class VisitorSearchToken(Document):
+	pass
+
+
+def on_doctype_update():
+	# ค้นหาแบบ exact / prefix ด้วย (token_type, token) แล้วอ่าน visitor_register จาก index เดียวกัน
+	frappe.db.add_index("Visitor Search Token", ["token_type", "token", "visitor_register"], index_name="token_lookup_index")
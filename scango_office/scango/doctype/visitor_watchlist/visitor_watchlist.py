@@ -0,0 +1,22 @@
+# Copyright (c) 2026, kunpriya-natpaphat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+from scango_office.scango.watchlist import clear_watchlist_cache
+
+
+class VisitorWatchlist(Document):
+	def validate(self):
+		if not (self.thai_national_id or self.passport_number or (self.first_name and self.last_name)):
+			frappe.throw(
+				"กรุณากรอกเลขบัตรประชาชน เลขหนังสือเดินทาง หรือชื่อและนามสกุล",
+				title="ข้อมูลไม่ครบ"
+			)
+
+	def on_update(self):
+		clear_watchlist_cache()
+
+	def on_trash(self):
+		clear_watchlist_cache()
@@ -0,0 +1,119 @@
+# Visitor Gate Pass archival
+#
+# ย้ายแถวที่เก่ากว่าระยะเวลาที่กำหนดออกจากตาราง Visitor Gate Pass ไปเก็บในตาราง archive รายเดือน
+# (`tabVisitor Gate Pass Archive YYYYMM`) ทีละชุด เพื่อให้ตารางหลักมีขนาดคงที่
+#
+# site_config.json
+#   "scango_gate_pass_retention_days": 365    (ค่าเริ่มต้น 365 วัน)
+
+import frappe
+from frappe.utils import add_days, cint, getdate, today
+
+LIVE_TABLE = "tabVisitor Gate Pass"
+ARCHIVE_TABLE_PREFIX = "tabVisitor Gate Pass Archive "
+ARCHIVE_TABLES_CACHE_KEY = "scango:gate_pass_archive_tables"
+
+DEFAULT_RETENTION_DAYS = 365
+ARCHIVE_CHUNK_SIZE = 5000
+# จำกัดจำนวนชุดต่อการรันหนึ่งครั้ง ส่วนที่เหลือจะถูกย้ายในรอบถัดไป
+MAX_CHUNKS_PER_RUN = 200
+
+
+def get_retention_days():
+    return cint(frappe.conf.get("scango_gate_pass_retention_days")) or DEFAULT_RETENTION_DAYS
+
+
+def get_archive_cutoff():
+    return getdate(add_days(today(), -get_retention_days()))
+
+
+def get_archive_tables():
+    """Archive table names, newest month first"""
+    try:
+        tables = frappe.cache.get_value(ARCHIVE_TABLES_CACHE_KEY)
+    except Exception:
+        tables = None
+
+    if tables is None:
+        tables = sorted(
+            (row[0] for row in frappe.db.sql("show tables like %s", (ARCHIVE_TABLE_PREFIX + "%",))),
+            reverse=True
+        )
+        try:
+            frappe.cache.set_value(ARCHIVE_TABLES_CACHE_KEY, tables)
+        except Exception:
+            pass
+    return tables
+
+
+def get_gate_pass_tables():
+    """Live table followed by the archive tables (newest first)"""
+    return [LIVE_TABLE, *get_archive_tables()]
+
+
+def ensure_archive_table(month):
+    table = f"{ARCHIVE_TABLE_PREFIX}{month}"
+    if table not in get_archive_tables():
+        frappe.db.sql_ddl(f"create table if not exists `{table}` like `{LIVE_TABLE}`")
+        frappe.cache.delete_value(ARCHIVE_TABLES_CACHE_KEY)
+    sync_archive_columns(table)
+    sync_archive_indexes(table)
+    return table
+
+
+def sync_archive_columns(table):
+    """Add columns that were added to Visitor Gate Pass after the archive table was created"""
+    archive_columns = {row[0] for row in frappe.db.sql(f"show columns from `{table}`")}
+    for row in frappe.db.sql(f"show columns from `{LIVE_TABLE}`", as_dict=True):
+        if row.Field not in archive_columns:
+            frappe.db.sql_ddl(f"alter table `{table}` add column `{row.Field}` {row.Type}")
+
+
+def sync_archive_indexes(table):
+    """Add Visitor Gate Pass indexes that were added after the archive table was created"""
+    from scango_office.scango.doctype.visitor_gate_pass.visitor_gate_pass import GATE_PASS_INDEXES
+
+    # add_index ข้ามดัชนีที่มีอยู่แล้ว
+    for index_name, fields in GATE_PASS_INDEXES.items():
+        frappe.db.add_index(table[len("tab"):], fields, index_name=index_name)
+
+
+def archive_gate_passes():
+    """Move gate passes older than the retention window into monthly archive tables (scheduled)"""
+    cutoff = get_archive_cutoff()
+    columns = None
+    # ตรวจ/เพิ่มคอลัมน์และดัชนีของตาราง archive ครั้งเดียวต่อตารางต่อการรัน
+    tables = {}
+
+    for _ in range(MAX_CHUNKS_PER_RUN):
+        rows = frappe.db.sql(f"""
+            select name, date_format(scan_datetime, '%%Y%%m') as month
+            from `{LIVE_TABLE}`
+            where scan_datetime < %s
+            order by scan_datetime asc
+            limit %s
+        """, (cutoff, ARCHIVE_CHUNK_SIZE), as_dict=True)
+        if not rows:
+            break
+
+        if columns is None:
+            columns = ", ".join(f"`{row[0]}`" for row in frappe.db.sql(f"show columns from `{LIVE_TABLE}`"))
+
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row.month, []).append(row.name)
+
+        # DDL ทำให้ commit อัตโนมัติ จึงสร้างตารางให้ครบก่อนเริ่มย้ายข้อมูล
+        for month in by_month:
+            if month not in tables:
+                tables[month] = ensure_archive_table(month)
+
+        for month, names in by_month.items():
+            table = tables[month]
+            frappe.db.sql(
+                f"insert ignore into `{table}` ({columns}) select {columns} from `{LIVE_TABLE}` where name in %s",
+                (names,)
+            )
+            frappe.db.sql(f"delete from `{LIVE_TABLE}` where name in %s", (names,))
+
+        frappe.db.commit()
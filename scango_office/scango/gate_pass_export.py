@@ -0,0 +1,212 @@
+# Gate pass export
+#
+# ส่งออก Visitor Gate Pass (รวมตาราง archive) เป็น CSV / XLSX ใน background job
+# อ่านทีละหน้าแบบ keyset (iter_gate_pass_pages) และเขียนลงไฟล์ทีละแถว หน่วยความจำจึงคงที่
+# ไม่ว่าจะส่งออกกี่แถว ข้อมูลจาก Visitor Register ถูกอ่านเป็นชุดตามหน้า (ไม่ join ทั้งตาราง)
+#
+# ไฟล์ถูกเก็บเป็น private File ของผู้ที่สั่งส่งออก และแจ้งลิงก์ดาวน์โหลดผ่าน realtime
+# (event scango_gate_pass_export) หรือถามสถานะได้ที่ get_gate_pass_export
+
+import csv
+import hashlib
+import os
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from scango_office.scango.doctype.visitor_register.visitor_register import iter_gate_pass_pages
+
+EXPORT_STATUS_PREFIX = "scango:gate_pass_export"
+EXPORT_STATUS_TTL = 24 * 60 * 60
+EXPORT_EVENT = "scango_gate_pass_export"
+
+EXPORT_FORMATS = ("csv", "xlsx")
+EXPORT_PAGE_LENGTH = 2000
+
+# จำนวนแถวสูงสุดต่อ worksheet ของ Excel (รวมหัวตาราง) - เกินนี้ขึ้น sheet ใหม่
+XLSX_MAX_ROWS = 1048576
+
+GATE_PASS_EXPORT_FIELDS = ["name", "scan_datetime", "action_type", "visitor_register", "visitor_name",
+    "visitor_last_name", "gate_machine", "building_gate", "building_name"]
+
+# ฟิลด์ของ Visitor Register ที่ขอเพิ่มในไฟล์ได้
+EXPORT_VISITOR_FIELDS = ("title", "middle_name", "gender", "nationality", "phone_number", "visit_date",
+    "visit_end_date", "visit_status", "purpose", "other_purpose_details", "person_to_meet")
+
+
+def _status_key(job_id):
+    return f"{EXPORT_STATUS_PREFIX}:{job_id}"
+
+
+def set_export_status(job_id, **status):
+    try:
+        frappe.cache.set_value(_status_key(job_id), status, expires_in_sec=EXPORT_STATUS_TTL)
+    except Exception as e:
+        frappe.log_error(f"Gate Pass Export Error: {str(e)}")
+
+
+def get_visitor_fields(visitor_fields):
+    if not visitor_fields:
+        return []
+    if isinstance(visitor_fields, str):
+        visitor_fields = frappe.parse_json(visitor_fields) if visitor_fields.startswith("[") else visitor_fields.split(",")
+    return [field.strip() for field in visitor_fields if field.strip() in EXPORT_VISITOR_FIELDS]
+
+
+@frappe.whitelist()
+def export_gate_passes(file_format="csv", from_date=None, to_date=None, building_name=None, building_gate=None,
+                       action_type=None, visitor_fields=None):
+    """
+    Queue a CSV / XLSX export of gate passes
+    action_type: action เดียว หรือ JSON list, visitor_fields: ฟิลด์จาก Visitor Register (EXPORT_VISITOR_FIELDS)
+    """
+    frappe.has_permission("Visitor Gate Pass", "export", throw=True)
+    visitor_fields = get_visitor_fields(visitor_fields)
+    if visitor_fields:
+        # ฟิลด์ของ Visitor Register (เช่น phone_number) ต้องมีสิทธิ์อ่าน Visitor Register ด้วย
+        frappe.has_permission("Visitor Register", "read", throw=True)
+
+    if file_format not in EXPORT_FORMATS:
+        return {
+            "success": False,
+            "message": f"ไม่รองรับรูปแบบไฟล์: {file_format}"
+        }
+
+    filters = {
+        "from_date": from_date,
+        "to_date": to_date,
+        "building_name": building_name,
+        "building_gate": building_gate,
+        "action_type": action_type,
+    }
+    job_id = f"gate_pass_export::{frappe.generate_hash(length=10)}"
+    set_export_status(job_id, status="queued", user=frappe.session.user)
+
+    frappe.enqueue(
+        "scango_office.scango.gate_pass_export.build_gate_pass_export",
+        queue="long",
+        timeout=4 * 60 * 60,
+        job_id=job_id,
+        export_id=job_id,
+        file_format=file_format,
+        filters={key: value for key, value in filters.items() if value},
+        visitor_fields=visitor_fields
+    )
+
+    return {
+        "success": True,
+        "job_id": job_id,
+        "message": "กำลังสร้างไฟล์ จะแจ้งลิงก์ดาวน์โหลดเมื่อเสร็จ"
+    }
+
+
+@frappe.whitelist()
+def get_gate_pass_export(job_id):
+    """Status of a queued export ({"status": queued / running / done / failed, "file_url", "rows"})"""
+    status = frappe.cache.get_value(_status_key(job_id))
+    if not status or status.get("user") != frappe.session.user:
+        return {"success": False, "message": "ไม่พบงานส่งออกนี้"}
+    return {"success": True, **status}
+
+
+def iter_export_rows(filters, visitor_fields):
+    """Header row, then one row per gate pass (newest first)"""
+    yield GATE_PASS_EXPORT_FIELDS + visitor_fields
+
+    for page in iter_gate_pass_pages(EXPORT_PAGE_LENGTH, fields=GATE_PASS_EXPORT_FIELDS, **filters):
+        visitors = {}
+        if visitor_fields:
+            visitors = {v.name: v for v in frappe.get_all("Visitor Register",
+                filters={"name": ["in", list({row.visitor_register for row in page if row.visitor_register})]},
+                fields=["name", *visitor_fields]
+            )}
+
+        for row in page:
+            visitor = visitors.get(row.visitor_register) or {}
+            yield [row.get(field) for field in GATE_PASS_EXPORT_FIELDS] + [visitor.get(field) for field in visitor_fields]
+
+
+def write_csv(path, rows):
+    # utf-8-sig เพื่อให้ Excel อ่านภาษาไทยได้
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        count = -1
+        for row in rows:
+            writer.writerow(["" if value is None else value for value in row])
+            count += 1
+    return count
+
+
+def write_xlsx(path, rows):
+    from openpyxl import Workbook
+
+    # write_only: แถวถูกเขียนลงไฟล์ชั่วคราวทันที ไม่เก็บทั้ง worksheet ไว้ใน memory
+    workbook = Workbook(write_only=True)
+    rows = iter(rows)
+    header = next(rows)
+    sheet = None
+    sheet_rows = XLSX_MAX_ROWS
+    count = 0
+    for row in rows:
+        if sheet_rows >= XLSX_MAX_ROWS:
+            # sheet เต็ม - เริ่ม sheet ใหม่พร้อมหัวตาราง
+            sheet = workbook.create_sheet(f"Gate Pass {len(workbook.worksheets) + 1}" if sheet else "Gate Pass")
+            sheet.append(header)
+            sheet_rows = 1
+        sheet.append(row)
+        sheet_rows += 1
+        count += 1
+    if not sheet:
+        workbook.create_sheet("Gate Pass").append(header)
+    workbook.save(path)
+    return count
+
+
+def build_gate_pass_export(export_id, file_format, filters, visitor_fields):
+    """Background job: write the export file and attach it as a private File of the requesting user"""
+    user = frappe.session.user
+    set_export_status(export_id, status="running", user=user)
+
+    file_name = f"gate_pass_{now_datetime().strftime('%Y%m%d_%H%M%S')}_{frappe.generate_hash(length=6)}.{file_format}"
+    folder = frappe.get_site_path("private", "files")
+    path = os.path.join(folder, file_name)
+
+    try:
+        rows = iter_export_rows(filters, visitor_fields)
+        count = write_xlsx(path, rows) if file_format == "xlsx" else write_csv(path, rows)
+
+        file_doc = frappe.get_doc({
+            "doctype": "File",
+            "file_name": file_name,
+            "file_url": f"/private/files/{file_name}",
+            "is_private": 1,
+            "file_size": os.path.getsize(path),
+            # คำนวณ hash เองทีละส่วน File จะได้ไม่อ่านทั้งไฟล์เข้า memory
+            "content_hash": get_file_hash(path),
+        })
+        file_doc.insert(ignore_permissions=True)
+        frappe.db.commit()
+    except Exception as e:
+        frappe.db.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        frappe.log_error(f"Gate Pass Export Error: {str(e)}")
+        set_export_status(export_id, status="failed", user=user, message=str(e))
+        frappe.publish_realtime(EXPORT_EVENT, {"job_id": export_id, "status": "failed", "message": str(e)}, user=user)
+        return
+
+    set_export_status(export_id, status="done", user=user, file_url=file_doc.file_url, rows=cint(count))
+    frappe.publish_realtime(EXPORT_EVENT, {
+        "job_id": export_id,
+        "status": "done",
+        "file_url": file_doc.file_url,
+        "rows": cint(count)
+    }, user=user)
+
+
+def get_file_hash(path):
+    content_hash = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
@@ -0,0 +1,197 @@
+# Gate snapshot (offline validation)
+#
+# ทุกวัน scheduled job สร้าง snapshot ของผู้เยี่ยมชมที่ใช้งานได้วันนี้ เก็บเป็นไฟล์ JSON บีบอัด gzip
+# ใน private/gate_snapshots/ (เก็บไว้ SNAPSHOT_RETENTION รุ่นล่าสุด) ประกอบด้วย
+#   visitors  - [name, visit_date, visit_end_date, title, first_name, last_name] (วันที่เป็น YYYYMMDD)
+#   revoked   - ผู้เยี่ยมชมที่ Checkout แล้วแต่ยังอยู่ในช่วงวันที่ใช้งาน (เพื่อตอบข้อความให้ตรงกับ server)
+#
+# เครื่องที่ประตูดาวน์โหลด snapshot ทั้งไฟล์วันละครั้ง (download_gate_snapshot) แล้วดึงเฉพาะส่วนที่เปลี่ยน
+# ระหว่างวัน (get_gate_snapshot_changes) เมื่อเชื่อมต่อ server ไม่ได้ (offline / network error) เครื่องจะตรวจ QR
+# เองด้วยกฎเดียวกับ check_qr_status แล้วส่งการสแกนเข้าคิว offline ตอน sync server ตรวจช่วงวันที่ ณ เวลาสแกน, Checkout
+# และ Deny watchlist ซ้ำ (sync_offline_scans) - snapshot ไม่มีรายชื่อเฝ้าระวัง
+#
+# สร้าง snapshot ใหม่ทันที
+#   bench --site <site> execute scango_office.scango.gate_snapshot.build_gate_snapshot
+
+import gzip
+import json
+import os
+
+import frappe
+from frappe.utils import get_datetime, getdate, now_datetime, today
+
+from scango_office.scango.visit_expiry import ACTIVE, CHECKED_OUT
+
+GATE_SNAPSHOT_KEY = "scango:gate_snapshot"
+SNAPSHOT_FOLDER = "gate_snapshots"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_RETENTION = 3
+
+SNAPSHOT_FIELDS = ["name", "visit_date", "visit_end_date", "title", "first_name", "last_name"]
+
+# จำนวนแถวสูงสุดของส่วนที่เปลี่ยนต่อการเรียกหนึ่งครั้ง ถ้าเกินให้เครื่องดาวน์โหลด snapshot ใหม่
+MAX_CHANGES = 5000
+
+
+def get_snapshot_folder():
+    return frappe.get_site_path("private", SNAPSHOT_FOLDER)
+
+
+def _compact_date(value):
+    return getdate(value).strftime("%Y%m%d") if value else None
+
+
+def _snapshot_row(visitor):
+    return [visitor.name, _compact_date(visitor.visit_date), _compact_date(visitor.visit_end_date),
+            visitor.title, visitor.first_name, visitor.last_name]
+
+
+def _is_valid_on(visitor, date):
+    return (visitor.visit_status == ACTIVE
+            and (not visitor.visit_date or getdate(visitor.visit_date) <= date)
+            and (not visitor.visit_end_date or getdate(visitor.visit_end_date) >= date))
+
+
+def build_gate_snapshot():
+    """Write today's snapshot of valid registrations and revoked QR codes (scheduled)"""
+    generated_at = now_datetime()
+    today_date = getdate(today())
+    version = generated_at.strftime("%Y%m%dT%H%M%S")
+
+    visitors = frappe.db.sql(f"""
+        select {", ".join(f"`{field}`" for field in SNAPSHOT_FIELDS)}
+        from `tabVisitor Register`
+        where visit_status = %(active)s
+            and (visit_date is null or visit_date <= %(today)s)
+            and (visit_end_date is null or visit_end_date >= %(today)s)
+    """, {"active": ACTIVE, "today": today_date}, as_dict=True)
+
+    revoked = frappe.db.sql_list("""
+        select name from `tabVisitor Register`
+        where visit_status = %(checked_out)s
+            and (visit_end_date is null or visit_end_date >= %(today)s)
+    """, {"checked_out": CHECKED_OUT, "today": today_date})
+
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "version": version,
+        "valid_date": _compact_date(today_date),
+        "generated_at": str(generated_at),
+        "fields": SNAPSHOT_FIELDS,
+        "visitors": [_snapshot_row(visitor) for visitor in visitors],
+        "revoked": revoked,
+    }
+
+    folder = get_snapshot_folder()
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"gate_snapshot_{version}.json.gz")
+    # เขียนไฟล์ชั่วคราวแล้วค่อย rename เพื่อไม่ให้มีการดาวน์โหลดไฟล์ที่เขียนไม่เสร็จ
+    with gzip.open(path + ".tmp", "wb", compresslevel=9) as f:
+        f.write(json.dumps(snapshot, separators=(",", ":"), ensure_ascii=False).encode())
+    os.replace(path + ".tmp", path)
+
+    frappe.cache.set_value(GATE_SNAPSHOT_KEY, {
+        "version": version,
+        "generated_at": str(generated_at),
+        "path": path
+    })
+    remove_old_snapshots(folder)
+    return version
+
+
+def remove_old_snapshots(folder):
+    files = sorted(f for f in os.listdir(folder) if f.startswith("gate_snapshot_") and f.endswith(".json.gz"))
+    for filename in files[:-SNAPSHOT_RETENTION]:
+        os.remove(os.path.join(folder, filename))
+
+
+def get_current_snapshot():
+    """{"version", "generated_at", "path"} of the latest snapshot, or None"""
+    current = frappe.cache.get_value(GATE_SNAPSHOT_KEY)
+    if current and os.path.exists(current["path"]):
+        return current
+
+    # Redis ถูกล้าง - ใช้ไฟล์ล่าสุดในโฟลเดอร์แทน
+    folder = get_snapshot_folder()
+    if not os.path.isdir(folder):
+        return None
+    files = sorted(f for f in os.listdir(folder) if f.startswith("gate_snapshot_") and f.endswith(".json.gz"))
+    if not files:
+        return None
+    version = files[-1][len("gate_snapshot_"):-len(".json.gz")]
+    generated_at = get_datetime(f"{version[:4]}-{version[4:6]}-{version[6:8]} "
+                                f"{version[9:11]}:{version[11:13]}:{version[13:15]}")
+    return {"version": version, "generated_at": str(generated_at), "path": os.path.join(folder, files[-1])}
+
+
+@frappe.whitelist(methods=["GET"])
+def download_gate_snapshot():
+    """The latest snapshot file (JSON, gzip content encoding - the browser decompresses it)"""
+    from werkzeug.wrappers import Response
+
+    frappe.has_permission("Visitor Register", "read", throw=True)
+
+    current = get_current_snapshot()
+    if not current:
+        build_gate_snapshot()
+        current = get_current_snapshot()
+
+    with open(current["path"], "rb") as f:
+        content = f.read()
+
+    response = Response(content, mimetype="application/json")
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Cache-Control"] = "private, max-age=0, must-revalidate"
+    response.headers["ETag"] = f'"{current["version"]}"'
+    return response
+
+
+@frappe.whitelist()
+def get_gate_snapshot_changes(version, since=None):
+    """
+    Changes since a snapshot (or since the previous call)
+    คืนค่า {"stale": True} ถ้าเครื่องต้องดาวน์โหลด snapshot ใหม่ (มี snapshot ใหม่กว่า / เปลี่ยนวัน / เปลี่ยนมากเกินไป)
+    มิฉะนั้นคืน visitors ที่เพิ่ม/แก้ไข, removed (ใช้งานไม่ได้แล้ว) และ synced_at สำหรับเรียกครั้งถัดไป
+    """
+    frappe.has_permission("Visitor Register", "read", throw=True)
+
+    current = get_current_snapshot()
+    today_date = getdate(today())
+    if not current or current["version"] != version or current["version"][:8] != _compact_date(today_date):
+        return {"stale": True}
+
+    # อ่านเวลาก่อน query เพื่อไม่ให้พลาดการเปลี่ยนแปลงที่เกิดระหว่างนี้ (ส่งซ้ำได้ ไม่เป็นไร)
+    synced_at = now_datetime()
+    since = get_datetime(since or current["generated_at"])
+
+    changed = frappe.db.sql(f"""
+        select {", ".join(f"`{field}`" for field in SNAPSHOT_FIELDS)}, visit_status
+        from `tabVisitor Register`
+        where modified > %s
+        limit %s
+    """, (since, MAX_CHANGES + 1), as_dict=True)
+
+    # Checkout / ลบเอกสาร ไม่เปลี่ยน modified ของ Visitor Register
+    revoked = frappe.db.sql_list("""
+        select distinct visitor_register from `tabVisitor Gate Pass`
+        where action_type = 'Checkout' and creation > %s
+        limit %s
+    """, (since, MAX_CHANGES + 1))
+    deleted = frappe.db.sql_list("""
+        select deleted_name from `tabDeleted Document`
+        where deleted_doctype = 'Visitor Register' and creation > %s
+        limit %s
+    """, (since, MAX_CHANGES + 1))
+
+    if len(changed) + len(revoked) + len(deleted) > MAX_CHANGES:
+        return {"stale": True}
+
+    return {
+        "stale": False,
+        "version": current["version"],
+        "synced_at": str(synced_at),
+        "visitors": [_snapshot_row(v) for v in changed if _is_valid_on(v, today_date)],
+        "removed": [v.name for v in changed
+                    if not _is_valid_on(v, today_date) and v.visit_status != CHECKED_OUT] + deleted,
+        "revoked": list({*revoked, *(v.name for v in changed if v.visit_status == CHECKED_OUT)}),
+    }
@@ -0,0 +1,110 @@
+# Gate topology cache
+#
+# Machine Gate -> Building Gate -> Building ถูกโหลดครั้งเดียวเก็บไว้ใน memory ของแต่ละ process
+# และใช้ version number ใน Redis เพื่อบอกทุก worker ว่าต้องโหลดใหม่เมื่อมีการแก้ไขข้อมูล
+
+import frappe
+
+TOPOLOGY_VERSION_KEY = "scango:gate_topology_version"
+
+# {site: (version, {machine_id: topology})}
+_topology_cache = {}
+
+
+def get_gate_topology(machine_id):
+    """
+    Resolve a Machine Gate to its full topology in one lookup
+    คืนค่า frappe._dict(name, machine_id, use_for, building_gate, gate_code, gate_name,
+    building, building_code, building_name, anti_passback, reentry_cooldown, parent_building,
+    child_buildings) หรือ None ถ้าไม่พบ
+    """
+    if not machine_id:
+        return None
+    return get_all_gate_topology().get(machine_id)
+
+
+def get_all_gate_topology():
+    site = frappe.local.site
+    version = get_topology_version()
+
+    cached = _topology_cache.get(site)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    topology = load_gate_topology()
+    _topology_cache[site] = (version, topology)
+    return topology
+
+
+def get_topology_version():
+    # อ่าน version จาก Redis ครั้งเดียวต่อ request / job
+    if getattr(frappe.local, "scango_topology_version", None) is None:
+        try:
+            frappe.local.scango_topology_version = frappe.cache.get_value(TOPOLOGY_VERSION_KEY) or 0
+        except Exception:
+            # Redis ใช้งานไม่ได้ - ไม่ใช้ cache ใน process นี้
+            return frappe.generate_hash(length=8)
+    return frappe.local.scango_topology_version
+
+
+def load_gate_topology():
+    buildings = {
+        b.name: b for b in frappe.get_all("Building", fields=["name", "building_code", "building_name",
+            "anti_passback", "reentry_cooldown_minutes", "parent_building"])
+    }
+    gates = {
+        g.name: g for g in frappe.get_all("Building Gate", fields=["name", "gate_code", "gate_name", "building",
+            "anti_passback", "reentry_cooldown_minutes"])
+    }
+    child_buildings = get_child_buildings(buildings)
+
+    topology = {}
+    for machine in frappe.get_all("Machine Gate", fields=["name", "machine_id", "building_gate", "use_for"]):
+        gate = gates.get(machine.building_gate) or frappe._dict()
+        building = buildings.get(gate.building) or frappe._dict()
+        topology[machine.name] = frappe._dict({
+            "name": machine.name,
+            "machine_id": machine.machine_id,
+            "use_for": machine.use_for,
+            "building_gate": machine.building_gate,
+            "gate_code": gate.gate_code,
+            "gate_name": gate.gate_name,
+            "building": gate.building,
+            "building_code": building.building_code,
+            "building_name": building.building_name,
+            # กฎ anti-passback: ค่าของประตูใช้ก่อน ถ้าไม่ได้ตั้งจึงใช้ค่าของอาคาร
+            "anti_passback": gate.anti_passback == "Enforce" or (not gate.anti_passback and bool(building.anti_passback)),
+            "reentry_cooldown": (gate.reentry_cooldown_minutes or building.reentry_cooldown_minutes or 0) * 60,
+            "parent_building": building.parent_building,
+            "child_buildings": child_buildings.get(gate.building, ()),
+        })
+
+    return topology
+
+
+def get_child_buildings(buildings):
+    """{building: (every building nested inside it, at any depth)}"""
+    children = {}
+    for building in buildings.values():
+        if building.parent_building:
+            children.setdefault(building.parent_building, []).append(building.name)
+
+    def descendants(name, seen):
+        result = []
+        for child in children.get(name, []):
+            if child not in seen:
+                seen.add(child)
+                result += [child, *descendants(child, seen)]
+        return result
+
+    return {name: tuple(descendants(name, {name})) for name in buildings}
+
+
+def clear_gate_topology_cache():
+    """Invalidate the topology cache on every worker (called from the doctypes' on_update / on_trash)"""
+    _topology_cache.pop(frappe.local.site, None)
+    frappe.local.scango_topology_version = None
+    try:
+        frappe.cache.set_value(TOPOLOGY_VERSION_KEY, frappe.generate_hash(length=10))
+    except Exception as e:
+        frappe.log_error(f"Gate Topology Cache Error: {str(e)}")
@@ -0,0 +1,159 @@
+# Occupancy counters
+#
+# จำนวนผู้เยี่ยมชมที่อยู่ในแต่ละอาคาร / แต่ละประตู เก็บเป็น Redis hash และเปลี่ยนแบบ atomic (HINCRBY)
+# ทุกครั้งที่ Visitor Presence เปลี่ยนสถานะ แล้ว push ไปยัง dashboard ผ่าน realtime
+# มี scheduled job ตรวจทานกับฐานข้อมูลเป็นระยะเผื่อค่าคลาดเคลื่อน
+#
+# การตรวจทานสร้างค่าใหม่ใน key ชั่วคราวแล้วสลับแทนที่ด้วย Lua script (atomic) ระหว่างนั้นการเปลี่ยนแปลงที่เกิดขึ้น
+# ถูกเพิ่มลง key ชั่วคราวด้วย จึงไม่หายไปเมื่อสลับ key
+
+import frappe
+
+BUILDING_OCCUPANCY_KEY = "scango:occupancy:building"
+GATE_OCCUPANCY_KEY = "scango:occupancy:gate"
+OCCUPANCY_LOADED_KEY = "scango:occupancy_loaded"
+OCCUPANCY_RECONCILING_KEY = "scango:occupancy_reconciling"
+TMP_SUFFIX = ":tmp"
+RECONCILE_TIMEOUT = 5 * 60
+
+# KEYS: (tmp, live) ทีละคู่ แล้วตามด้วย marker ของการตรวจทาน
+SWAP_SCRIPT = """
+for i = 1, #KEYS - 1, 2 do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        redis.call('RENAME', KEYS[i], KEYS[i + 1])
+    else
+        redis.call('DEL', KEYS[i + 1])
+    end
+end
+redis.call('DEL', KEYS[#KEYS])
+return 1
+"""
+
+OCCUPANCY_EVENT = "scango_occupancy"
+
+
+def apply_presence_change(before, after):
+    """
+    Queue counter updates for a presence transition (applied after commit)
+    before / after: {"in_building", "building_name", "building_gate"}
+    """
+    changes = []
+    if before and before.get("in_building"):
+        changes.append((before.get("building_name"), before.get("building_gate"), -1))
+    if after and after.get("in_building"):
+        changes.append((after.get("building_name"), after.get("building_gate"), 1))
+
+    if not changes:
+        return
+
+    def _apply():
+        try:
+            if not frappe.cache.get_value(OCCUPANCY_LOADED_KEY):
+                reconcile_occupancy()
+            else:
+                # ระหว่างตรวจทาน เพิ่มลง key ชั่วคราวด้วย เพื่อไม่ให้หายตอนสลับ key
+                suffixes = ("", TMP_SUFFIX) if frappe.cache.get(frappe.cache.make_key(OCCUPANCY_RECONCILING_KEY)) else ("",)
+                pipe = frappe.cache.pipeline()
+                for building_name, building_gate, amount in changes:
+                    for suffix in suffixes:
+                        if building_name:
+                            pipe.hincrby(frappe.cache.make_key(BUILDING_OCCUPANCY_KEY + suffix), building_name, amount)
+                        if building_gate:
+                            pipe.hincrby(frappe.cache.make_key(GATE_OCCUPANCY_KEY + suffix), building_gate, amount)
+                pipe.execute()
+            publish_occupancy()
+        except Exception as e:
+            frappe.log_error(f"Occupancy Counter Error: {str(e)}")
+
+    frappe.db.after_commit.add(_apply)
+
+
+def _decode_counters(raw):
+    return {
+        (k.decode() if isinstance(k, bytes) else k): max(int(v), 0)
+        for k, v in (raw or {}).items()
+    }
+
+
+def get_occupancy_counters():
+    if not frappe.cache.get_value(OCCUPANCY_LOADED_KEY):
+        reconcile_occupancy()
+
+    # อ่านผ่าน pipeline ของ redis โดยตรง (hgetall ของ frappe.cache จะ unpickle ค่า)
+    buildings, gates = (
+        frappe.cache.pipeline()
+        .hgetall(frappe.cache.make_key(BUILDING_OCCUPANCY_KEY))
+        .hgetall(frappe.cache.make_key(GATE_OCCUPANCY_KEY))
+        .execute()
+    )
+    buildings = _decode_counters(buildings)
+    return {
+        "buildings": buildings,
+        "gates": _decode_counters(gates),
+        "total": sum(buildings.values())
+    }
+
+
+def publish_occupancy():
+    frappe.publish_realtime(OCCUPANCY_EVENT, get_occupancy_counters())
+
+
+@frappe.whitelist()
+def get_occupancy():
+    """Current headcount per building and per gate (from Redis counters)"""
+    frappe.has_permission("Visitor Presence", "read", throw=True)
+
+    try:
+        return {"success": True, **get_occupancy_counters()}
+    except Exception as e:
+        frappe.log_error(f"Occupancy Counter Error: {str(e)}")
+        return {"success": True, **count_occupancy_from_db()}
+
+
+def count_occupancy_from_db():
+    buildings = {}
+    gates = {}
+    for row in frappe.get_all("Visitor Presence",
+        filters={"in_building": 1},
+        fields=["last_building_name", "last_building_gate", "count(name) as visitors"],
+        group_by="last_building_name, last_building_gate",
+        order_by=None
+    ):
+        if row.last_building_name:
+            buildings[row.last_building_name] = buildings.get(row.last_building_name, 0) + row.visitors
+        if row.last_building_gate:
+            gates[row.last_building_gate] = gates.get(row.last_building_gate, 0) + row.visitors
+
+    return {"buildings": buildings, "gates": gates, "total": sum(buildings.values())}
+
+
+def reconcile_occupancy():
+    """Replace the Redis counters with the counts from Visitor Presence (scheduled)"""
+    keys = (BUILDING_OCCUPANCY_KEY, GATE_OCCUPANCY_KEY)
+
+    # เริ่มเก็บการเปลี่ยนแปลงลง key ชั่วคราวก่อนอ่านฐานข้อมูล
+    pipe = frappe.cache.pipeline()
+    pipe.delete(*[frappe.cache.make_key(key + TMP_SUFFIX) for key in keys])
+    pipe.set(frappe.cache.make_key(OCCUPANCY_RECONCILING_KEY), 1, ex=RECONCILE_TIMEOUT)
+    pipe.execute()
+
+    counts = count_occupancy_from_db()
+
+    # HINCRBY ไม่ทับการเปลี่ยนแปลงที่ถูกเพิ่มลง key ชั่วคราวไปแล้ว
+    pipe = frappe.cache.pipeline()
+    for key, values in zip(keys, (counts["buildings"], counts["gates"]), strict=True):
+        for field, count in values.items():
+            pipe.hincrby(frappe.cache.make_key(key + TMP_SUFFIX), field, count)
+    pipe.execute()
+
+    swap_keys = []
+    for key in keys:
+        swap_keys.extend([frappe.cache.make_key(key + TMP_SUFFIX), frappe.cache.make_key(key)])
+    frappe.cache.register_script(SWAP_SCRIPT)(keys=[*swap_keys, frappe.cache.make_key(OCCUPANCY_RECONCILING_KEY)])
+
+    frappe.cache.set_value(OCCUPANCY_LOADED_KEY, 1)
+
+
+def reconcile_and_publish_occupancy():
+    reconcile_occupancy()
+    publish_occupancy()
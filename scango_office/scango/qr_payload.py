@@ -0,0 +1,178 @@
+# Signed QR payloads
+#
+# เมื่อเปิด scango_signed_qr ใน site_config, QR จะเก็บ visitor ID + ช่วงวันที่ใช้งานได้ + ลายเซ็น Ed25519
+#
+#   SG1.<visitor_id>.<valid_from YYYYMMDD>.<valid_to YYYYMMDD>.<signature base64url>
+#
+# ประตูหรือ server จึงปฏิเสธ QR ที่ปลอมหรือหมดอายุได้โดยใช้แค่ key ก่อนอ่าน Visitor Register
+# (server ยังตรวจวันที่ในฐานข้อมูลซ้ำ เพราะ visit_end_date อาจถูกแก้ให้สั้นลงหลังพิมพ์ QR แล้ว)
+#
+# เมื่อเปิดแล้ว QR ที่เป็น visitor ID ล้วน ๆ จะถูกปฏิเสธ (ชื่อเอกสารเรียงลำดับ เดาได้)
+# ยกเว้นช่วงเปลี่ยนผ่านที่กำหนดด้วย scango_unsigned_qr_until (รวมวันนั้น) ระหว่างพิมพ์ QR ใหม่
+#
+# site_config.json
+#   "scango_signed_qr": 1,
+#   "scango_qr_private_key": "<base64 ของ Ed25519 private key 32 bytes>",
+#   "scango_unsigned_qr_until": "2026-10-31"    (ไม่บังคับ)
+#
+# สร้าง key ได้ด้วย
+#   bench --site <site> execute scango_office.scango.qr_payload.generate_qr_signing_key
+
+import base64
+from datetime import date
+
+import frappe
+from frappe.utils import getdate, today
+
+PAYLOAD_PREFIX = "SG1"
+PAYLOAD_SEPARATOR = "."
+
+_keys = {}
+
+
+def is_signed_qr_enabled():
+    return bool(frappe.conf.get("scango_signed_qr") and frappe.conf.get("scango_qr_private_key"))
+
+
+def accepts_unsigned_qr():
+    """Plain visitor IDs are accepted only without signing or until scango_unsigned_qr_until"""
+    if not is_signed_qr_enabled():
+        return True
+    until = frappe.conf.get("scango_unsigned_qr_until")
+    return bool(until) and getdate(today()) <= getdate(until)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def get_private_key():
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+    raw = frappe.conf.get("scango_qr_private_key")
+    if raw not in _keys:
+        _keys[raw] = Ed25519PrivateKey.from_private_bytes(base64.b64decode(raw))
+    return _keys[raw]
+
+
+def get_public_key():
+    return get_private_key().public_key()
+
+
+@frappe.whitelist()
+def get_qr_public_key():
+    """Raw Ed25519 public key (base64) for gate machines that validate QR codes locally"""
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+    if not is_signed_qr_enabled():
+        return {"enabled": False}
+
+    raw = get_public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    return {"enabled": True, "algorithm": "Ed25519", "public_key": base64.b64encode(raw).decode()}
+
+
+def generate_qr_signing_key():
+    """Create a new Ed25519 key and enable signed QR codes for the current site"""
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat
+    from frappe.installer import update_site_config
+
+    raw = Ed25519PrivateKey.generate().private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+    update_site_config("scango_qr_private_key", base64.b64encode(raw).decode())
+    update_site_config("scango_signed_qr", 1)
+
+
+def make_qr_payload(visitor_id, valid_from, valid_to):
+    """Build the signed QR content for a visitor"""
+    message = PAYLOAD_SEPARATOR.join([
+        PAYLOAD_PREFIX,
+        visitor_id,
+        getdate(valid_from).strftime("%Y%m%d"),
+        getdate(valid_to).strftime("%Y%m%d"),
+    ])
+    signature = get_private_key().sign(message.encode())
+    return f"{message}{PAYLOAD_SEPARATOR}{_b64encode(signature)}"
+
+
+def is_signed_payload(content):
+    return bool(content) and content.startswith(PAYLOAD_PREFIX + PAYLOAD_SEPARATOR)
+
+
+def parse_signed_payload(content):
+    """Verify the signature of a signed payload, return its fields or None if forged/malformed"""
+    try:
+        message, signature = content.strip().rsplit(PAYLOAD_SEPARATOR, 1)
+        _prefix, visitor_id, valid_from, valid_to = message.split(PAYLOAD_SEPARATOR)
+        get_public_key().verify(_b64decode(signature), message.encode())
+        return {
+            "visitor_id": visitor_id,
+            "valid_from": date(int(valid_from[:4]), int(valid_from[4:6]), int(valid_from[6:])),
+            "valid_to": date(int(valid_to[:4]), int(valid_to[4:6]), int(valid_to[6:])),
+        }
+    except Exception:
+        return None
+
+
+def get_qr_visitor_id(content):
+    """
+    Visitor ID of scanned QR content without the date check (offline scans are checked at their scan time)
+    คืนค่า None ถ้าลายเซ็นไม่ถูกต้อง หรือเป็น visitor ID ล้วน ๆ ขณะที่บังคับใช้ QR แบบ signed
+    """
+    content = (content or "").strip()
+    if not is_signed_payload(content):
+        return content if accepts_unsigned_qr() else None
+    payload = parse_signed_payload(content)
+    return payload and payload["visitor_id"]
+
+
+def decode_qr_content(content):
+    """
+    Decode scanned QR content
+    คืนค่า {"visitor_id", "signed", "valid_from", "valid_to"} หรือ {"error": <ผลแบบ check_qr_status>}
+    QR แบบ signed จะถูกตรวจลายเซ็นและวันที่ใช้งานก่อนอ่านฐานข้อมูล
+    """
+    content = (content or "").strip()
+    if not is_signed_payload(content):
+        if not accepts_unsigned_qr():
+            return {
+                "error": {
+                    "valid": False,
+                    "message": "QR Code ไม่ถูกต้อง",
+                    "status": "unsigned"
+                }
+            }
+        return {"visitor_id": content, "signed": False}
+
+    payload = parse_signed_payload(content)
+    if not payload:
+        return {
+            "error": {
+                "valid": False,
+                "message": "QR Code ไม่ถูกต้อง",
+                "status": "invalid_signature"
+            }
+        }
+
+    today_date = getdate(today())
+    if today_date < payload["valid_from"]:
+        return {
+            "error": {
+                "valid": False,
+                "message": "QR Code ยังไม่ถึงวันที่ใช้งาน",
+                "status": "not_started"
+            }
+        }
+    if today_date > payload["valid_to"]:
+        return {
+            "error": {
+                "valid": False,
+                "message": "QR Code หมดอายุแล้ว",
+                "status": "expired"
+            }
+        }
+
+    return {"signed": True, **payload}
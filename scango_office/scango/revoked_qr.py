@@ -0,0 +1,164 @@
+# Revoked QR cache
+#
+# QR ที่ถูก Checkout แล้วจะใช้งานไม่ได้อีก เก็บรายชื่อ visitor_register เหล่านั้นไว้ใน
+# Redis set เพื่อให้การตรวจ "QR นี้ยังใช้ได้ไหม" ไม่ต้อง query ตาราง Visitor Gate Pass ทุกครั้ง
+# ถ้า set ยังไม่ถูกสร้าง (Redis ถูกล้าง / invalidate) จะสร้างใหม่ใน background job เพียงครั้งเดียว
+# และระหว่างนั้นการตรวจจะอ่านจากฐานข้อมูลแทน
+#
+# ระหว่าง rebuild ชื่อ set ชั่วคราวถูกเก็บไว้ใน REVOKED_QR_REBUILD_KEY และ Checkout ที่เกิดขึ้นระหว่างนั้น
+# ถูกเพิ่มลงทั้ง set จริงและ set ชั่วคราว (Lua script) จึงไม่หายไปตอนที่ set ชั่วคราวถูก rename ทับ
+
+import frappe
+
+from scango_office.scango.cache_errors import log_cache_error
+from scango_office.scango.gate_pass_archive import get_gate_pass_tables
+
+REVOKED_QR_KEY = "scango:revoked_qr"
+REVOKED_QR_LOADED_KEY = "scango:revoked_qr_loaded"
+REVOKED_QR_REBUILD_LOCK = "scango:revoked_qr_rebuild_lock"
+REVOKED_QR_REBUILD_KEY = "scango:revoked_qr_rebuilding"
+# อายุสูงสุดของ lock เผื่อ job rebuild ล้มกลางทาง
+REBUILD_LOCK_SECONDS = 10 * 60
+
+# จำนวน ID ที่ส่งเข้า Redis ต่อหนึ่งคำสั่งตอน rebuild
+REBUILD_CHUNK_SIZE = 5000
+
+# KEYS: set จริง, key ที่เก็บชื่อ set ชั่วคราว  ARGV: visitor
+ADD_SCRIPT = """
+local tmp = redis.call('GET', KEYS[2])
+if tmp then
+    redis.call('SADD', tmp, ARGV[1])
+end
+redis.call('SADD', KEYS[1], ARGV[1])
+return 1
+"""
+
+# KEYS: set ชั่วคราว, set จริง, key ที่เก็บชื่อ set ชั่วคราว
+SWAP_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('RENAME', KEYS[1], KEYS[2])
+else
+    redis.call('DEL', KEYS[2])
+end
+redis.call('DEL', KEYS[3])
+return 1
+"""
+
+
+def is_qr_revoked(visitor_id):
+    """Return True if the visitor's QR has been burned by a Checkout scan"""
+    try:
+        if not frappe.cache.get_value(REVOKED_QR_LOADED_KEY):
+            # ยังไม่มี set - ให้ background job สร้างครั้งเดียว ระหว่างนี้ทุก request อ่านจากฐานข้อมูล
+            enqueue_revoked_qr_rebuild()
+            return bool(get_checkout_time(visitor_id))
+        return bool(frappe.cache.sismember(REVOKED_QR_KEY, visitor_id))
+    except Exception as e:
+        # Redis ใช้งานไม่ได้ - กลับไปใช้ฐานข้อมูลแทน
+        log_cache_error("Revoked QR Cache Error", e)
+        return bool(get_checkout_time(visitor_id))
+
+
+def get_checkout_time(visitor_id):
+    """Return scan time of the visitor's Checkout gate pass (only needed for revoked QR)"""
+    # รวมถึงตาราง archive เพราะ Checkout ที่เก่ามากอาจถูกย้ายออกจากตารางหลักแล้ว
+    for table in get_gate_pass_tables():
+        rows = frappe.db.sql(f"""
+            select scan_datetime from `{table}`
+            where visitor_register = %s and action_type = 'Checkout'
+            order by scan_datetime asc
+            limit 1
+        """, (visitor_id,))
+        if rows:
+            return rows[0][0]
+    return None
+
+
+def get_checkout_times(visitor_ids):
+    """{visitor_id: first Checkout scan time} for many visitors (live + archive tables)"""
+    checkout_times = {}
+    if not visitor_ids:
+        return checkout_times
+    for table in get_gate_pass_tables():
+        for visitor_id, scan_datetime in frappe.db.sql(f"""
+            select visitor_register, min(scan_datetime) from `{table}`
+            where visitor_register in %s and action_type = 'Checkout'
+            group by visitor_register
+        """, (tuple(visitor_ids),)):
+            if visitor_id not in checkout_times or scan_datetime < checkout_times[visitor_id]:
+                checkout_times[visitor_id] = scan_datetime
+    return checkout_times
+
+
+def add_revoked_qr(visitor_id):
+    """Mark a visitor's QR as revoked once the Checkout gate pass is committed"""
+    def _add():
+        try:
+            frappe.cache.register_script(ADD_SCRIPT)(
+                keys=[frappe.cache.make_key(REVOKED_QR_KEY), frappe.cache.make_key(REVOKED_QR_REBUILD_KEY)],
+                args=[visitor_id]
+            )
+        except Exception as e:
+            log_cache_error("Revoked QR Cache Error", e)
+            invalidate_revoked_qr_cache()
+
+    frappe.db.after_commit.add(_add)
+
+
+def invalidate_revoked_qr_cache():
+    """Force a rebuild from the database on the next lookup"""
+    frappe.cache.delete_value(REVOKED_QR_LOADED_KEY)
+
+
+def enqueue_revoked_qr_rebuild():
+    """Queue one rebuild of the revoked QR set (only the request that takes the lock enqueues it)"""
+    lock_key = frappe.cache.make_key(REVOKED_QR_REBUILD_LOCK)
+    if not frappe.cache.set(lock_key, 1, nx=True, ex=REBUILD_LOCK_SECONDS):
+        return
+
+    try:
+        frappe.enqueue(
+            "scango_office.scango.revoked_qr.rebuild_revoked_qr_cache",
+            queue="short",
+            job_id="revoked_qr_rebuild",
+            deduplicate=True
+        )
+    except Exception:
+        frappe.cache.delete(lock_key)
+        raise
+
+
+def rebuild_revoked_qr_cache():
+    """Rebuild the revoked QR set from all Checkout gate passes"""
+    try:
+        _rebuild_revoked_qr_cache()
+    finally:
+        # ถ้า rebuild ล้มกลางทาง ให้เลิกเพิ่มลง set ชั่วคราวด้วย (สำเร็จแล้ว SWAP_SCRIPT ลบ key นี้ไปแล้ว)
+        frappe.cache.delete(frappe.cache.make_key(REVOKED_QR_REBUILD_LOCK),
+                            frappe.cache.make_key(REVOKED_QR_REBUILD_KEY))
+
+
+def _rebuild_revoked_qr_cache():
+    # ประกาศ set ชั่วคราวก่อนอ่านฐานข้อมูล Checkout ที่ commit หลังจากนี้จะถูกเพิ่มลง set นี้ด้วย
+    tmp_key = f"{REVOKED_QR_KEY}:rebuild:{frappe.generate_hash(length=8)}"
+    frappe.cache.set(frappe.cache.make_key(REVOKED_QR_REBUILD_KEY), frappe.cache.make_key(tmp_key),
+                     ex=REBUILD_LOCK_SECONDS)
+
+    visitor_ids = []
+    for table in get_gate_pass_tables():
+        visitor_ids += [row[0] for row in frappe.db.sql(
+            f"select distinct visitor_register from `{table}` where action_type = 'Checkout'"
+        )]
+
+    # สร้าง set ใหม่ใน key ชั่วคราวแล้วค่อย rename เพื่อไม่ให้มีช่วงที่ set ว่าง
+    for i in range(0, len(visitor_ids), REBUILD_CHUNK_SIZE):
+        frappe.cache.sadd(tmp_key, *visitor_ids[i:i + REBUILD_CHUNK_SIZE])
+
+    # rename และเลิกเพิ่มลง set ชั่วคราวพร้อมกัน (atomic)
+    frappe.cache.register_script(SWAP_SCRIPT)(keys=[
+        frappe.cache.make_key(tmp_key),
+        frappe.cache.make_key(REVOKED_QR_KEY),
+        frappe.cache.make_key(REVOKED_QR_REBUILD_KEY),
+    ])
+
+    frappe.cache.set_value(REVOKED_QR_LOADED_KEY, 1)
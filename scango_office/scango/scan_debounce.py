@@ -0,0 +1,110 @@
+# Scan debouncing / idempotency
+#
+# QR ที่ค้างอยู่หน้ากล้องจะถูกอ่านซ้ำหลายครั้ง ทำให้เกิด Visitor Gate Pass ซ้ำ
+# process_gate_scan จึงจองการสแกน (visitor, เครื่อง, action) ด้วย Redis key อายุสั้น (SET NX)
+# การสแกนที่ซ้ำภายในช่วงเวลานั้นจะได้ผลเดิมกลับไปโดยไม่บันทึกใหม่
+# ผลของแต่ละ idempotency key ถูกเก็บไว้ด้วย เพื่อให้การ retry request เดิมได้ผลเดิม
+#
+# site_config.json
+#   "scango_scan_debounce_seconds": 5     (ค่าเริ่มต้น 5 วินาที, 0 = ปิด)
+
+import json
+
+import frappe
+from frappe.utils import cint
+
+from scango_office.scango.cache_errors import log_cache_error
+
+SCAN_RECENT_PREFIX = "scango:scan_recent"
+SCAN_IDEMPOTENCY_PREFIX = "scango:scan_idempotency"
+
+DEFAULT_DEBOUNCE_SECONDS = 5
+IDEMPOTENCY_TTL = 24 * 60 * 60
+PENDING = "pending"
+
+
+def get_debounce_seconds():
+    return cint(frappe.conf.get("scango_scan_debounce_seconds", DEFAULT_DEBOUNCE_SECONDS))
+
+
+def _recent_key(visitor_id, gate_machine, action_type):
+    return frappe.cache.make_key(f"{SCAN_RECENT_PREFIX}:{gate_machine}:{action_type}:{visitor_id}")
+
+
+def _idempotency_key(idempotency_key):
+    return frappe.cache.make_key(f"{SCAN_IDEMPOTENCY_PREFIX}:{idempotency_key}")
+
+
+def _load(value):
+    if value is None:
+        return None
+    value = value.decode() if isinstance(value, bytes) else value
+    return None if value == PENDING else json.loads(value)
+
+
+def get_idempotent_result(idempotency_key):
+    """Result already returned for this idempotency key, or None"""
+    if not idempotency_key:
+        return None
+    try:
+        return _load(frappe.cache.get(_idempotency_key(idempotency_key)))
+    except Exception as e:
+        log_cache_error("Scan Debounce Error", e)
+        return None
+
+
+def claim_scan(visitor_id, gate_machine, action_type):
+    """
+    Reserve the (visitor, machine, action) scan for the debounce window
+    คืนค่า (True, None) ถ้าจองได้ หรือ (False, ผลของการสแกนก่อนหน้า) ถ้าเป็นการสแกนซ้ำ
+    """
+    seconds = get_debounce_seconds()
+    if seconds <= 0:
+        return False, None
+
+    key = _recent_key(visitor_id, gate_machine, action_type)
+    try:
+        if frappe.cache.set(key, PENDING, nx=True, ex=seconds):
+            return True, None
+
+        value = frappe.cache.get(key)
+        if value is None:
+            # ครั้งแรกไม่สำเร็จและปล่อย key แล้ว ให้ตรวจสอบใหม่ตามปกติ (จองอีกครั้งเดียว ไม่วนรอ)
+            if frappe.cache.set(key, PENDING, nx=True, ex=seconds):
+                return True, None
+            value = frappe.cache.get(key)
+
+        # ครั้งแรกยังบันทึกไม่เสร็จ - ตอบทันทีโดยไม่รอใน web worker เครื่องที่ประตูจะสแกนซ้ำเองและได้ผลเดิม
+        return False, _load(value) or {
+            "valid": False,
+            "message": "กำลังบันทึกการสแกนนี้อยู่ กรุณารอสักครู่",
+            "status": "processing",
+            "action_type": action_type
+        }
+    except Exception as e:
+        # Redis ใช้งานไม่ได้ - ไม่ debounce (idempotency key ในฐานข้อมูลยังกันบันทึกซ้ำได้)
+        log_cache_error("Scan Debounce Error", e)
+        return False, None
+
+
+def remember_scan_result(visitor_id, gate_machine, action_type, idempotency_key, result):
+    """Keep a successful scan's result for repeated scans and retries of the same request"""
+    value = json.dumps({**result, "duplicate": True}, default=str)
+    try:
+        pipe = frappe.cache.pipeline()
+        seconds = get_debounce_seconds()
+        if seconds > 0:
+            pipe.set(_recent_key(visitor_id, gate_machine, action_type), value, ex=seconds)
+        if idempotency_key:
+            pipe.set(_idempotency_key(idempotency_key), value, ex=IDEMPOTENCY_TTL)
+        pipe.execute()
+    except Exception as e:
+        log_cache_error("Scan Debounce Error", e)
+
+
+def release_scan(visitor_id, gate_machine, action_type):
+    """Drop the reservation of a scan that did not record a gate pass"""
+    try:
+        frappe.cache.delete(_recent_key(visitor_id, gate_machine, action_type))
+    except Exception as e:
+        log_cache_error("Scan Debounce Error", e)
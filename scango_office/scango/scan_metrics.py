@@ -0,0 +1,162 @@
+# Scan timing metrics
+#
+# จับเวลาแต่ละขั้นของการสแกน (process_gate_scan / qr_scanner), การลงทะเบียน และการสร้าง QR
+# แล้วรวมเป็น histogram ต่อ path / เครื่อง / ขั้นตอน เก็บใน Redis hash เดียว (HINCRBY ผ่าน pipeline)
+# อ่านออกมาเป็น Prometheus text ได้ที่
+#
+#   /api/method/scango_office.scango.scan_metrics.metrics
+#
+# การสแกนที่ใช้เวลารวมเกิน threshold จะถูกเขียนลง logs/scango_slow_scan.log พร้อมเวลาของแต่ละขั้น
+#
+# site_config.json
+#   "scango_scan_metrics": 0              (ปิดการเก็บ metrics, ค่าเริ่มต้นเปิด)
+#   "scango_slow_scan_ms": 1000           (ค่าเริ่มต้น 1000 ms)
+#   "scango_metrics_token": "<token>"     (ให้ Prometheus อ่านด้วย Authorization: Bearer <token>)
+
+import hmac
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import frappe
+from frappe.utils import cint, flt
+
+SCAN_METRICS_KEY = "scango:scan_metrics"
+METRIC_NAME = "scango_stage_duration_seconds"
+FIELD_SEPARATOR = "\x1f"
+
+DEFAULT_SLOW_SCAN_MS = 1000
+
+# ขอบบนของแต่ละ bucket (วินาที)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKET_LABELS = [f"{bucket:g}" for bucket in BUCKETS] + ["+Inf"]
+
+
+def is_scan_metrics_enabled():
+    return bool(cint(frappe.conf.get("scango_scan_metrics", 1)))
+
+
+def get_slow_scan_threshold():
+    """Slow scan threshold in milliseconds"""
+    return flt(frappe.conf.get("scango_slow_scan_ms")) or DEFAULT_SLOW_SCAN_MS
+
+
+class ScanTimer:
+    """
+    Per-stage timer for one scan / registration / QR render
+
+        timer = ScanTimer("scan", machine)
+        with timer.stage("insert"):
+            ...
+        timer.finish(visitor=visitor_id)
+    """
+
+    def __init__(self, path, machine=None):
+        self.path = path
+        self.machine = machine or ""
+        self.stages = {}
+        self.started = time.perf_counter()
+        self.finished = False
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - started
+
+    def finish(self, **context):
+        """Record the stage durations (once) and log the scan if it was slow"""
+        if self.finished:
+            return
+        self.finished = True
+
+        durations = {**self.stages, "total": time.perf_counter() - self.started}
+
+        if not is_scan_metrics_enabled():
+            return
+
+        try:
+            record_durations(self.path, self.machine, durations)
+        except Exception as e:
+            frappe.log_error(f"Scan Metrics Error: {str(e)}")
+
+        if durations["total"] * 1000 >= get_slow_scan_threshold():
+            log_slow_scan(self.path, self.machine, durations, context)
+
+
+def record_durations(path, machine, durations):
+    key = frappe.cache.make_key(SCAN_METRICS_KEY)
+    pipe = frappe.cache.pipeline()
+    for stage, seconds in durations.items():
+        prefix = FIELD_SEPARATOR.join((path, machine, stage))
+        bucket = BUCKET_LABELS[bisect_left(BUCKETS, seconds)]
+        pipe.hincrby(key, f"{prefix}{FIELD_SEPARATOR}{bucket}", 1)
+        pipe.hincrbyfloat(key, f"{prefix}{FIELD_SEPARATOR}sum", seconds)
+    pipe.execute()
+
+
+def log_slow_scan(path, machine, durations, context):
+    frappe.logger("scango_slow_scan", allow_site=True).warning(json.dumps({
+        "path": path,
+        "machine": machine,
+        "ms": {stage: round(seconds * 1000, 2) for stage, seconds in durations.items()},
+        **{k: v for k, v in context.items() if v is not None},
+    }, ensure_ascii=False, default=str))
+
+
+def get_scan_metrics():
+    """{(path, machine, stage): {"buckets": {le: count}, "sum": seconds}}"""
+    # อ่านผ่าน pipeline ของ redis โดยตรง (hgetall ของ frappe.cache จะ unpickle ค่า)
+    raw = frappe.cache.pipeline().hgetall(frappe.cache.make_key(SCAN_METRICS_KEY)).execute()[0] or {}
+
+    series = {}
+    for field, value in raw.items():
+        field = field.decode() if isinstance(field, bytes) else field
+        path, machine, stage, bucket = field.split(FIELD_SEPARATOR)
+        entry = series.setdefault((path, machine, stage), {"buckets": {}, "sum": 0.0})
+        if bucket == "sum":
+            entry["sum"] = float(value)
+        else:
+            entry["buckets"][bucket] = int(value)
+    return series
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(series):
+    lines = [
+        f"# HELP {METRIC_NAME} Duration of each stage of gate scans, registrations and QR rendering",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    for (path, machine, stage), entry in sorted(series.items()):
+        labels = f'path="{_label(path)}",machine="{_label(machine)}",stage="{_label(stage)}"'
+        cumulative = 0
+        for bucket in BUCKET_LABELS:
+            cumulative += entry["buckets"].get(bucket, 0)
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bucket}"}} {cumulative}')
+        lines.append(f"{METRIC_NAME}_sum{{{labels}}} {entry['sum']:.6f}")
+        lines.append(f"{METRIC_NAME}_count{{{labels}}} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+@frappe.whitelist(allow_guest=True, methods=["GET"])
+def metrics():
+    """Scan timing histograms in Prometheus text format"""
+    from werkzeug.wrappers import Response
+
+    token = frappe.conf.get("scango_metrics_token")
+    authorization = frappe.get_request_header("Authorization") or ""
+    if not (token and hmac.compare_digest(authorization, f"Bearer {token}")):
+        frappe.only_for("System Manager")
+
+    return Response(render_prometheus(get_scan_metrics()), mimetype="text/plain; version=0.0.4")
+
+
+def reset_scan_metrics():
+    """Clear all collected histograms (bench execute scango_office.scango.scan_metrics.reset_scan_metrics)"""
+    frappe.cache.delete_value(SCAN_METRICS_KEY)
@@ -0,0 +1,99 @@
+# Copyright (c) 2026, kunpriya-natpaphat and Contributors
+# See license.txt
+
+from datetime import timedelta
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase
+from frappe.utils import now_datetime
+
+from scango_office.scango import anti_passback
+from scango_office.scango.anti_passback import claim_passback, clear_passback_state, release_passback
+
+
+class IntegrationTestAntiPassback(IntegrationTestCase):
+	"""
+	Integration tests for the anti-passback state in Redis.
+	The gate topology is patched to a single anti-passback building.
+	"""
+
+	def setUp(self):
+		self.visitor_id = f"_Test Visitor {frappe.generate_hash(length=8)}"
+		self.machine = frappe._dict({
+			"name": "_Test Passback Machine",
+			"building_gate": "_Test Passback Gate",
+			"building": "_Test Passback Building",
+			"anti_passback": True,
+			"reentry_cooldown": 0,
+			"parent_building": None,
+			"child_buildings": (),
+		})
+		topology = {self.machine.name: self.machine}
+		for target, value in (("get_gate_topology", topology.get), ("get_all_gate_topology", lambda: topology)):
+			patcher = patch.object(anti_passback, target, side_effect=value)
+			patcher.start()
+			self.addCleanup(patcher.stop)
+
+	def tearDown(self):
+		clear_passback_state([self.visitor_id])
+
+	def claim(self, action_type):
+		return claim_passback(self.visitor_id, self.machine.name, action_type)
+
+	def test_anti_passback_denies_second_in(self):
+		claim, violation = self.claim("In")
+		self.assertTrue(claim)
+		self.assertIsNone(violation)
+
+		claim, violation = self.claim("In")
+		self.assertIsNone(claim)
+		self.assertEqual(violation["status"], "passback_already_in")
+
+		self.assertTrue(self.claim("Out")[0])
+		self.assertTrue(self.claim("In")[0])
+
+	def test_anti_passback_denies_out_without_in(self):
+		claim, violation = self.claim("Out")
+		self.assertIsNone(claim)
+		self.assertEqual(violation["status"], "passback_not_in")
+
+	def test_reentry_cooldown_expires(self):
+		self.machine.anti_passback = False
+		self.machine.reentry_cooldown = 10 * 60
+		self.assertTrue(self.claim("Out")[0])
+
+		claim, violation = self.claim("In")
+		self.assertIsNone(claim)
+		self.assertEqual(violation["status"], "passback_cooldown")
+
+		with patch.object(anti_passback, "now_datetime", return_value=now_datetime() + timedelta(minutes=11)):
+			claim, violation = self.claim("In")
+		self.assertTrue(claim)
+		self.assertIsNone(violation)
+
+	def test_expired_state_is_reloaded_from_gate_passes(self):
+		self.assertTrue(self.claim("In")[0])
+
+		# state หมดอายุ (STATE_TTL) - โหลดใหม่จากประวัติ ซึ่งไม่มี gate pass ของผู้เยี่ยมชมนี้
+		clear_passback_state([self.visitor_id])
+		claim, violation = self.claim("In")
+		self.assertTrue(claim)
+		self.assertIsNone(violation)
+
+	def test_release_restores_previous_state(self):
+		self.assertTrue(self.claim("In")[0])
+		claim = self.claim("Out")[0]
+		self.assertTrue(claim)
+
+		# บันทึก gate pass ไม่สำเร็จ - ต้องกลับไปเป็น In จึงสแกนออกได้อีกครั้ง
+		release_passback(claim)
+		self.assertEqual(self.claim("In")[1]["status"], "passback_already_in")
+		self.assertTrue(self.claim("Out")[0])
+
+	def test_release_does_not_overwrite_newer_state(self):
+		claim = self.claim("In")[0]
+		self.assertTrue(self.claim("Out")[0])
+
+		release_passback(claim)
+		self.assertEqual(self.claim("Out")[1]["status"], "passback_not_in")
@@ -0,0 +1,82 @@
+# Visit status / auto-expiry
+#
+# Visitor Register.visit_status เก็บสถานะที่คำนวณไว้แล้ว (Active / Expired / Checked Out)
+# เพื่อให้ประตูตัดสินจากฟิลด์เดียวที่มี index แทนการคำนวณวันที่และค้นหา Checkout ทุกครั้ง
+#
+#   Checked Out  - ตั้งใน transaction เดียวกับการบันทึก Visitor Gate Pass แบบ Checkout
+#   Expired      - scheduled job ย้ายผู้เยี่ยมชมที่เลย visit_end_date แล้วเป็นชุด ๆ ด้วย SQL
+#                  พร้อมบันทึก Visitor Gate Pass แบบ Expired (ไม่มีเครื่อง) เป็นหลักฐาน
+
+import frappe
+from frappe.model.naming import make_autoname
+from frappe.utils import getdate, now_datetime, today
+
+from scango_office.scango.revoked_qr import get_checkout_time
+
+ACTIVE = "Active"
+EXPIRED = "Expired"
+CHECKED_OUT = "Checked Out"
+
+EXPIRY_BATCH_SIZE = 5000
+# จำกัดจำนวนชุดต่อการรันหนึ่งครั้ง ส่วนที่เหลือจะถูกย้ายในรอบถัดไป
+MAX_BATCHES_PER_RUN = 200
+
+
+def get_visit_status(visit_end_date, checked_out=False):
+    if checked_out:
+        return CHECKED_OUT
+    if visit_end_date and getdate(visit_end_date) < getdate(today()):
+        return EXPIRED
+    return ACTIVE
+
+
+def mark_checked_out(visitor_ids):
+    """Flag visitors as Checked Out (same transaction as their Checkout gate pass)"""
+    if not visitor_ids:
+        return
+    frappe.db.sql(
+        "update `tabVisitor Register` set visit_status = %s where name in %s",
+        (CHECKED_OUT, tuple(visitor_ids))
+    )
+
+
+def refresh_visit_status(visitor_id):
+    """Recompute a visitor's status from scratch (e.g. after a Checkout gate pass was deleted)"""
+    visit_end_date = frappe.db.get_value("Visitor Register", visitor_id, "visit_end_date")
+    status = get_visit_status(visit_end_date, checked_out=bool(get_checkout_time(visitor_id)))
+    frappe.db.set_value("Visitor Register", visitor_id, "visit_status", status, update_modified=False)
+
+
+def expire_overdue_visits():
+    """Expire Active registrations whose visit_end_date has passed (scheduled)"""
+    today_date = getdate(today())
+    autoname = frappe.get_meta("Visitor Gate Pass").autoname
+    user = frappe.session.user
+
+    for _ in range(MAX_BATCHES_PER_RUN):
+        visitors = frappe.db.sql("""
+            select name, first_name, last_name, visit_end_date
+            from `tabVisitor Register`
+            where visit_status = %s and visit_end_date < %s
+            limit %s
+            for update
+        """, (ACTIVE, today_date, EXPIRY_BATCH_SIZE), as_dict=True)
+        if not visitors:
+            break
+
+        now = now_datetime()
+        names = tuple(v.name for v in visitors)
+
+        # รายการ Expired ใช้ idempotency key ตาม visitor จึงรันซ้ำได้โดยไม่เกิดแถวซ้ำ
+        frappe.db.bulk_insert("Visitor Gate Pass",
+            ["name", "owner", "modified_by", "creation", "modified", "docstatus", "visitor_register",
+             "visitor_name", "visitor_last_name", "action_type", "scan_datetime", "idempotency_key"],
+            [[make_autoname(autoname, "Visitor Gate Pass"), user, user, now, now, 0, v.name,
+              v.first_name or "", v.last_name or "", EXPIRED, now, f"expired::{v.name}"] for v in visitors],
+            ignore_duplicates=True
+        )
+        frappe.db.sql(
+            "update `tabVisitor Register` set visit_status = %s where name in %s and visit_status = %s",
+            (EXPIRED, names, ACTIVE)
+        )
+        frappe.db.commit()
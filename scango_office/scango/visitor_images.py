@@ -0,0 +1,175 @@
+# Visitor image pipeline
+#
+# รูปที่แนบใน Visitor Register (visitor_photo, additional_documents) ถูกประมวลผลใน background job หลังบันทึก
+#   - ไฟล์ต้นฉบับ: หมุนตาม EXIF orientation แล้วบันทึกทับโดยไม่มี EXIF (ตัดพิกัด GPS / ข้อมูลกล้อง)
+#                  และย่อให้ด้านยาวไม่เกิน MAX_ORIGINAL_SIZE
+#   - thumbnail:   JPEG บีบอัดตามขนาดใน IMAGE_SIZES เก็บเป็นไฟล์ private แนบกับเอกสาร
+#
+# URL ของทุกขนาดเก็บใน image_variants ({"visitor_photo": {"source", "small", "medium"}, ...})
+# และ visitor_photo_thumbnail (small - list view) / visitor_photo_medium (หน้า scanner)
+#
+# สร้าง thumbnail ให้รูปที่อัปโหลดไว้ก่อนแล้วด้วย
+#   bench --site <site> execute scango_office.scango.visitor_images.enqueue_missing_image_variants
+
+import hashlib
+import io
+
+import frappe
+
+IMAGE_FIELDS = ("visitor_photo", "additional_documents")
+
+# ด้านยาวสูงสุด (px) ของแต่ละขนาด
+IMAGE_SIZES = {"small": 96, "medium": 480}
+MAX_ORIGINAL_SIZE = 2048
+
+THUMBNAIL_QUALITY = 75
+ORIGINAL_QUALITY = 85
+
+# ฟิลด์ใน Visitor Register ที่เก็บ URL ของ visitor_photo แต่ละขนาด
+PHOTO_SIZE_FIELDS = {"small": "visitor_photo_thumbnail", "medium": "visitor_photo_medium"}
+# ฟิลด์ที่ job เป็นผู้เขียนเท่านั้น
+VARIANT_FIELDS = ("image_variants", *PHOTO_SIZE_FIELDS.values())
+
+
+def enqueue_visitor_images(doc):
+    """Queue image processing when an image field of the Visitor Register changed"""
+    if not any(doc.has_value_changed(field) for field in IMAGE_FIELDS):
+        return
+    enqueue_image_processing(doc.name)
+
+
+def enqueue_image_processing(visitor_id):
+    """Queue process_visitor_images after commit (one job per visitor)"""
+    frappe.enqueue(
+        "scango_office.scango.visitor_images.process_visitor_images",
+        queue="default",
+        job_id=f"visitor_images::{visitor_id}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        visitor_id=visitor_id
+    )
+
+
+def keep_image_variants(doc):
+    """
+    Keep the variant fields written by the job from the database
+    job บันทึกโดยไม่เปลี่ยน modified ฟอร์มที่เปิดไว้ก่อน job เสร็จจึงยังมีค่าว่าง และจะลบค่าที่ job เขียนไว้ถ้าบันทึกตามฟอร์ม
+    """
+    if doc.is_new():
+        return
+    values = frappe.db.get_value("Visitor Register", doc.name, VARIANT_FIELDS, as_dict=True)
+    if values:
+        doc.update(values)
+
+
+def process_visitor_images(visitor_id):
+    """Background job: strip EXIF and build thumbnails for a visitor's image fields"""
+    visitor = frappe.db.get_value("Visitor Register", visitor_id,
+        ["name", "image_variants", *IMAGE_FIELDS], as_dict=True)
+    if not visitor:
+        return
+
+    variants = frappe.parse_json(visitor.image_variants) or {}
+    changed = False
+
+    for field in IMAGE_FIELDS:
+        file_url = visitor.get(field)
+        current = variants.get(field) or {}
+        if current.get("source") == file_url:
+            continue
+
+        delete_variant_files(visitor_id, current)
+        variants.pop(field, None)
+        changed = True
+
+        if file_url:
+            try:
+                variants[field] = build_image_variants(visitor_id, field, file_url)
+            except Exception as e:
+                frappe.log_error(f"Visitor Image Error: {visitor_id} {field}: {str(e)}")
+
+    if not changed:
+        return
+
+    photo = variants.get("visitor_photo") or {}
+    frappe.db.set_value("Visitor Register", visitor_id, {
+        "image_variants": frappe.as_json(variants) if variants else None,
+        **{fieldname: photo.get(size) for size, fieldname in PHOTO_SIZE_FIELDS.items()}
+    }, update_modified=False)
+
+
+def build_image_variants(visitor_id, field, file_url):
+    from PIL import Image, ImageOps
+
+    file_doc = frappe.get_doc("File", {"file_url": file_url, "attached_to_doctype": "Visitor Register",
+                                       "attached_to_name": visitor_id})
+    image = Image.open(io.BytesIO(file_doc.get_content()))
+    image_format = image.format or "JPEG"
+    image = ImageOps.exif_transpose(image)
+
+    # บันทึกไฟล์ต้นฉบับใหม่โดยไม่มี EXIF (Pillow ไม่คัดลอก EXIF ถ้าไม่ส่ง exif=...)
+    image.thumbnail((MAX_ORIGINAL_SIZE, MAX_ORIGINAL_SIZE))
+    replace_file_content(file_doc, encode_image(image, image_format, ORIGINAL_QUALITY))
+
+    from frappe.utils.file_manager import save_file
+
+    result = {"source": file_url}
+    for size, pixels in IMAGE_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail((pixels, pixels))
+        thumbnail_doc = save_file(
+            fname=f"{field}_{size}_{visitor_id}.jpg",
+            content=encode_image(thumbnail, "JPEG", THUMBNAIL_QUALITY),
+            dt="Visitor Register",
+            dn=visitor_id,
+            is_private=1
+        )
+        result[size] = thumbnail_doc.file_url
+    return result
+
+
+def encode_image(image, image_format, quality):
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        image.save(buffer, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, format=image_format, optimize=True)
+    return buffer.getvalue()
+
+
+def replace_file_content(file_doc, content):
+    with open(file_doc.get_full_path(), "wb") as f:
+        f.write(content)
+    file_doc.db_set({
+        "file_size": len(content),
+        "content_hash": hashlib.md5(content).hexdigest()
+    }, update_modified=False)
+
+
+def delete_variant_files(visitor_id, variants):
+    urls = [url for size, url in (variants or {}).items() if size != "source" and url]
+    if not urls:
+        return
+    for name in frappe.get_all("File", filters={
+        "attached_to_doctype": "Visitor Register",
+        "attached_to_name": visitor_id,
+        "file_url": ["in", urls]
+    }, pluck="name"):
+        frappe.delete_doc("File", name, ignore_permissions=True)
+
+
+def enqueue_missing_image_variants():
+    """Queue processing for visitors whose photo has no thumbnails yet (uploaded before this pipeline)"""
+    for visitor_id in frappe.get_all("Visitor Register",
+        filters={"visitor_photo": ["is", "set"], "visitor_photo_thumbnail": ["is", "not set"]},
+        pluck="name"
+    ):
+        frappe.enqueue(
+            "scango_office.scango.visitor_images.process_visitor_images",
+            queue="long",
+            job_id=f"visitor_images::{visitor_id}",
+            deduplicate=True,
+            visitor_id=visitor_id
+        )
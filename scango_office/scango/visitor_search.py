@@ -0,0 +1,205 @@
+# Guard desk visitor search
+#
+# ดัชนีค้นหาผู้เยี่ยมชมเก็บใน Visitor Search Token (หนึ่งแถวต่อ token) แทนการ LIKE '%...%' บน Visitor Register
+#   word          - คำในชื่อ (ตัวพิมพ์เล็ก, ตัดวรรณยุกต์ไทย) สำหรับค้นหาแบบ prefix
+#   trigram       - ตัวอักษร 3 ตัวของแต่ละคำ สำหรับค้นหาแบบสะกดไม่ตรง (fuzzy)
+#   id            - sha256 ของเลขบัตรประชาชน / เลขหนังสือเดินทาง (ค้นหาแบบตรงตัวเท่านั้น)
+#   phone         - เบอร์โทร (ตัวเลขล้วน) สำหรับค้นหาแบบ prefix
+#   phone_suffix  - เลข 4 ตัวท้ายของเบอร์โทร
+#
+# ดัชนีถูกปรับใน transaction เดียวกับการบันทึก Visitor Register และการนำเข้าแบบ bulk
+#
+# สร้างดัชนีใหม่ทั้งหมด
+#   bench --site <site> execute scango_office.scango.visitor_search.rebuild_search_index
+
+import hashlib
+import math
+import re
+import unicodedata
+
+import frappe
+from frappe.utils import cint
+
+SEARCH_NAME_FIELDS = ("first_name", "middle_name", "last_name")
+SEARCH_FIELDS = (*SEARCH_NAME_FIELDS, "thai_national_id", "passport_number", "phone_number")
+
+SEARCH_RESULT_FIELDS = ["name", "title", "first_name", "last_name", "phone_number", "visit_date",
+    "visit_end_date", "visit_status", "visitor_photo_thumbnail"]
+
+# วรรณยุกต์และเครื่องหมายกำกับที่มักพิมพ์ผิด/ตกหล่น (ไม้ไต่คู้ - การันต์)
+THAI_TONE_MARKS = re.compile("[\u0e47-\u0e4e]")
+NON_WORD = re.compile("[^0-9a-z\u0e01-\u0e5b]+")
+
+MAX_TOKEN_LENGTH = 140
+MAX_CANDIDATES = 500
+MAX_PAGE_LENGTH = 100
+# สัดส่วน trigram ของคำค้นที่ต้องตรงจึงนับว่าใกล้เคียง
+FUZZY_THRESHOLD = 0.5
+REBUILD_CHUNK_SIZE = 2000
+
+
+def normalize_words(value):
+    value = unicodedata.normalize("NFC", value or "").casefold()
+    value = THAI_TONE_MARKS.sub("", value)
+    return [word for word in NON_WORD.split(value) if word]
+
+
+def get_trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def hash_id(value):
+    value = re.sub(r"[^0-9A-Z]", "", (value or "").upper())
+    return hashlib.sha256(value.encode()).hexdigest() if value else None
+
+
+def normalize_phone(value):
+    return re.sub(r"\D", "", value or "")
+
+
+def get_search_tokens(visitor):
+    """{(token_type, token)} for a Visitor Register (document or dict)"""
+    tokens = set()
+    for field in SEARCH_NAME_FIELDS:
+        for word in normalize_words(visitor.get(field)):
+            tokens.add(("word", word[:MAX_TOKEN_LENGTH]))
+            tokens.update(("trigram", trigram) for trigram in get_trigrams(word))
+
+    for field in ("thai_national_id", "passport_number"):
+        hashed = hash_id(visitor.get(field))
+        if hashed:
+            tokens.add(("id", hashed))
+
+    phone = normalize_phone(visitor.get("phone_number"))
+    if phone:
+        tokens.add(("phone", phone[:MAX_TOKEN_LENGTH]))
+        tokens.add(("phone_suffix", phone[-4:]))
+
+    return tokens
+
+
+def index_visitors(visitors):
+    """Replace the search tokens of the given visitors (same transaction as the caller)"""
+    if not visitors:
+        return
+
+    frappe.db.delete("Visitor Search Token", {"visitor_register": ["in", [v.get("name") for v in visitors]]})
+
+    values = []
+    for visitor in visitors:
+        for token_type, token in get_search_tokens(visitor):
+            values.append([frappe.generate_hash(length=10), visitor.get("name"), token_type, token])
+    if values:
+        frappe.db.bulk_insert("Visitor Search Token", ["name", "visitor_register", "token_type", "token"], values)
+
+
+def update_search_index(doc):
+    """Re-index a Visitor Register when one of the searchable fields changed (called from on_update)"""
+    if any(doc.has_value_changed(field) for field in SEARCH_FIELDS):
+        index_visitors([doc])
+
+
+def remove_from_search_index(visitor_id):
+    frappe.db.delete("Visitor Search Token", {"visitor_register": visitor_id})
+
+
+def rebuild_search_index():
+    """Re-index every Visitor Register in chunks"""
+    last_name = ""
+    while True:
+        visitors = frappe.get_all("Visitor Register",
+            filters={"name": [">", last_name]},
+            fields=["name", *SEARCH_FIELDS],
+            order_by="name asc",
+            limit=REBUILD_CHUNK_SIZE
+        )
+        if not visitors:
+            break
+        index_visitors(visitors)
+        frappe.db.commit()
+        last_name = visitors[-1].name
+
+
+def _match_tokens(token_type, tokens):
+    if not tokens:
+        return []
+    return [row[0] for row in frappe.db.sql("""
+        select distinct visitor_register from `tabVisitor Search Token`
+        where token_type = %s and token in %s
+        limit %s
+    """, (token_type, tuple(tokens), MAX_CANDIDATES))]
+
+
+def _match_prefix(token_type, prefix):
+    return [row[0] for row in frappe.db.sql("""
+        select distinct visitor_register from `tabVisitor Search Token`
+        where token_type = %s and token like %s
+        limit %s
+    """, (token_type, f"{prefix}%", MAX_CANDIDATES))]
+
+
+def _match_fuzzy(words):
+    trigrams = set()
+    for word in words:
+        trigrams |= get_trigrams(word)
+    required = max(1, math.ceil(len(trigrams) * FUZZY_THRESHOLD))
+
+    return {row[0]: row[1] / len(trigrams) for row in frappe.db.sql("""
+        select visitor_register, count(*) as matches from `tabVisitor Search Token`
+        where token_type = 'trigram' and token in %s
+        group by visitor_register
+        having matches >= %s
+        order by matches desc
+        limit %s
+    """, (tuple(trigrams), required, MAX_CANDIDATES))}
+
+
+@frappe.whitelist()
+def search_visitors(query, page_length=20):
+    """
+    Search visitors by partial name, national ID, passport or phone number
+    ชื่อค้นหาแบบ prefix ก่อน ถ้าไม่พบจึงค้นหาแบบสะกดใกล้เคียง (trigram)
+    เลขบัตรประชาชน / เลขหนังสือเดินทางต้องตรงทั้งหมด
+    """
+    frappe.has_permission("Visitor Register", "read", throw=True)
+
+    page_length = min(max(cint(page_length), 1), MAX_PAGE_LENGTH)
+    query = (query or "").strip()
+    compact = re.sub(r"[\s-]", "", query)
+    if len(compact) < 2:
+        return {"success": True, "results": []}
+
+    scores = {}
+
+    def add(visitor_ids, score):
+        for visitor_id in visitor_ids:
+            scores[visitor_id] = scores.get(visitor_id, 0) + score
+
+    if re.fullmatch(r"[0-9A-Za-z]+", compact) and any(ch.isdigit() for ch in compact):
+        add(_match_tokens("id", [hash_id(compact)]), 100)
+
+    if compact.isdigit():
+        add(_match_prefix("phone", compact), 50)
+        if len(compact) == 4:
+            add(_match_tokens("phone_suffix", [compact]), 40)
+    else:
+        words = normalize_words(query)
+        for word in words:
+            add(_match_tokens("word", [word]), 5)
+            add(_match_prefix("word", word), 10)
+
+        if words and len(scores) < page_length:
+            for visitor_id, similarity in _match_fuzzy(words).items():
+                scores[visitor_id] = scores.get(visitor_id, 0) + 10 * similarity
+
+    if not scores:
+        return {"success": True, "results": []}
+
+    visitors = frappe.get_all("Visitor Register",
+        filters={"name": ["in", list(scores)]},
+        fields=SEARCH_RESULT_FIELDS
+    )
+    visitors.sort(key=lambda v: (scores[v.name], str(v.visit_date or "")), reverse=True)
+
+    return {"success": True, "results": visitors[:page_length]}
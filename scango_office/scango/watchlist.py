@@ -0,0 +1,144 @@
+# Visitor watchlist
+#
+# รายชื่อเฝ้าระวัง (Visitor Watchlist) ถูกโหลดเป็น hash index ใน memory ของแต่ละ process
+#   ids    - sha256 ของเลขบัตรประชาชน / เลขหนังสือเดินทาง
+#   names  - ชื่อ + นามสกุลที่ normalize แล้ว (แบบเดียวกับดัชนีค้นหา)
+# การตรวจจึงเป็นแค่การเปิด dict ไม่มี query หรือ round trip ต่อการสแกน
+#
+# เมื่อรายชื่อเปลี่ยน version ใน Redis จะถูกเปลี่ยน แต่ละ process ตรวจ version ไม่บ่อยกว่า
+# VERSION_CHECK_INTERVAL วินาที แล้วโหลดใหม่เมื่อ version ไม่ตรง (process ที่แก้ไขจะล้าง cache ทันที)
+
+import time
+
+import frappe
+from frappe.utils import getdate, today
+
+from scango_office.scango.cache_errors import log_cache_error
+from scango_office.scango.visitor_search import hash_id, normalize_words
+
+WATCHLIST_VERSION_KEY = "scango:watchlist_version"
+VERSION_CHECK_INTERVAL = 5
+
+DENY = "Deny"
+FLAG = "Flag"
+
+WATCHLIST_ALERT_EVENT = "scango_watchlist_alert"
+# ผู้ที่ได้รับแจ้งเตือนเมื่อพบผู้เยี่ยมชมในรายชื่อเฝ้าระวังที่ประตู
+WATCHLIST_ALERT_ROLES = ("Security Guard", "System Manager")
+
+# {site: {"version", "checked_at", "ids", "names"}}
+_watchlist_cache = {}
+
+
+def get_name_key(first_name, last_name):
+    words = normalize_words(first_name) + normalize_words(last_name)
+    return " ".join(words) if len(words) > 1 else None
+
+
+def get_watchlist_index():
+    site = frappe.local.site
+    now = time.monotonic()
+
+    cached = _watchlist_cache.get(site)
+    if cached and now - cached["checked_at"] < VERSION_CHECK_INTERVAL:
+        return cached
+
+    version = get_watchlist_version()
+    if cached and version is not None and cached["version"] == version:
+        cached["checked_at"] = now
+        return cached
+
+    index = load_watchlist_index()
+    index.update(version=version, checked_at=now)
+    _watchlist_cache[site] = index
+    return index
+
+
+def get_watchlist_version():
+    try:
+        return frappe.cache.get_value(WATCHLIST_VERSION_KEY) or 0
+    except Exception:
+        # Redis ใช้งานไม่ได้ - โหลดจากฐานข้อมูลทุกรอบการตรวจ version
+        return None
+
+
+def load_watchlist_index():
+    ids = {}
+    names = {}
+    for row in frappe.get_all("Visitor Watchlist",
+        filters={"enabled": 1},
+        or_filters=[["valid_until", "is", "not set"], ["valid_until", ">=", today()]],
+        fields=["name", "first_name", "last_name", "thai_national_id", "passport_number",
+                "watchlist_action", "valid_until", "reason"]
+    ):
+        entry = frappe._dict({
+            "name": row.name,
+            "action": row.watchlist_action,
+            "reason": row.reason,
+            "valid_until": getdate(row.valid_until) if row.valid_until else None,
+        })
+        for value in (row.thai_national_id, row.passport_number):
+            hashed = hash_id(value)
+            if hashed:
+                ids.setdefault(hashed, []).append(entry)
+        name_key = get_name_key(row.first_name, row.last_name)
+        if name_key:
+            names.setdefault(name_key, []).append(entry)
+
+    return {"ids": ids, "names": names}
+
+
+def match_watchlist(visitor):
+    """
+    Match a visitor (document or dict) against the watchlist
+    คืนค่า entry (name, action, reason) โดยให้ Deny มาก่อน Flag หรือ None ถ้าไม่พบ
+    """
+    index = get_watchlist_index()
+    if not (index["ids"] or index["names"]):
+        return None
+
+    entries = []
+    for field in ("thai_national_id", "passport_number"):
+        hashed = hash_id(visitor.get(field))
+        if hashed:
+            entries += index["ids"].get(hashed, [])
+    name_key = get_name_key(visitor.get("first_name"), visitor.get("last_name"))
+    if name_key:
+        entries += index["names"].get(name_key, [])
+
+    today_date = getdate(today())
+    entries = [entry for entry in entries if not entry.valid_until or entry.valid_until >= today_date]
+    if not entries:
+        return None
+    return next((entry for entry in entries if entry.action == DENY), entries[0])
+
+
+def get_watchlist_message(entry):
+    if entry.action == DENY:
+        return "ผู้เยี่ยมชมอยู่ในรายชื่อห้ามเข้า กรุณาติดต่อเจ้าหน้าที่"
+    return "ผู้เยี่ยมชมอยู่ในรายชื่อเฝ้าระวัง กรุณาตรวจสอบ"
+
+
+def publish_watchlist_alert(visitor_id, entry, gate_machine=None):
+    """Notify guard desks right away that a watchlisted visitor was seen"""
+    from frappe.utils.user import get_users_with_role
+
+    # ส่งถึงผู้ใช้ตาม role โดยตรง (ไม่ต้องเปิดหน้าใดค้างไว้) และไม่ส่งเหตุผล
+    # ไม่รอ commit เพราะการสแกนที่ถูกปฏิเสธ (Deny) ไม่มีการบันทึกใด ๆ
+    users = {user for role in WATCHLIST_ALERT_ROLES for user in get_users_with_role(role)}
+    for user in users:
+        frappe.publish_realtime(WATCHLIST_ALERT_EVENT, {
+            "visitor": visitor_id,
+            "watchlist": entry.name,
+            "action": entry.action,
+            "gate_machine": gate_machine,
+        }, user=user)
+
+
+def clear_watchlist_cache():
+    """Reload the watchlist on every worker (called from Visitor Watchlist on_update / on_trash)"""
+    _watchlist_cache.pop(frappe.local.site, None)
+    try:
+        frappe.cache.set_value(WATCHLIST_VERSION_KEY, frappe.generate_hash(length=10))
+    except Exception as e:
+        log_cache_error("Watchlist Cache Error", e)
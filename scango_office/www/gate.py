@@ -1,5 +1,8 @@
 import frappe
 
+from scango_office.scango.gate_topology import get_gate_topology
+from scango_office.scango.scan_debounce import get_debounce_seconds
+
 def get_context(context):
 
     machine_name = frappe.form_dict.get('name')
@@ -7,9 +10,10 @@ def get_context(context):
     try :
         if machine_name :
             context.machine_name  = machine_name
-            machine = frappe.get_doc("Machine Gate",machine_name)
+            machine = get_gate_topology(machine_name)
 
             if machine : 
                 context.machine = machine
+                context.scan_debounce_seconds = get_debounce_seconds()
     except Exception as e :
         context.error = str(e)
\ No newline at end of file
@@ -1,6 +1,10 @@
 import frappe
 from frappe.utils import getdate, date_diff, now_datetime
 
+from scango_office.scango.gate_topology import get_gate_topology
+from scango_office.scango.qr_payload import get_qr_visitor_id
+from scango_office.scango.scan_metrics import ScanTimer
+
 def get_context(context):
     """QR Scanner - ตรวจสอบและบันทึก Gate Pass ตาม Machine Gate"""
     context.no_cache = 1
@@ -14,14 +18,23 @@ def get_context(context):
         context.error_message = "กรุณาสแกน QR Code ที่ถูกต้อง"
         return context
     
+    # QR แบบ signed: ตรวจลายเซ็นแล้วใช้ visitor ID ที่อยู่ใน QR (visitor ID ล้วน ๆ ใช้ไม่ได้เมื่อบังคับใช้ signed)
+    visitor_id = get_qr_visitor_id(visitor_id)
+    if not visitor_id:
+        context.error = "QR Code ไม่ถูกต้อง"
+        context.error_message = "กรุณาสแกน QR Code ที่ถูกต้อง"
+        return context
+    
     if not machine_id:
         context.error = "ไม่พบข้อมูลเครื่อง"
         context.error_message = "กรุณาระบุ Machine Gate"
         return context
     
     try:
-        # ดึงข้อมูล Machine Gate
-        machine = frappe.get_doc("Machine Gate", machine_id)
+        # ดึงข้อมูล Machine Gate (จาก gate topology cache)
+        machine = get_gate_topology(machine_id)
+        if not machine:
+            raise frappe.DoesNotExistError
         
         # เช็คว่าเป็น CheckStatus หรือไม่
         if machine.use_for == "CheckStatus":
@@ -51,12 +64,17 @@ def show_qr_info(context, visitor_id, machine):
         start_date = getdate(visitor.visit_date)
         end_date = getdate(visitor.visit_end_date)
         
-        if today < start_date:
+        if visitor.visit_status == "Checked Out":
+            status = "Checkout แล้ว"
+            status_color = "red"
+            days_left = 0
+            days_text = "QR Code ถูกปิดการใช้งานถาวร"
+        elif today < start_date:
             status = "ยังไม่ถึงวันเข้า"
             status_color = "orange"
             days_left = date_diff(start_date, today)
             days_text = f"อีก {days_left} วัน"
-        elif today > end_date:
+        elif visitor.visit_status == "Expired" or today > end_date:
             status = "หมดอายุแล้ว"
             status_color = "red"
             days_left = 0
@@ -108,22 +126,26 @@ def show_qr_info(context, visitor_id, machine):
 
 def record_gate_pass(context, visitor_id, machine):
     """บันทึก Gate Pass (สำหรับ In/Out/Checkout)"""
+    timer = ScanTimer("qr_scanner", machine.name)
     try:
-        visitor = frappe.get_doc("Visitor Register", visitor_id)
+        with timer.stage("visitor"):
+            visitor = frappe.get_doc("Visitor Register", visitor_id)
         
         #สร้าง Gate Pass
-        gate_pass = frappe.get_doc({
-            "doctype": "Visitor Gate Pass",
-            "visitor_register": visitor_id,
-            "visitor_name": f"{visitor.first_name} {visitor.last_name or ''}",
-            "machine_gate": machine.name,
-            "building_gate": machine.building_gate,
-            "pass_type": machine.use_for,
-            "pass_datetime": now_datetime(),
-            "security_guard": frappe.session.user
-        })
-        gate_pass.insert(ignore_permissions=True)
-        frappe.db.commit()
+        with timer.stage("insert"):
+            gate_pass = frappe.get_doc({
+                "doctype": "Visitor Gate Pass",
+                "visitor_register": visitor_id,
+                "visitor_name": f"{visitor.first_name} {visitor.last_name or ''}",
+                "machine_gate": machine.name,
+                "building_gate": machine.building_gate,
+                "pass_type": machine.use_for,
+                "pass_datetime": now_datetime(),
+                "security_guard": frappe.session.user
+            })
+            gate_pass.insert(ignore_permissions=True)
+        with timer.stage("commit"):
+            frappe.db.commit()
         
         context.mode = "gate_pass"
         context.visitor = visitor
@@ -138,5 +160,7 @@ def record_gate_pass(context, visitor_id, machine):
         frappe.log_error(f"Gate Pass Error: {str(e)}")
         context.error = "เกิดข้อผิดพลาด"
         context.error_message = "ไม่สามารถบันทึกข้อมูลได้"
+    finally:
+        timer.finish(visitor=visitor_id)
     
     return context
\ No newline at end of file